@@ -14,7 +14,6 @@
 # limitations under the License.
 #
 
-import scipy.ndimage
 try:
     import matplotlib.pyplot as plt
 except:
@@ -22,26 +21,52 @@ except:
     failed_imports.append("matplotlib")
 
 import copy
+import threading
 from renderer import Renderer
-from configurations import Preset
+from configurations import Preset, Frameworks
 from collections import deque
 from utils import LazyStack
 from collections import OrderedDict
-from utils import RunPhase, Signal, is_empty, RunningStat
+from utils import RunPhase, Signal, is_empty, RunningStat, ReplayRatioController
 from architectures import *
 from exploration_policies import *
+from environments import create_vectorized_environment
+from image_preprocessing import *
 from memories import *
 from memories.memory import *
 from logger import logger, screen
 import random
 import time
+import atexit
 import os
 import itertools
 from architectures.tensorflow_components.shared_variables import SharedRunningStats
 from six.moves import range
 
 
+class EnvironmentStream(object):
+    """
+    The acting state of one of the environments of a vectorized environment. The transitions of the current episode are
+    kept in the stream until the episode ends, so that the memory receives the episodes of the different environments
+    one after the other.
+    """
+    def __init__(self, env_idx, curr_state, curr_stack):
+        self.env_idx = env_idx
+        self.curr_state = curr_state
+        self.curr_stack = curr_stack
+        self.episode = Episode()
+        self.total_reward = 0
+        self.steps_counter = 0
+        # the action info of the action which the environment is performing
+        self.action_info = None
+
+
 class Agent(object):
+    # agents which support acting on several environments with a single batched action choice
+    supports_vectorized_acting = False
+    # agents which support acting on one thread while training on another
+    supports_decoupled_acting = False
+
     def __init__(self, env, tuning_parameters, replicated_device=None, task_id=0):
         """
         :param env: An environment instance
@@ -64,18 +89,75 @@ class Agent(object):
         if not tuning_parameters.env.desired_observation_width or not tuning_parameters.env.desired_observation_height:
             tuning_parameters.env.desired_observation_width = self.env.width
             tuning_parameters.env.desired_observation_height = self.env.height
+        if tuning_parameters.env.preprocess_observation_in_graph:
+            assert tuning_parameters.framework == Frameworks.TensorFlow, \
+                'Preprocessing the observations in the graph requires TensorFlow'
+            # the network gets the raw observations
+            tuning_parameters.env.raw_observation_shape = np.asarray(self.env.state['observation']).shape
+        self.image_preprocessor = eval(tuning_parameters.image_preprocessor)(
+            tuning_parameters.env.desired_observation_height, tuning_parameters.env.desired_observation_width,
+            tuning_parameters.rescaling_interpolation_type)
         self.action_space_size = tuning_parameters.env.action_space_size = self.env.action_space_size
         self.measurements_size = tuning_parameters.env.measurements_size = self.env.measurements_size
         if tuning_parameters.agent.use_accumulated_reward_as_measurement:
             self.measurements_size = tuning_parameters.env.measurements_size = (self.measurements_size[0] + 1,)
 
         # modules
-        if tuning_parameters.agent.load_memory_from_file_path:
+        # protects the memory when it is sampled or loaded by a background thread
+        self.memory_lock = threading.Lock()
+        self.batch_prefetcher = None
+        self.memory_loading_thread = None
+        if tuning_parameters.agent.load_memory_from_file_path and \
+                is_chunked_replay_buffer(tuning_parameters.agent.load_memory_from_file_path):
+            screen.log_title("Loading replay buffer from chunks. Replay buffer path: {}"
+                             .format(tuning_parameters.agent.load_memory_from_file_path))
+            self.memory = eval(tuning_parameters.memory + '(tuning_parameters)')
+            reader = ChunkedReplayBufferReader(tuning_parameters.agent.load_memory_from_file_path,
+                                               tuning_parameters.agent.num_memory_loading_threads)
+            self.memory_loading_thread = reader.load_into(self.memory, self.memory_lock,
+                                                          background=tuning_parameters.agent.load_memory_in_background)
+        elif tuning_parameters.agent.load_memory_from_file_path:
             screen.log_title("Loading replay buffer from pickle. Pickle path: {}"
                              .format(tuning_parameters.agent.load_memory_from_file_path))
             self.memory = read_pickle(tuning_parameters.agent.load_memory_from_file_path)
         else:
             self.memory = eval(tuning_parameters.memory + '(tuning_parameters)')
+        self.batch_buffers = BatchBuffers()
+        if tuning_parameters.agent.rnn_sequence_length is not None:
+            # the batches are made of whole sequences which add up to the batch size
+            self.rnn_sequence_length = tuning_parameters.agent.rnn_burn_in_steps + \
+                tuning_parameters.agent.rnn_sequence_length
+            assert tuning_parameters.agent.middleware_type == MiddlewareTypes.LSTM, \
+                'Training on sequences requires an LSTM middleware'
+            assert tuning_parameters.batch_size % self.rnn_sequence_length == 0, \
+                'The batch size should be a multiple of the sequence length (including the burn in steps)'
+            assert tuning_parameters.prefetch_batches == 0, 'Sequence batches can not be prefetched'
+        if tuning_parameters.agent.store_rnn_states:
+            assert tuning_parameters.agent.middleware_type == MiddlewareTypes.LSTM, \
+                'Storing the LSTM states requires an LSTM middleware'
+        self.vectorized_env = None
+        self.env_streams = None
+        if tuning_parameters.num_envs_per_worker > 1:
+            assert self.supports_vectorized_acting, \
+                '{} does not support acting on several environments'.format(self.__class__.__name__)
+            assert tuning_parameters.agent.middleware_type != MiddlewareTypes.LSTM, \
+                'Acting on several environments is not supported with an LSTM middleware'
+            self.vectorized_env = create_vectorized_environment(tuning_parameters, env)
+            if tuning_parameters.environment_pool_mode is not None:
+                # the environment subprocesses are stopped when the worker exits
+                atexit.register(self.vectorized_env.close)
+        if tuning_parameters.decoupled_acting_and_training:
+            assert self.supports_decoupled_acting, \
+                '{} does not support acting and training on separate threads'.format(self.__class__.__name__)
+            assert tuning_parameters.agent.middleware_type != MiddlewareTypes.LSTM, \
+                'Acting and training on separate threads is not supported with an LSTM middleware'
+            assert tuning_parameters.train and tuning_parameters.agent.collect_new_data, \
+                'Acting and training on separate threads requires both training and collecting new data'
+        # held by the acting thread while it chooses actions. when acting and training run on separate threads, the
+        # networks share it for updating their weights
+        self.weights_lock = threading.RLock()
+        self.replay_ratio_controller = None
+        self.last_target_network_update_period = 0
         # self.architecture = eval(tuning_parameters.architecture)
 
         self.has_global = replicated_device is not None
@@ -112,6 +194,18 @@ class Agent(object):
         self.signals.append(self.loss)
         self.curr_learning_rate = Signal('Learning Rate')
         self.signals.append(self.curr_learning_rate)
+        if self.tp.decoupled_acting_and_training:
+            self.measured_replay_ratio = Signal('Replay Ratio')
+            self.signals.append(self.measured_replay_ratio)
+        if self.tp.prefetch_batches > 0:
+            self.prefetch_queue_occupancy = Signal('Prefetch Queue Occupancy')
+            self.signals.append(self.prefetch_queue_occupancy)
+            self.prefetch_wait_time = Signal('Prefetch Wait Time')
+            self.signals.append(self.prefetch_wait_time)
+        # memories that report their own signals (memories loaded from a pickle might not have any)
+        self.signals.extend(getattr(self.memory, 'signals', []))
+        # environment pools report the timing of their environments
+        self.signals.extend(getattr(self.vectorized_env, 'signals', []))
 
         if self.tp.env.normalize_observation and not self.env.is_state_type_image:
             if not self.tp.distributed or not self.tp.agent.share_statistics_between_workers:
@@ -124,6 +218,20 @@ class Agent(object):
                 self.running_reward_stats = SharedRunningStats(self.tp, replicated_device,
                                                                shape=(),
                                                                name='reward_stats')
+            if self.tp.env.preprocess_observation_in_graph and \
+                    not isinstance(self.running_observation_stats, SharedRunningStats):
+                # the observations are normalized by the network, so the statistics are kept in the graph
+                self.running_observation_stats = SharedRunningStats(self.tp, replicated_device,
+                                                                    shape=(self.tp.env.desired_observation_width,),
+                                                                    name='observation_stats')
+            tuning_parameters.running_observation_stats = self.running_observation_stats
+
+        # shared statistics are synced with the other workers on each training iteration, and report their sync rate
+        self.shared_running_stats = [stats for stats in [getattr(self, 'running_observation_stats', None),
+                                                         getattr(self, 'running_reward_stats', None)]
+                                     if isinstance(stats, SharedRunningStats)]
+        for stats in self.shared_running_stats:
+            self.signals.extend(stats.signals)
 
         # env is already reset at this point. Otherwise we're getting an error where you cannot
         # reset an env which is not done
@@ -180,6 +288,8 @@ class Agent(object):
             logger.create_signal_value("{}/Stdev".format(signal.name), signal.get_stdev())
             logger.create_signal_value("{}/Max".format(signal.name), signal.get_max())
             logger.create_signal_value("{}/Min".format(signal.name), signal.get_min())
+            for percentile in signal.percentiles:
+                logger.create_signal_value("{}/P{}".format(signal.name, percentile), signal.get_percentile(percentile))
 
         # dump
         if self.current_episode % self.tp.visualization.dump_signals_to_csv_every_x_episodes == 0 \
@@ -227,16 +337,15 @@ class Agent(object):
         :return: A processed version of the observation
         """
 
-        if self.env.is_state_type_image:
-            # rescale
-            observation = scipy.misc.imresize(observation,
-                                              (self.tp.env.desired_observation_height,
-                                               self.tp.env.desired_observation_width),
-                                              interp=self.tp.rescaling_interpolation_type)
-            # rgb to y
-            if len(observation.shape) > 2 and observation.shape[2] > 1:
-                r, g, b = observation[:, :, 0], observation[:, :, 1], observation[:, :, 2]
-                observation = 0.2989 * r + 0.5870 * g + 0.1140 * b
+        if self.tp.env.preprocess_observation_in_graph:
+            # the network preprocesses the observation. only the normalization statistics are updated here
+            if self.tp.env.normalize_observation and not self.env.is_state_type_image and \
+                    (not self.tp.distributed or not self.tp.agent.share_statistics_between_workers):
+                self.running_observation_stats.push(np.expand_dims(observation, 0))
+            return observation
+        elif self.env.is_state_type_image:
+            # convert to grayscale and rescale
+            observation = self.image_preprocessor.preprocess(observation)
 
             # Render the processed observation which is how the agent will see it
             # Warning: this cannot currently be done in parallel to rendering the environment
@@ -245,7 +354,7 @@ class Agent(object):
                     self.renderer.create_screen(observation.shape[0], observation.shape[1])
                 self.renderer.render_image(observation)
 
-            return observation.astype('uint8')
+            return observation
         else:
             if self.tp.env.normalize_observation:
                 # standardize the input observation using a running mean and std
@@ -269,7 +378,21 @@ class Agent(object):
         A single training iteration. Sample a batch, train on it and update target networks.
         :return: The training loss.
         """
-        batch = self.memory.sample(self.tp.batch_size)
+        if self.tp.prefetch_batches > 0:
+            if self.batch_prefetcher is None:
+                self.batch_prefetcher = BatchPrefetcher(self.memory, self.tp.batch_size, self.tp.prefetch_batches,
+                                                        self.memory_lock, self.tp.agent.use_measurements)
+            batch, queue_occupancy, wait_time = self.batch_prefetcher.get()
+            self.prefetch_queue_occupancy.add_sample(queue_occupancy)
+            self.prefetch_wait_time.add_sample(wait_time)
+        elif self.tp.agent.rnn_sequence_length is not None:
+            with self.memory_lock:
+                batch = self.memory.sample_sequences(self.tp.batch_size // self.rnn_sequence_length,
+                                                     self.tp.agent.rnn_sequence_length,
+                                                     self.tp.agent.rnn_burn_in_steps)
+        else:
+            with self.memory_lock:
+                batch = self.memory.sample(self.tp.batch_size)
         loss = self.learn_from_batch(batch)
 
         if self.tp.learning_rate_decay_rate != 0:
@@ -278,7 +401,7 @@ class Agent(object):
             self.curr_learning_rate.add_sample(self.tp.learning_rate)
 
         # update the target network of every network that has a target network
-        if self.total_steps_counter % self.tp.agent.num_steps_between_copying_online_weights_to_target == 0:
+        if self.is_target_network_update_step():
             for network in self.networks:
                 network.update_target_network(self.tp.agent.rate_for_copying_weights_to_target)
             logger.create_signal_value('Update Target Network', 1)
@@ -287,27 +410,44 @@ class Agent(object):
 
         return loss
 
+    def is_target_network_update_step(self):
+        """
+        :return: True if the target networks should be updated in the current training step
+        """
+        interval = self.tp.agent.num_steps_between_copying_online_weights_to_target
+        if interval <= 1:
+            # soft updates are applied on every training step
+            return True
+
+        # the steps counter is advanced by the number of environments which were stepped together, and by the acting
+        # thread when acting and training run on separate threads, so it can pass a multiple of the interval without
+        # being equal to it. the target networks are updated once for each period of the interval which it enters
+        target_network_update_period = self.total_steps_counter // interval
+        if target_network_update_period > self.last_target_network_update_period:
+            self.last_target_network_update_period = target_network_update_period
+            return True
+        return False
+
     def extract_batch(self, batch):
         """
-        Extracts a single numpy array for each object in a batch of transitions (state, action, etc.)
-        :param batch: An array of transitions
+        Extracts a single numpy array for each object in a batch of transitions (state, action, etc.).
+        The arrays are written to buffers which are reused by the next call, so they should not be kept across
+        training iterations.
+        :param batch: An array of transitions or a ColumnarBatch
         :return: For each transition element, returns a numpy array of all the transitions in the batch
         """
-        current_states = {}
-        next_states = {}
-        current_states['observation'] = np.array([np.array(transition.state['observation']) for transition in batch])
-        next_states['observation'] = np.array([np.array(transition.next_state['observation']) for transition in batch])
-        actions = np.array([transition.action for transition in batch])
-        rewards = np.array([transition.reward for transition in batch])
-        game_overs = np.array([transition.game_over for transition in batch])
-        total_return = np.array([transition.total_return for transition in batch])
-
-        # get the entire state including measurements if available
-        if self.tp.agent.use_measurements:
-            current_states['measurements'] = np.array([transition.state['measurements'] for transition in batch])
-            next_states['measurements'] = np.array([transition.next_state['measurements'] for transition in batch])
-
-        return current_states, next_states, actions, rewards, game_overs, total_return
+        if isinstance(batch, ColumnarBatch):
+            # the batch was already gathered into arrays by the memory
+            state_keys = ['observation', 'measurements'] if self.tp.agent.use_measurements else ['observation']
+            current_states = {key: batch.states[key] for key in state_keys}
+            next_states = {key: batch.next_states[key] for key in state_keys}
+            if isinstance(batch, SequenceBatch):
+                # the next states are fed as sequences as well, starting from the same initial lstm state
+                current_states.update(batch.rnn_inputs)
+                next_states.update(batch.rnn_inputs)
+            return current_states, next_states, batch.actions, batch.rewards, batch.game_overs, batch.total_returns
+
+        return self.batch_buffers.extract(batch, self.tp.agent.use_measurements)
 
     def plot_action_values_online(self):
         """
@@ -332,6 +472,17 @@ class Agent(object):
         """
         pass
 
+    def choose_actions(self, curr_states, phase=RunPhase.TRAIN):
+        """
+        choose an action for each of a batch of states, which come from different environments. The states are handled
+        one by one, and agents which can choose the actions of a batch with a single network call override this.
+
+        :param curr_states: a list of states to act upon.
+        :param phase: the current phase: training or testing.
+        :return: a list of the chosen action and its action info for each of the states
+        """
+        return [self.choose_action(curr_state, phase=phase) for curr_state in curr_states]
+
     def preprocess_reward(self, reward):
         if self.tp.env.reward_scaling:
             reward /= float(self.tp.env.reward_scaling)
@@ -352,22 +503,65 @@ class Agent(object):
             input_state[input_name] = np.expand_dims(np.array(curr_state[input_name]), 0)
         return input_state
         
+    def tf_input_states(self, curr_states):
+        """
+        convert a list of states into batched input tensors tensorflow is expecting.
+        """
+        input_state = {}
+        for input_name in self.tp.agent.input_types.keys():
+            input_state[input_name] = np.stack([np.array(curr_state[input_name]) for curr_state in curr_states])
+        return input_state
+
     def prepare_initial_state(self):
         """
         Create an initial state when starting a new episode
         :return: None
         """
-        observation = self.preprocess_observation(self.env.state['observation'])
-        self.curr_stack = deque([observation]*self.tp.env.observation_stack_size, maxlen=self.tp.env.observation_stack_size)
-        observation = LazyStack(self.curr_stack, -1)
+        self.curr_state, self.curr_stack = self._initial_state(self.env)
+
+    def _initial_state(self, env):
+        """
+        Create the initial state of an episode of an environment
+        :param env: the environment, after it was reset
+        :return: the state and the stack of its observations
+        """
+        observation = self._preprocess_env_observation(env.state['observation'])
+        curr_stack = deque([observation]*self.tp.env.observation_stack_size, maxlen=self.tp.env.observation_stack_size)
+        observation = LazyStack(curr_stack, -1)
 
-        self.curr_state = {
+        curr_state = {
             'observation': observation
         }
         if self.tp.agent.use_measurements:
-            self.curr_state['measurements'] = self.env.measurements
+            curr_state['measurements'] = env.measurements
             if self.tp.agent.use_accumulated_reward_as_measurement:
-                self.curr_state['measurements'] = np.append(self.curr_state['measurements'], 0)
+                curr_state['measurements'] = np.append(curr_state['measurements'], 0)
+        return curr_state, curr_stack
+
+    def _preprocess_env_observation(self, observation):
+        """
+        Preprocess an observation which might be a view of a buffer that the environment writes to again, like the
+        observations of a SubprocessEnvironmentPool
+        :param observation: the observation
+        :return: a processed version of the observation, which doesn't share memory with the environment
+        """
+        processed_observation = self.preprocess_observation(observation)
+        if processed_observation is observation:
+            processed_observation = np.array(observation)
+        return processed_observation
+
+    def _preprocess_env_observations(self, observations):
+        """
+        Preprocess the observations of several environments, like _preprocess_env_observation. Image observations are
+        preprocessed as a single batch
+        :param observations: a list of observations
+        :return: a list of processed observations, which don't share memory with the environments
+        """
+        if self.env.is_state_type_image and not self.tp.env.preprocess_observation_in_graph and \
+                not self.tp.visualization.render_observation and len(observations) > 1:
+            # each of the observations is copied out of the batch, since they are kept by different episodes
+            return [observation.copy() for observation in self.image_preprocessor.preprocess_batch(observations)]
+        return [self._preprocess_env_observation(observation) for observation in observations]
 
     def act(self, phase=RunPhase.TRAIN):
         """
@@ -383,10 +577,16 @@ class Agent(object):
         # get new action
         action_info = {"action_probability": 1.0 / self.env.action_space_size, "action_value": 0, "max_action_value": 0}
 
+        if self.tp.agent.store_rnn_states:
+            # the lstm state before choosing the action initializes the training sequences which start here
+            online_network = self.networks[0].online_network
+            rnn_state = np.concatenate([online_network.curr_rnn_c_in, online_network.curr_rnn_h_in], axis=-1)[0]
+
         if phase == RunPhase.HEATUP and not self.tp.heatup_using_network_decisions:
             action = self.env.get_random_action()
         else:
-            action, action_info = self.choose_action(self.curr_state, phase=phase)
+            with self.weights_lock:
+                action, action_info = self.choose_action(self.curr_state, phase=phase)
 
         # perform action
         if type(action) == np.ndarray:
@@ -423,7 +623,10 @@ class Agent(object):
                 transition.info[key] = action_info[key]
             if self.tp.agent.add_a_normalized_timestep_to_the_observation:
                 transition.info['timestep'] = float(self.current_episode_steps_counter) / self.env.timestep_limit
-            self.memory.store(transition)
+            if self.tp.agent.store_rnn_states:
+                transition.info['rnn_state'] = rnn_state
+            with self.memory_lock:
+                self.memory.store(transition)
         elif phase == RunPhase.TEST and self.tp.visualization.dump_gifs:
             # we store the transitions only for saving gifs
             self.last_episode_images.append(self.env.get_rendered_image())
@@ -446,6 +649,108 @@ class Agent(object):
         # return episode really ended
         return result['done']
 
+    def act_vectorized(self, phase=RunPhase.TRAIN):
+        """
+        Take one step in each of the environments of the vectorized environment which are ready for an action, with a
+        single batched action choice. The transitions of each environment are stored in memory as a separate stream of
+        episodes.
+        :param phase: Either Train or Heatup
+        :return: The number of environment steps which were taken
+        """
+        if self.env_streams is None:
+            self.env_streams = [EnvironmentStream(env_idx, *self._initial_state(env))
+                                for env_idx, env in enumerate(self.vectorized_env.envs)]
+
+        # get new actions
+        env_indices = self.vectorized_env.ready_env_indices
+        streams = [self.env_streams[env_idx] for env_idx in env_indices]
+        if phase == RunPhase.HEATUP and not self.tp.heatup_using_network_decisions:
+            actions = [self.env.get_random_action() for _ in streams]
+            actions_info = [{"action_probability": 1.0 / self.env.action_space_size, "action_value": 0,
+                             "max_action_value": 0} for _ in streams]
+        else:
+            with self.weights_lock:
+                actions, actions_info = zip(*self.choose_actions([stream.curr_state for stream in streams],
+                                                                 phase=phase))
+        for stream, action_info in zip(streams, actions_info):
+            stream.action_info = action_info
+
+        # perform the actions. environments which run asynchronously return the results of the environments which
+        # finished their step first, which are not necessarily the ones which were just sent an action
+        actions = [action.squeeze() if type(action) == np.ndarray else action for action in actions]
+        self.vectorized_env.send(env_indices, actions)
+        results = self.vectorized_env.receive()
+        self.total_steps_counter += len(results)
+
+        next_observations = self._preprocess_env_observations([result['state']['observation'] for _, result in results])
+        for (env_idx, result), next_observation in zip(results, next_observations):
+            stream = self.env_streams[env_idx]
+            action_info = stream.action_info
+            stream.steps_counter += 1
+            shaped_reward = self.preprocess_reward(result['reward'])
+            if 'action_intrinsic_reward' in action_info.keys():
+                shaped_reward += action_info['action_intrinsic_reward']
+            stream.total_reward += result['reward']
+            next_state = result['state']
+            stream.curr_stack.append(next_observation)
+            next_state['observation'] = LazyStack(stream.curr_stack, -1)
+            if self.tp.agent.use_measurements and 'measurements' in result.keys():
+                next_state['measurements'] = result['state']['measurements']
+                if self.tp.agent.use_accumulated_reward_as_measurement:
+                    next_state['measurements'] = np.append(next_state['measurements'], stream.total_reward)
+
+            transition = Transition(stream.curr_state, result['action'], shaped_reward, next_state, result['done'])
+            for key in action_info.keys():
+                transition.info[key] = action_info[key]
+            if self.tp.agent.add_a_normalized_timestep_to_the_observation:
+                transition.info['timestep'] = float(stream.steps_counter) / self.env.timestep_limit
+            stream.episode.insert(transition)
+            stream.curr_state = next_state
+
+            if result['done']:
+                self._end_stream_episode(stream, phase)
+
+        return len(results)
+
+    def _end_stream_episode(self, stream, phase):
+        """
+        Store the episode of an environment stream in memory, log it and start a new episode in the environment
+        """
+        with self.memory_lock:
+            for transition in stream.episode.transitions:
+                self.memory.store(transition)
+
+        # the episode is logged as if it was played by the single environment of the agent
+        self.total_reward_in_current_episode = stream.total_reward
+        self.current_episode_steps_counter = stream.steps_counter
+        if self.tp.visualization.dump_csv:
+            self.update_log(phase=phase)
+        self.log_to_screen(phase=phase)
+        for signal in self.signals:
+            signal.reset()
+        self.exploration_policy.reset()
+
+        self.current_episode += 1
+        self.tp.current_episode = self.current_episode
+
+        self.vectorized_env.reset(stream.env_idx)
+        self._reset_env_stream(stream.env_idx)
+
+    def _reset_env_stream(self, env_idx):
+        """
+        Start a new episode in an environment stream, after its environment was reset. The transitions of the previous
+        episode which were not stored yet are dropped.
+        """
+        if self.env_streams is not None:
+            self.env_streams[env_idx] = EnvironmentStream(env_idx,
+                                                          *self._initial_state(self.vectorized_env.envs[env_idx]))
+
+    def _restart_first_env_stream(self):
+        # the first environment of a vectorized environment is also the environment of the single environment acting,
+        # so its stream is restarted whenever the single environment acting resets it
+        if self.vectorized_env is not None and self.vectorized_env.envs[0] is self.env:
+            self._reset_env_stream(0)
+
     def evaluate(self, num_episodes, keep_networks_synced=False):
         """
         Run in an evaluation mode for several episodes. Actions will be chosen greedily.
@@ -507,8 +812,14 @@ class Agent(object):
             self.in_heatup = True
             screen.log_title("Starting heatup {}".format(self.task_id))
             num_steps_required_for_one_training_batch = self.tp.batch_size * self.tp.env.observation_stack_size
-            for step in range(max(self.tp.num_heatup_steps, num_steps_required_for_one_training_batch)):
-                self.act(phase=RunPhase.HEATUP)
+            num_heatup_steps = max(self.tp.num_heatup_steps, num_steps_required_for_one_training_batch)
+            if self.vectorized_env is not None:
+                step = 0
+                while step < num_heatup_steps:
+                    step += self.act_vectorized(phase=RunPhase.HEATUP)
+            else:
+                for step in range(num_heatup_steps):
+                    self.act(phase=RunPhase.HEATUP)
 
         # training phase
         self.in_heatup = False
@@ -517,48 +828,144 @@ class Agent(object):
         training_start_time = time.time()
         model_snapshots_periods_passed = -1
         self.reset_game()
+        self._restart_first_env_stream()
+
+        if self.tp.decoupled_acting_and_training:
+            self.act_and_train_concurrently(training_start_time)
+            return
 
         while self.training_iteration < self.tp.num_training_iterations:
-            # evaluate
-            evaluate_agent = (self.last_episode_evaluation_ran is not self.current_episode) and \
-                             (self.current_episode % self.tp.evaluate_every_x_episodes == 0)
-            evaluate_agent = evaluate_agent or \
-                             (self.imitation and self.training_iteration > 0 and
-                              self.training_iteration % self.tp.evaluate_every_x_training_iterations == 0)
-
-            if evaluate_agent:
-                self.env.reset(force_environment_reset=True)
-                self.last_episode_evaluation_ran = self.current_episode
-                self.evaluate(self.tp.evaluation_episodes)
-
-            # snapshot model
-            if self.tp.save_model_sec and self.tp.save_model_sec > 0 and not self.tp.distributed:
-                total_training_time = time.time() - training_start_time
-                current_snapshot_period = (int(total_training_time) // self.tp.save_model_sec)
-                if current_snapshot_period > model_snapshots_periods_passed:
-                    model_snapshots_periods_passed = current_snapshot_period
-                    self.save_model(model_snapshots_periods_passed)
+            self.evaluate_if_needed()
+            model_snapshots_periods_passed = self.save_model_if_needed(training_start_time,
+                                                                       model_snapshots_periods_passed)
 
             # play and record in replay buffer
             if self.tp.agent.collect_new_data:
-                if self.tp.agent.step_until_collecting_full_episodes:
-                    step = 0
-                    while step < self.tp.agent.num_consecutive_playing_steps or self.memory.get_episode(-1).length() != 0:
-                        self.act()
-                        step += 1
-                else:
-                    for step in range(self.tp.agent.num_consecutive_playing_steps):
-                        self.act()
+                self.play()
 
             # train
             if self.tp.train:
-                for step in range(self.tp.agent.num_consecutive_training_steps):
-                    loss = self.train()
-                    self.loss.add_sample(loss)
-                    self.training_iteration += 1
-                    if self.imitation:
-                        self.log_to_screen(RunPhase.TRAIN)
-                self.post_training_commands()
+                self.train_consecutive_steps()
+
+    def evaluate_if_needed(self):
+        """
+        Run an evaluation if the evaluation interval has passed
+        :return: None
+        """
+        evaluate_agent = (self.last_episode_evaluation_ran is not self.current_episode) and \
+                         (self.current_episode % self.tp.evaluate_every_x_episodes == 0)
+        evaluate_agent = evaluate_agent or \
+                         (self.imitation and self.training_iteration > 0 and
+                          self.training_iteration % self.tp.evaluate_every_x_training_iterations == 0)
+
+        if evaluate_agent:
+            self.env.reset(force_environment_reset=True)
+            self.last_episode_evaluation_ran = self.current_episode
+            self.evaluate(self.tp.evaluation_episodes)
+            self._restart_first_env_stream()
+
+    def save_model_if_needed(self, training_start_time, model_snapshots_periods_passed):
+        """
+        Save a snapshot of the model if the snapshot interval has passed
+        :param training_start_time: the time in which the training started
+        :param model_snapshots_periods_passed: the number of the last snapshot period in which the model was saved
+        :return: the number of the last snapshot period in which the model was saved
+        """
+        if self.tp.save_model_sec and self.tp.save_model_sec > 0 and not self.tp.distributed:
+            total_training_time = time.time() - training_start_time
+            current_snapshot_period = (int(total_training_time) // self.tp.save_model_sec)
+            if current_snapshot_period > model_snapshots_periods_passed:
+                model_snapshots_periods_passed = current_snapshot_period
+                self.save_model(model_snapshots_periods_passed)
+        return model_snapshots_periods_passed
+
+    def play(self):
+        """
+        Take the consecutive playing steps and record them in the replay buffer
+        :return: The number of environment steps which were taken
+        """
+        if self.vectorized_env is not None:
+            # the episodes are stored only when they end, so the memory never holds a partial episode
+            step = 0
+            while step < self.tp.agent.num_consecutive_playing_steps:
+                step += self.act_vectorized()
+        elif self.tp.agent.step_until_collecting_full_episodes:
+            step = 0
+            while step < self.tp.agent.num_consecutive_playing_steps or self.memory.get_episode(-1).length() != 0:
+                self.act()
+                step += 1
+        else:
+            for step in range(self.tp.agent.num_consecutive_playing_steps):
+                self.act()
+            step = self.tp.agent.num_consecutive_playing_steps
+        return step
+
+    def train_consecutive_steps(self):
+        """
+        Take the consecutive training steps
+        :return: None
+        """
+        for step in range(self.tp.agent.num_consecutive_training_steps):
+            loss = self.train()
+            self.loss.add_sample(loss)
+            self.training_iteration += 1
+            for stats in self.shared_running_stats:
+                stats.sync()
+            if self.imitation:
+                self.log_to_screen(RunPhase.TRAIN)
+        self.post_training_commands()
+
+    def act_and_train_concurrently(self, training_start_time):
+        """
+        Play on a separate thread while training on this thread, instead of alternating between them. The replay ratio
+        controller keeps the number of training steps per acting step close to the replay ratio, and the acting thread
+        chooses its actions while holding the weights lock, which the networks hold while their weights are updated.
+        :param training_start_time: the time in which the training started
+        :return: None
+        """
+        replay_ratio = self.tp.replay_ratio
+        if replay_ratio is None:
+            replay_ratio = float(self.tp.agent.num_consecutive_training_steps) / \
+                self.tp.agent.num_consecutive_playing_steps
+        max_lag = self.tp.replay_ratio_max_lag or max(self.tp.agent.num_consecutive_training_steps, 1)
+        self.replay_ratio_controller = ReplayRatioController(replay_ratio, max_lag)
+        self.last_target_network_update_period = \
+            self.total_steps_counter // self.tp.agent.num_steps_between_copying_online_weights_to_target
+        for network in self.networks:
+            network.weights_lock = self.weights_lock
+
+        acting_errors = []
+
+        def play_until_stopped():
+            try:
+                while self.replay_ratio_controller.wait_for_acting():
+                    self.evaluate_if_needed()
+                    self.replay_ratio_controller.add_acting_steps(self.play())
+            except BaseException as e:
+                acting_errors.append(e)
+            finally:
+                self.replay_ratio_controller.stop()
+
+        acting_thread = threading.Thread(target=play_until_stopped)
+        acting_thread.daemon = True
+        acting_thread.start()
+
+        model_snapshots_periods_passed = -1
+        try:
+            while self.training_iteration < self.tp.num_training_iterations and \
+                    self.replay_ratio_controller.wait_for_training():
+                model_snapshots_periods_passed = self.save_model_if_needed(training_start_time,
+                                                                           model_snapshots_periods_passed)
+                self.train_consecutive_steps()
+                self.replay_ratio_controller.add_training_steps(self.tp.agent.num_consecutive_training_steps)
+                self.measured_replay_ratio.add_sample(self.replay_ratio_controller.get_replay_ratio())
+        finally:
+            self.replay_ratio_controller.stop()
+            acting_thread.join()
+
+        # errors of the acting thread are raised on this thread
+        if acting_errors:
+            raise acting_errors[0]
 
     def save_model(self, model_id):
         self.main_network.save_model(model_id)
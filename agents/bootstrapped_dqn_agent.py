@@ -19,6 +19,11 @@ from agents.value_optimization_agent import *
 
 # Bootstrapped DQN - https://arxiv.org/pdf/1602.04621.pdf
 class BootstrappedDQNAgent(ValueOptimizationAgent):
+    # the bootstrap mask is added to the last transition in memory after each step
+    supports_vectorized_acting = False
+    # a transition could be sampled for training before its mask is added
+    supports_decoupled_acting = False
+
     def __init__(self, env, tuning_parameters, replicated_device=None, thread_id=0):
         ValueOptimizationAgent.__init__(self, env, tuning_parameters, replicated_device, thread_id)
 
@@ -55,4 +60,5 @@ class BootstrappedDQNAgent(ValueOptimizationAgent):
         ValueOptimizationAgent.act(self, phase)
         mask = np.random.binomial(1, self.tp.exploration.bootstrapped_data_sharing_probability,
                                   self.tp.exploration.architecture_num_q_heads)
-        self.memory.update_last_transition_info({'mask': mask})
+        with self.memory_lock:
+            self.memory.update_last_transition_info({'mask': mask})
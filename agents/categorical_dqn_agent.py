@@ -50,11 +50,17 @@ class CategoricalDQNAgent(ValueOptimizationAgent):
             l = (np.floor(bj)).astype(int)
             m[batches, l] = m[batches, l] + (distributed_q_st_plus_1[batches, target_actions, j] * (u - bj))
             m[batches, u] = m[batches, u] + (distributed_q_st_plus_1[batches, target_actions, j] * (bj - l))
+        # the priority of a transition is the cross entropy between the projected target distribution and the
+        # current distribution of the action that was taken
+        TD_errors = -np.sum(m * np.log(TD_targets[batches, actions] + 1e-15), axis=1)
+
         # total_loss = cross entropy between actual result above and predicted result for the given action
         TD_targets[batches, actions] = m
 
-        result = self.main_network.train_and_sync_networks(current_states, TD_targets)
+        result = self.main_network.train_and_sync_networks(self.add_importance_weights(batch, current_states),
+                                                           TD_targets)
         total_loss = result[0]
+        self.update_transition_priorities(batch, TD_errors)
 
         return total_loss
 
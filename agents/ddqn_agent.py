@@ -28,6 +28,8 @@ class DDQNAgent(ValueOptimizationAgent):
         selected_actions = np.argmax(self.main_network.online_network.predict(next_states), 1)
         q_st_plus_1 = self.main_network.target_network.predict(next_states)
         TD_targets = self.main_network.online_network.predict(current_states)
+        batch_idx = np.arange(self.tp.batch_size)
+        q_st = TD_targets[batch_idx, actions]
 
         # initialize with the current prediction so that we will
         #  only update the action that we have actually done in this transition
@@ -36,7 +38,9 @@ class DDQNAgent(ValueOptimizationAgent):
                                         + (1.0 - game_overs[i]) * self.tp.agent.discount * q_st_plus_1[i][
                 selected_actions[i]]
 
-        result = self.main_network.train_and_sync_networks(current_states, TD_targets)
+        result = self.main_network.train_and_sync_networks(self.add_importance_weights(batch, current_states),
+                                                           TD_targets)
         total_loss = result[0]
+        self.update_transition_priorities(batch, TD_targets[batch_idx, actions] - q_st)
 
         return total_loss
@@ -31,13 +31,17 @@ class DQNAgent(ValueOptimizationAgent):
         q_st_plus_1 = self.main_network.target_network.predict(next_states)
         # initialize with the current prediction so that we will
         TD_targets = self.main_network.online_network.predict(current_states)
+        batch_idx = np.arange(self.tp.batch_size)
+        q_st = TD_targets[batch_idx, actions]
 
         #  only update the action that we have actually done in this transition
         for i in range(self.tp.batch_size):
             TD_targets[i, actions[i]] = rewards[i] + (1.0 - game_overs[i]) * self.tp.agent.discount * np.max(
                 q_st_plus_1[i], 0)
 
-        result = self.main_network.train_and_sync_networks(current_states, TD_targets)
+        result = self.main_network.train_and_sync_networks(self.add_importance_weights(batch, current_states),
+                                                           TD_targets)
         total_loss = result[0]
+        self.update_transition_priorities(batch, TD_targets[batch_idx, actions] - q_st)
 
         return total_loss
@@ -34,9 +34,20 @@ class HumanAgent(Agent):
                 screen.log("\t- {}: {}".format(action, key))
             screen.separator()
 
+        # the episodes are appended to the recorded replay buffer as they are finished
+        self.replay_buffer_path = os.path.join(logger.experiments_path, 'replay_buffer')
+        self.replay_buffer_writer = ChunkedReplayBufferWriter(self.replay_buffer_path,
+                                                              self.tp.agent.replay_buffer_chunk_size)
+
     def train(self):
         return 0
 
+    def act(self, phase=RunPhase.TRAIN):
+        episode_ended = Agent.act(self, phase)
+        if episode_ended:
+            self.replay_buffer_writer.add_episode(self.memory.get_last_complete_episode())
+        return episode_ended
+
     def choose_action(self, curr_state, phase=RunPhase.TRAIN):
         action = self.env.get_action_from_user()
 
@@ -49,10 +60,9 @@ class HumanAgent(Agent):
         return action, {"action_value": 0}
 
     def save_replay_buffer_and_exit(self):
-        replay_buffer_path = os.path.join(logger.experiments_path, 'replay_buffer.p')
-        self.memory.tp = None
-        to_pickle(self.memory, replay_buffer_path)
-        screen.log_title("Replay buffer was stored in {}".format(replay_buffer_path))
+        # the current episode is not complete, so it is not recorded
+        self.replay_buffer_writer.close()
+        screen.log_title("Replay buffer was stored in {}".format(self.replay_buffer_path))
         exit()
 
     def log_to_screen(self, phase):
@@ -55,7 +55,7 @@ class ImitationAgent(Agent):
                 OrderedDict([
                     ("Worker", self.task_id),
                     ("Episode", self.current_episode),
-                    ("Loss", self.loss.values[-1]),
+                    ("Loss", self.loss.last_sample),
                     ("Training iteration", self.training_iteration)
                 ]),
                 prefix="Training"
@@ -28,6 +28,8 @@ class MixedMonteCarloAgent(ValueOptimizationAgent):
         TD_targets = self.main_network.online_network.predict(current_states)
         selected_actions = np.argmax(self.main_network.online_network.predict(next_states), 1)
         q_st_plus_1 = self.main_network.target_network.predict(next_states)
+        batch_idx = np.arange(self.tp.batch_size)
+        q_st = TD_targets[batch_idx, actions]
         # initialize with the current prediction so that we will
         #  only update the action that we have actually done in this transition
         for i in range(self.tp.batch_size):
@@ -36,7 +38,9 @@ class MixedMonteCarloAgent(ValueOptimizationAgent):
             monte_carlo_target = total_return[i]
             TD_targets[i, actions[i]] = (1 - self.mixing_rate) * one_step_target + self.mixing_rate * monte_carlo_target
 
-        result = self.main_network.train_and_sync_networks(current_states, TD_targets)
+        result = self.main_network.train_and_sync_networks(self.add_importance_weights(batch, current_states),
+                                                           TD_targets)
         total_loss = result[0]
+        self.update_transition_priorities(batch, TD_targets[batch_idx, actions] - q_st)
 
         return total_loss
@@ -24,6 +24,10 @@ from utils import Signal, last_sample
 
 # N Step Q Learning Agent - https://arxiv.org/abs/1602.01783
 class NStepQAgent(ValueOptimizationAgent, PolicyOptimizationAgent):
+    # the network is trained on the partial episode which was just played
+    supports_vectorized_acting = False
+    supports_decoupled_acting = False
+
     def __init__(self, env, tuning_parameters, replicated_device=None, thread_id=0):
         ValueOptimizationAgent.__init__(self, env, tuning_parameters, replicated_device, thread_id, create_target_network=True)
         self.last_gradient_update_step_idx = 0
@@ -78,7 +82,7 @@ class NStepQAgent(ValueOptimizationAgent, PolicyOptimizationAgent):
 
     def train(self):
         # update the target network of every network that has a target network
-        if self.total_steps_counter % self.tp.agent.num_steps_between_copying_online_weights_to_target == 0:
+        if self.is_target_network_update_step():
             for network in self.networks:
                 network.update_target_network(self.tp.agent.rate_for_copying_weights_to_target)
             logger.create_signal_value('Update Target Network', 1)
@@ -22,6 +22,9 @@ from utils import RunPhase, Signal
 
 # Normalized Advantage Functions - https://arxiv.org/pdf/1603.00748.pdf
 class NAFAgent(ValueOptimizationAgent):
+    # the continuous actions are chosen from the predicted mu, and not from q values
+    supports_vectorized_acting = False
+
     def __init__(self, env, tuning_parameters, replicated_device=None, thread_id=0):
         ValueOptimizationAgent.__init__(self, env, tuning_parameters, replicated_device, thread_id)
         self.l_values = Signal("L")
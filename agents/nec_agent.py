@@ -14,6 +14,8 @@
 # limitations under the License.
 #
 
+import os
+
 import numpy as np
 
 from agents.value_optimization_agent import ValueOptimizationAgent
@@ -23,6 +25,11 @@ from utils import RunPhase
 
 # Neural Episodic Control - https://arxiv.org/pdf/1703.01988.pdf
 class NECAgent(ValueOptimizationAgent):
+    # the state embeddings of a single episode are collected for inserting them to the DND
+    supports_vectorized_acting = False
+    # the DND is updated while acting and read while training
+    supports_decoupled_acting = False
+
     def __init__(self, env, tuning_parameters, replicated_device=None, thread_id=0):
         ValueOptimizationAgent.__init__(self, env, tuning_parameters, replicated_device, thread_id,
                                         create_target_network=False)
@@ -46,7 +53,8 @@ class NECAgent(ValueOptimizationAgent):
             TD_targets[i, actions[i]] = total_return[i]
 
         # train the neural network
-        result = self.main_network.train_and_sync_networks(current_states, TD_targets)
+        result = self.main_network.train_and_sync_networks(self.add_importance_weights(batch, current_states),
+                                                           TD_targets)
 
         total_loss = result[0]
 
@@ -92,5 +100,5 @@ class NECAgent(ValueOptimizationAgent):
 
     def save_model(self, model_id):
         self.main_network.save_model(model_id)
-        with open(os.path.join(self.tp.save_model_dir, str(model_id) + '.dnd'), 'wb') as f:
-            pickle.dump(self.main_network.online_network.output_heads[0].DND, f, pickle.HIGHEST_PROTOCOL)
+        self.main_network.online_network.output_heads[0].DND.save(
+            os.path.join(self.tp.save_model_dir, str(model_id) + '.dnd'))
@@ -56,11 +56,15 @@ class QuantileRegressionDQNAgent(ValueOptimizationAgent):
             quantile_midpoints[idx, :] = quantile_midpoints[idx, sorted_quantiles[idx]]
 
         # train
-        result = self.main_network.train_and_sync_networks({
+        result = self.main_network.train_and_sync_networks(self.add_importance_weights(batch, {
             **current_states,
             'output_0_0': actions_locations,
             'output_0_1': quantile_midpoints,
-        }, TD_targets)
+        }), TD_targets)
         total_loss = result[0]
 
+        # the priority of a transition is the TD error of the mean of the quantiles (i.e. of the Q value)
+        TD_errors = np.mean(TD_targets, axis=1) - np.mean(current_quantiles[batch_idx, actions], axis=1)
+        self.update_transition_priorities(batch, TD_errors)
+
         return total_loss
@@ -18,10 +18,15 @@ import numpy as np
 
 from agents.agent import Agent
 from architectures.network_wrapper import NetworkWrapper
+from memories.columnar_experience_replay import SequenceBatch
+from memories.prioritized_experience_replay import PrioritizedBatch
 from utils import RunPhase, Signal
 
 
 class ValueOptimizationAgent(Agent):
+    supports_vectorized_acting = True
+    supports_decoupled_acting = True
+
     def __init__(self, env, tuning_parameters, replicated_device=None, thread_id=0, create_target_network=True):
         Agent.__init__(self, env, tuning_parameters, replicated_device, thread_id)
         self.main_network = NetworkWrapper(tuning_parameters, create_target_network, self.has_global, 'main',
@@ -39,6 +44,29 @@ class ValueOptimizationAgent(Agent):
     def get_prediction(self, curr_state):
         return self.main_network.online_network.predict(self.tf_input_state(curr_state))
 
+    def add_importance_weights(self, batch, inputs):
+        """
+        Add the importance sampling weights of a batch which was sampled from a prioritized replay, or the loss mask of
+        a batch of sequences, to the network inputs
+        :param batch: the batch of transitions which was sampled from the memory
+        :param inputs: the network inputs for the batch
+        :return: the network inputs, with the importance weights if the batch has them
+        """
+        if isinstance(batch, (PrioritizedBatch, SequenceBatch)):
+            return dict(inputs, importance_weights=batch.importance_weights)
+        return inputs
+
+    def update_transition_priorities(self, batch, TD_errors):
+        """
+        Update the priorities of the batch transitions according to their TD errors if the batch was sampled from a
+        prioritized replay
+        :param batch: the batch of transitions which was sampled from the memory
+        :param TD_errors: a numpy array with the TD error of each of the transitions
+        """
+        if isinstance(batch, PrioritizedBatch):
+            with self.memory_lock:
+                self.memory.update_priorities(batch.indices, TD_errors)
+
     def _validate_action(self, policy, action):
         if np.array(action).shape != ():
             raise ValueError((
@@ -48,7 +76,23 @@ class ValueOptimizationAgent(Agent):
             ).format(policy.__class__.__name__))
 
     def choose_action(self, curr_state, phase=RunPhase.TRAIN):
-        prediction = self.get_prediction(curr_state)
+        return self.choose_action_from_prediction(self.get_prediction(curr_state), phase)
+
+    def choose_actions(self, curr_states, phase=RunPhase.TRAIN):
+        # a single prediction for all the states, which is then split to the prediction of each state
+        predictions = self.main_network.online_network.predict(self.tf_input_states(curr_states))
+        if type(predictions) == list:
+            return [self.choose_action_from_prediction([p[i:i + 1] for p in predictions], phase)
+                    for i in range(len(curr_states))]
+        return [self.choose_action_from_prediction(predictions[i:i + 1], phase) for i in range(len(curr_states))]
+
+    def choose_action_from_prediction(self, prediction, phase=RunPhase.TRAIN):
+        """
+        Choose an action given the network prediction for a single state
+        :param prediction: the network prediction, with a batch of size 1
+        :param phase: the current phase: training or testing
+        :return: chosen action, some action value describing the action
+        """
         actions_q_values = self.get_q_values(prediction)
 
         # choose action according to the exploration policy and the current phase (evaluating or training the agent)
@@ -14,6 +14,7 @@
 # limitations under the License.
 #
 
+import threading
 from collections import OrderedDict
 from configurations import Preset, Frameworks
 from logger import *
@@ -49,6 +50,9 @@ class NetworkWrapper(object):
         self.has_global = has_global
         self.name = name
         self.sess = tuning_parameters.sess
+        # held while the online and target weights are updated, so that a thread which acts with the online network
+        # while another thread trains it never reads a partially updated set of weights
+        self.weights_lock = threading.RLock()
 
         if self.tp.framework == Frameworks.TensorFlow:
             general_network = GeneralTensorFlowNetwork
@@ -101,7 +105,8 @@ class NetworkWrapper(object):
         :param rate: the rate of copying the weights - 1 for copying exactly
         """
         if self.target_network:
-            self.target_network.set_weights(self.online_network.get_weights(), rate)
+            with self.weights_lock:
+                self.target_network.set_weights(self.online_network.get_weights(), rate)
 
     def update_online_network(self, rate=1.0):
         """
@@ -109,7 +114,8 @@ class NetworkWrapper(object):
         :param rate: the rate of copying the weights - 1 for copying exactly
         """
         if self.global_network:
-            self.online_network.set_weights(self.global_network.get_weights(), rate)
+            with self.weights_lock:
+                self.online_network.set_weights(self.global_network.get_weights(), rate)
 
     def apply_gradients_to_global_network(self):
         """
@@ -142,12 +148,13 @@ class NetworkWrapper(object):
         Applies the gradients accumulated in the online network to the global network or to itself and syncs the
         networks if necessary
         """
-        if self.global_network:
-            self.apply_gradients_to_global_network()
-            self.online_network.reset_accumulated_gradients()
-            self.update_online_network()
-        else:
-            self.online_network.apply_and_reset_gradients(self.online_network.accumulated_gradients)
+        with self.weights_lock:
+            if self.global_network:
+                self.apply_gradients_to_global_network()
+                self.online_network.reset_accumulated_gradients()
+                self.update_online_network()
+            else:
+                self.online_network.apply_and_reset_gradients(self.online_network.accumulated_gradients)
 
     def get_local_variables(self):
         """
@@ -186,17 +186,11 @@ class TensorFlowArchitecture(Architecture):
             else:
                 fetches.append(self.tensor_gradients)
             fetches += [self.total_loss, self.losses]
-            if self.tp.agent.middleware_type == MiddlewareTypes.LSTM:
-                fetches.append(self.middleware_embedder.state_out)
             additional_fetches_start_idx = len(fetches)
             fetches += additional_fetches
 
-            # feed the lstm state if necessary
-            if self.tp.agent.middleware_type == MiddlewareTypes.LSTM:
-                # we can't always assume that we are starting from scratch here can we?
-                feed_dict[self.middleware_embedder.c_in] = self.middleware_embedder.c_init
-                feed_dict[self.middleware_embedder.h_in] = self.middleware_embedder.h_init
-
+            # the lstm starts from a zero state unless the initial state of the sequences is given in the inputs, and
+            # training does not change the state the agent acts with
             fetches += [self.merged]
 
             # get grads
@@ -206,8 +200,6 @@ class TensorFlowArchitecture(Architecture):
 
             # extract the fetches
             norm_unclipped_grads, grads, total_loss, losses = result[:4]
-            if self.tp.agent.middleware_type == MiddlewareTypes.LSTM:
-                (self.curr_rnn_c_in, self.curr_rnn_h_in) = result[4]
             fetched_tensors = []
             if len(additional_fetches) > 0:
                 fetched_tensors = result[additional_fetches_start_idx:additional_fetches_start_idx +
@@ -302,13 +294,14 @@ class TensorFlowArchitecture(Architecture):
         :param squeeze_output: call squeeze_list on output
         :return: The network output
 
-        WARNING: must only call once per state since each call is assumed by LSTM to be a new time step.
+        WARNING: must only call once per state since each call is assumed by LSTM to be a new time step. This does
+        not apply to batches of sequences, which are described by the rnn inputs (e.g. SequenceBatch.rnn_inputs).
         """
         feed_dict = self._feed_dict(inputs)
         if outputs is None:
             outputs = self.outputs
 
-        if self.tp.agent.middleware_type == MiddlewareTypes.LSTM:
+        if self.tp.agent.middleware_type == MiddlewareTypes.LSTM and 'rnn_num_sequences' not in inputs:
             feed_dict[self.middleware_embedder.c_in] = self.curr_rnn_c_in
             feed_dict[self.middleware_embedder.h_in] = self.curr_rnn_h_in
 
@@ -17,6 +17,15 @@
 import tensorflow as tf
 from configurations import EmbedderComplexity
 
+# the resize methods of the interpolation types which are supported in the graph
+_RESIZE_METHODS = {
+    'nearest': tf.image.ResizeMethod.NEAREST_NEIGHBOR,
+    'bilinear': tf.image.ResizeMethod.BILINEAR,
+    'bicubic': tf.image.ResizeMethod.BICUBIC,
+    'cubic': tf.image.ResizeMethod.BICUBIC,
+    'area': tf.image.ResizeMethod.AREA,
+}
+
 
 class InputEmbedder(object):
     def __init__(self, input_size, activation_function=tf.nn.relu,
@@ -27,11 +36,15 @@ class InputEmbedder(object):
         self.input = None
         self.output = None
         self.embedder_complexity = embedder_complexity
+        # the shape and type of the fed inputs, when the inputs are preprocessed in the graph
+        self.placeholder_size = input_size
+        self.placeholder_dtype = "float"
 
     def __call__(self, prev_input_placeholder=None):
         with tf.variable_scope(self.get_name()):
             if prev_input_placeholder is None:
-                self.input = tf.placeholder("float", shape=(None,) + self.input_size, name=self.get_name())
+                self.input = tf.placeholder(self.placeholder_dtype, shape=(None,) + self.placeholder_size,
+                                            name=self.get_name())
             else:
                 self.input = prev_input_placeholder
             self._build_module()
@@ -47,13 +60,50 @@ class InputEmbedder(object):
 
 class ImageEmbedder(InputEmbedder):
     def __init__(self, input_size, input_rescaler=255.0, activation_function=tf.nn.relu,
-                 embedder_complexity=EmbedderComplexity.Shallow, name="embedder"):
+                 embedder_complexity=EmbedderComplexity.Shallow, name="embedder", raw_input_size=None,
+                 interpolation='bilinear'):
+        """
+        :param raw_input_size: the shape of the raw uint8 observation stacks, which are [height, width, stack] or
+                               [height, width, channels, stack]. when it is given, the raw observations are fed and
+                               they are converted to grayscale and resized to the input size in the graph
+        :param interpolation: the interpolation type which is used for resizing the raw observations
+        """
         InputEmbedder.__init__(self, input_size, activation_function, embedder_complexity, name)
         self.input_rescaler = input_rescaler
+        self.raw_input_size = raw_input_size
+        self.interpolation = interpolation
+        if raw_input_size is not None:
+            if interpolation not in _RESIZE_METHODS:
+                raise ValueError("The interpolation type {} is not supported in the graph".format(interpolation))
+            self.placeholder_size = raw_input_size
+            self.placeholder_dtype = tf.uint8
+
+    def _preprocess_raw_observations(self, observation_stack):
+        """
+        Convert a stack of raw observations to grayscale and resize it, like Agent.preprocess_observation does outside
+        of the graph
+        :param observation_stack: a [batch, height, width, stack] or [batch, height, width, channels, stack] tensor
+        :return: a [batch, input height, input width, stack] float tensor
+        """
+        observation_stack = tf.cast(observation_stack, tf.float32)
+        if len(self.raw_input_size) == 4:
+            if self.raw_input_size[2] == 1:
+                observation_stack = observation_stack[:, :, :, 0, :]
+            else:
+                # rgb to y
+                luma_weights = tf.constant([[0.2989], [0.5870], [0.1140]], dtype=tf.float32)
+                observation_stack = tf.reduce_sum(observation_stack[:, :, :, :3, :] * luma_weights, axis=3)
+
+        # the stacked observations are resized together as the channels of a single image
+        return tf.image.resize_images(observation_stack, self.input_size[:2],
+                                      method=_RESIZE_METHODS[self.interpolation])
 
     def _build_module(self):
         # image observation
-        rescaled_observation_stack = self.input / self.input_rescaler
+        observation_stack = self.input
+        if self.raw_input_size is not None:
+            observation_stack = self._preprocess_raw_observations(observation_stack)
+        rescaled_observation_stack = observation_stack / self.input_rescaler
 
         if self.embedder_complexity == EmbedderComplexity.Shallow:
             # same embedder as used in the original DQN paper
@@ -115,12 +165,23 @@ class ImageEmbedder(InputEmbedder):
 
 class VectorEmbedder(InputEmbedder):
     def __init__(self, input_size, activation_function=tf.nn.relu,
-                 embedder_complexity=EmbedderComplexity.Shallow, name="embedder"):
+                 embedder_complexity=EmbedderComplexity.Shallow, name="embedder", input_stats=None):
+        """
+        :param input_stats: a SharedRunningStats of the unstacked inputs. when it is given, the raw inputs are fed and
+                            they are standardized with the running mean and std in the graph
+        """
         InputEmbedder.__init__(self, input_size, activation_function, embedder_complexity, name)
+        self.input_stats = input_stats
 
     def _build_module(self):
         # vector observation
-        input_layer = tf.contrib.layers.flatten(self.input)
+        input_layer = self.input
+        if self.input_stats is not None:
+            # standardize each of the stacked inputs, like Agent.preprocess_observation does outside of the graph
+            mean = tf.expand_dims(self.input_stats.mean_tensor, -1)
+            std = tf.expand_dims(self.input_stats.std_tensor, -1)
+            input_layer = tf.clip_by_value((input_layer - mean) / (std + 1e-15), -5.0, 5.0)
+        input_layer = tf.contrib.layers.flatten(input_layer)
 
         if self.embedder_complexity == EmbedderComplexity.Shallow:
             self.output = tf.layers.dense(input_layer, 256, activation=self.activation_function,
@@ -55,11 +55,18 @@ class GeneralTensorFlowNetwork(TensorFlowArchitecture):
     def get_input_embedder(self, embedder_type):
         # the observation can be either an image or a vector
         def get_observation_embedding(with_timestep=False):
+            in_graph = self.tp.env.preprocess_observation_in_graph
             if self.input_height > 1:
+                raw_input_size = tuple(self.tp.env.raw_observation_shape) + (self.input_depth,) if in_graph else None
                 return ImageEmbedder((self.input_height, self.input_width, self.input_depth), name="observation",
-                                     input_rescaler=self.tp.agent.input_rescaler)
+                                     input_rescaler=self.tp.agent.input_rescaler, raw_input_size=raw_input_size,
+                                     interpolation=self.tp.rescaling_interpolation_type)
             else:
-                return VectorEmbedder((self.input_width + int(with_timestep), self.input_depth), name="observation")
+                input_stats = None
+                if in_graph and self.tp.env.normalize_observation and not with_timestep:
+                    input_stats = self.tp.running_observation_stats
+                return VectorEmbedder((self.input_width + int(with_timestep), self.input_depth), name="observation",
+                                      input_stats=input_stats)
 
         input_mapping = {
             InputTypes.Observation: get_observation_embedding(),
@@ -136,6 +143,14 @@ class GeneralTensorFlowNetwork(TensorFlowArchitecture):
                 state_embedding = tf.concat(state_embedding, axis=-1) if len(state_embedding) > 1 else state_embedding[0]
                 self.middleware_embedder = self.get_middleware_embedder(self.tp.agent.middleware_type)
                 _, self.state_embedding = self.middleware_embedder(state_embedding)
+                if self.tp.agent.middleware_type == MiddlewareTypes.LSTM:
+                    self.inputs.update(self.middleware_embedder.rnn_inputs)
+
+                # per-sample loss weights. these are all ones unless they are fed (e.g. by a prioritized replay)
+                if network_idx == 0:
+                    self.importance_weights = tf.placeholder_with_default(tf.ones_like(self.state_embedding[:, 0]),
+                                                                          [None], name='importance_weights')
+                    self.inputs['importance_weights'] = self.importance_weights
 
                 ################
                 # Output Heads #
@@ -159,6 +174,7 @@ class GeneralTensorFlowNetwork(TensorFlowArchitecture):
                             head_input = self.state_embedding
 
                         # build the head
+                        self.output_heads[-1].importance_weights = self.importance_weights
                         if self.network_is_local:
                             output, target_placeholder, input_placeholders = self.output_heads[-1](head_input)
                             self.targets.extend(target_placeholder)
@@ -40,6 +40,8 @@ class Head(object):
         self.target = []
         self.input = []
         self.is_local = is_local
+        # per-sample weights for the loss, set by the network before the head is built
+        self.importance_weights = None
 
     def __call__(self, input_layer):
         """
@@ -104,13 +106,24 @@ class Head(object):
             target = tf.placeholder('float', self.output[idx].shape, '{}_target'.format(self.get_name()))
             self.target.append(target)
             loss = self.loss_type[idx](self.target[-1], self.output[idx],
-                                       weights=self.loss_weight[idx], scope=self.get_name())
+                                       weights=self._get_loss_weights(idx), scope=self.get_name())
             self.loss.append(loss)
 
         # add regularizations
         for regularization in self.regularizations:
             self.loss.append(regularization)
 
+    def _get_loss_weights(self, idx):
+        """
+        Get the weights of the loss of the given output, including the per-sample importance weights if there are any
+        :param idx: the index of the output
+        :return: a scalar weight or a weights tensor which is broadcastable to the output shape
+        """
+        if self.importance_weights is None:
+            return self.loss_weight[idx]
+        per_sample_shape = [-1] + [1] * (len(self.output[idx].shape) - 1)
+        return self.loss_weight[idx] * tf.reshape(self.importance_weights, per_sample_shape)
+
 
 class QHead(Head):
     def __init__(self, tuning_parameters, head_idx=0, loss_weight=1., is_local=True):
@@ -280,42 +293,46 @@ class DNDQHead(Head):
         else:
             self.loss_type = tf.losses.mean_squared_error
         self.tp = tuning_parameters
-        self.dnd_embeddings = [None]*self.num_actions
-        self.dnd_values = [None]*self.num_actions
-        self.dnd_indices = [None]*self.num_actions
+        self.dnd_embeddings = None
+        self.dnd_values = None
+        self.dnd_indices = None
 
     def _build_module(self, input_layer):
         # DND based Q head
-        from memories import differentiable_neural_dictionary
-
-        if self.tp.checkpoint_restore_dir:
+        from memories import differentiable_neural_dictionary, shared_dnd
+
+        key_width = int(input_layer.get_shape()[-1])
+        if self.tp.agent.shared_dnd_name:
+            # the DND is shared by the local workers, and a checkpoint is restored by its writer process
+            self.DND = shared_dnd.SharedQDND(
+                self.tp.agent.shared_dnd_name, self.DND_size, key_width, self.num_actions,
+                self.new_value_shift_coefficient, key_error_threshold=self.DND_key_error_threshold,
+                learning_rate=self.tp.learning_rate, num_query_threads=self.tp.agent.num_dnd_query_threads,
+                index_type=self.tp.agent.dnd_index_type)
+        elif self.tp.checkpoint_restore_dir:
             self.DND = differentiable_neural_dictionary.load_dnd(self.tp.checkpoint_restore_dir)
         else:
             self.DND = differentiable_neural_dictionary.QDND(
-                self.DND_size, input_layer.get_shape()[-1], self.num_actions, self.new_value_shift_coefficient,
-                key_error_threshold=self.DND_key_error_threshold, learning_rate=self.tp.learning_rate)
+                self.DND_size, key_width, self.num_actions, self.new_value_shift_coefficient,
+                key_error_threshold=self.DND_key_error_threshold, learning_rate=self.tp.learning_rate,
+                num_query_threads=self.tp.agent.num_dnd_query_threads, index_type=self.tp.agent.dnd_index_type)
 
         # Retrieve info from DND dictionary
         # We assume that all actions have enough entries in the DND
-        self.output = tf.transpose([
-            self._q_value(input_layer, action)
-            for action in range(self.num_actions)
-        ])
-
-    def _q_value(self, input_layer, action):
-        result = tf.py_func(self.DND.query,
-                            [input_layer, action, self.number_of_nn],
+        # all the actions are queried with a single call, which returns [batch, actions, k, ...] arrays
+        result = tf.py_func(self.DND.query_all_actions,
+                            [input_layer, self.number_of_nn],
                             [tf.float64, tf.float64, tf.int64])
-        self.dnd_embeddings[action] = tf.to_float(result[0])
-        self.dnd_values[action] = tf.to_float(result[1])
-        self.dnd_indices[action] = result[2]
+        self.dnd_embeddings = tf.to_float(result[0])
+        self.dnd_values = tf.to_float(result[1])
+        self.dnd_indices = result[2]
 
         # DND calculation
-        square_diff = tf.square(self.dnd_embeddings[action] - tf.expand_dims(input_layer, 1))
-        distances = tf.reduce_sum(square_diff, axis=2) + [self.l2_norm_added_delta]
+        square_diff = tf.square(self.dnd_embeddings - tf.expand_dims(tf.expand_dims(input_layer, 1), 1))
+        distances = tf.reduce_sum(square_diff, axis=3) + [self.l2_norm_added_delta]
         weights = 1.0 / distances
-        normalised_weights = weights / tf.reduce_sum(weights, axis=1, keep_dims=True)
-        return tf.reduce_sum(self.dnd_values[action] * normalised_weights, axis=1)
+        normalised_weights = weights / tf.reduce_sum(weights, axis=2, keep_dims=True)
+        self.output = tf.reduce_sum(self.dnd_values * normalised_weights, axis=2)
 
 
 class NAFHead(Head):
@@ -510,6 +527,8 @@ class CategoricalQHead(Head):
         self.distributions = tf.placeholder(tf.float32, shape=(None, self.num_actions, self.num_atoms), name="distributions")
         self.target = self.distributions
         self.loss = tf.nn.softmax_cross_entropy_with_logits(labels=self.target, logits=values_distribution)
+        if self.importance_weights is not None:
+            self.loss = self.loss * tf.expand_dims(self.importance_weights, -1)
         tf.losses.add_loss(self.loss)
 
 
@@ -552,6 +571,8 @@ class QuantileRegressionQHead(Head):
 
         # Quantile Huber loss
         quantile_huber_loss = tf.abs(tau_i - tf.cast(error < 0, dtype=tf.float32)) * huber_loss
+        if self.importance_weights is not None:
+            quantile_huber_loss = quantile_huber_loss * tf.reshape(self.importance_weights, [-1, 1, 1])
 
         # Quantile regression loss (the probability for each quantile is 1/num_quantiles)
         quantile_regression_loss = tf.reduce_sum(quantile_huber_loss) / float(self.num_atoms)
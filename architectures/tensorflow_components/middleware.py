@@ -42,12 +42,13 @@ class MiddlewareEmbedder(object):
 class LSTM_Embedder(MiddlewareEmbedder):
     def _build_module(self):
         """
-        self.state_in: tuple of placeholders containing the initial state
-        self.state_out: tuple of output state
+        The input is a batch of num_sequences sequences of equal length, flattened to
+        [num_sequences * sequence length, features]. By default it is a single sequence, which is how the agent acts.
+        The first burn_in_steps steps of each sequence only advance the LSTM state, and no gradients flow through them.
 
-        todo: it appears that the shape of the output is batch, feature
-        the code here seems to be slicing off the first element in the batch
-        which would definitely be wrong. need to double check the shape
+        self.state_in: tuple of placeholders containing the initial state of each sequence. zeros by default
+        self.state_out: tuple of the final state of each sequence
+        self.rnn_inputs: the placeholders which describe the sequences, by their network input names
         """
 
         middleware = tf.layers.dense(self.input, 512, activation=self.activation_function, name='fc1')
@@ -55,16 +56,29 @@ class LSTM_Embedder(MiddlewareEmbedder):
         self.c_init = np.zeros((1, lstm_cell.state_size.c), np.float32)
         self.h_init = np.zeros((1, lstm_cell.state_size.h), np.float32)
         self.state_init = [self.c_init, self.h_init]
-        self.c_in = tf.placeholder(tf.float32, [1, lstm_cell.state_size.c])
-        self.h_in = tf.placeholder(tf.float32, [1, lstm_cell.state_size.h])
+        self.num_sequences = tf.placeholder_with_default(1, [], name='num_sequences')
+        self.burn_in_steps = tf.placeholder_with_default(0, [], name='burn_in_steps')
+        self.c_in = tf.placeholder_with_default(tf.zeros([self.num_sequences, lstm_cell.state_size.c]),
+                                                [None, lstm_cell.state_size.c], name='c_in')
+        self.h_in = tf.placeholder_with_default(tf.zeros([self.num_sequences, lstm_cell.state_size.h]),
+                                                [None, lstm_cell.state_size.h], name='h_in')
         self.state_in = (self.c_in, self.h_in)
-        rnn_in = tf.expand_dims(middleware, [0])
-        step_size = tf.shape(middleware)[:1]
+        self.rnn_inputs = {'rnn_num_sequences': self.num_sequences, 'rnn_burn_in_steps': self.burn_in_steps,
+                           'rnn_c_in': self.c_in, 'rnn_h_in': self.h_in}
+        rnn_in = tf.reshape(middleware, [self.num_sequences, -1, 512])
         state_in = tf.contrib.rnn.LSTMStateTuple(self.c_in, self.h_in)
-        lstm_outputs, lstm_state = tf.nn.dynamic_rnn(
-            lstm_cell, rnn_in, initial_state=state_in, sequence_length=step_size, time_major=False)
-        lstm_c, lstm_h = lstm_state
-        self.state_out = (lstm_c[:1, :], lstm_h[:1, :])
+
+        # the burn in runs over at least one step, which is ignored when there is no burn in
+        burn_in_outputs, burn_in_state = tf.nn.dynamic_rnn(
+            lstm_cell, rnn_in[:, :tf.maximum(self.burn_in_steps, 1)], initial_state=state_in,
+            sequence_length=tf.fill([self.num_sequences], self.burn_in_steps), scope='rnn')
+        burn_in_state = tf.contrib.rnn.LSTMStateTuple(tf.stop_gradient(burn_in_state.c),
+                                                      tf.stop_gradient(burn_in_state.h))
+        with tf.variable_scope(tf.get_variable_scope(), reuse=True):
+            lstm_outputs, lstm_state = tf.nn.dynamic_rnn(
+                lstm_cell, rnn_in[:, self.burn_in_steps:], initial_state=burn_in_state, scope='rnn')
+        lstm_outputs = tf.concat([tf.stop_gradient(burn_in_outputs[:, :self.burn_in_steps]), lstm_outputs], axis=1)
+        self.state_out = (lstm_state.c, lstm_state.h)
         self.output = tf.reshape(lstm_outputs, [-1, 256])
 
 
@@ -14,13 +14,38 @@
 # limitations under the License.
 #
 
+import threading
+
 import tensorflow as tf
 import numpy as np
+from utils import Signal
 
 
 class SharedRunningStats(object):
-    def __init__(self, tuning_parameters, replicated_device, epsilon=1e-2, shape=(), name=""):
+    """
+    Running statistics which are shared between the workers through variables on the parameter server.
+    Reading the shared variables for every observation would add a round trip to the parameter server for each step,
+    so each worker keeps a cached copy of the shared sums. The pushed samples are accumulated locally as deltas, and
+    they are added to the shared sums by the same run which refreshes the cached copy. This happens on each call to
+    sync, which the agent does on every training iteration, and after max_staleness_steps steps since the last sync,
+    where each push and each read of the mean is a step. The statistics which are read include the local deltas.
+    """
+    def __init__(self, tuning_parameters, replicated_device, epsilon=1e-2, shape=(), name="",
+                 max_staleness_steps=None):
+        """
+        :param tuning_parameters: A Preset class instance with all the running paramaters
+        :param replicated_device: the device which holds the shared variables
+        :param epsilon: the initial sum of squares and count, and the minimal variance
+        :param shape: the shape of the samples
+        :param name: the name of the variable scope
+        :param max_staleness_steps: the number of steps after which the cached copy is synced. when None, it is taken
+                                    from shared_statistics_max_staleness_steps of the agent parameters
+        """
         self.tp = tuning_parameters
+        self.epsilon = epsilon
+        if max_staleness_steps is None:
+            max_staleness_steps = self.tp.agent.shared_statistics_max_staleness_steps
+        self.max_staleness_steps = max_staleness_steps
         with tf.device(replicated_device):
             with tf.variable_scope(name):
                 self._sum = tf.get_variable(
@@ -43,6 +68,9 @@ class SharedRunningStats(object):
                 self._mean = self._sum / self._count
                 self._std = tf.sqrt(tf.maximum((self._sum_squared - self._count*tf.square(self._mean))
                                                / tf.maximum(self._count-1, 1), epsilon))
+                # the statistics as float32 tensors, for normalizing inputs in the graph
+                self.mean_tensor = tf.cast(self._mean, tf.float32)
+                self.std_tensor = tf.cast(self._std, tf.float32)
 
                 self.new_sum = tf.placeholder(shape=self.shape, dtype=tf.float64, name='sum')
                 self.new_sum_squared = tf.placeholder(shape=self.shape, dtype=tf.float64, name='var')
@@ -52,22 +80,83 @@ class SharedRunningStats(object):
                 self._inc_sum_squared = tf.assign_add(self._sum_squared, self.new_sum_squared, use_locking=True)
                 self._inc_count = tf.assign_add(self._count, self.newcount, use_locking=True)
 
+        # the shared sums as of the last sync, and the samples which were pushed since then
+        self._cached_sum = np.zeros(shape, dtype='float64')
+        self._cached_sum_squared = np.full(shape, epsilon, dtype='float64')
+        self._cached_count = epsilon
+        self._pending_sum = np.zeros(shape, dtype='float64')
+        self._pending_sum_squared = np.zeros(shape, dtype='float64')
+        self._pending_count = 0
+        self._cached_mean = None
+        self._cached_std = None
+        # the cached copy is stale until the first sync
+        self._steps_since_sync = max_staleness_steps
+        self._lock = threading.Lock()
+
+        self.steps_between_syncs = Signal('{} Steps Between Syncs'.format(name.replace('_', ' ').title()))
+        self.signals = [self.steps_between_syncs]
+
     def push(self, x):
         x = x.astype('float64')
-        self.tp.sess.run([self._inc_sum, self._inc_sum_squared, self._inc_count],
-                         feed_dict={
-                             self.new_sum: x.sum(axis=0).ravel(),
-                             self.new_sum_squared: np.square(x).sum(axis=0).ravel(),
-                             self.newcount: np.array(len(x), dtype='float64')
-                         })
+        with self._lock:
+            self._pending_sum += x.sum(axis=0).reshape(self.shape)
+            self._pending_sum_squared += np.square(x).sum(axis=0).reshape(self.shape)
+            self._pending_count += len(x)
+            self._cached_mean = self._cached_std = None
+            self._step()
+
+    def sync(self):
+        """
+        Add the samples which were pushed since the last sync to the shared sums, and refresh the cached copy of the
+        shared sums, with a single run
+        :return: None
+        """
+        with self._lock:
+            self._sync()
+
+    def _sync(self):
+        if self._pending_count > 0:
+            fetches = [self._inc_sum, self._inc_sum_squared, self._inc_count]
+            feed_dict = {
+                self.new_sum: self._pending_sum,
+                self.new_sum_squared: self._pending_sum_squared,
+                self.newcount: np.array(self._pending_count, dtype='float64')
+            }
+        else:
+            fetches = [self._sum, self._sum_squared, self._count]
+            feed_dict = None
+        self._cached_sum, self._cached_sum_squared, self._cached_count = self.tp.sess.run(fetches, feed_dict=feed_dict)
+        self._pending_sum[...] = 0
+        self._pending_sum_squared[...] = 0
+        self._pending_count = 0
+        self._cached_mean = self._cached_std = None
+        self.steps_between_syncs.add_sample(self._steps_since_sync)
+        self._steps_since_sync = 0
+
+    def _step(self):
+        self._steps_since_sync += 1
+        if self._steps_since_sync >= self.max_staleness_steps:
+            self._sync()
+
+    def _get_statistics(self):
+        if self._cached_mean is None:
+            count = self._cached_count + self._pending_count
+            mean = (self._cached_sum + self._pending_sum) / count
+            var = (self._cached_sum_squared + self._pending_sum_squared - count * np.square(mean)) / max(count - 1, 1)
+            self._cached_mean = mean
+            self._cached_std = np.sqrt(np.maximum(var, self.epsilon))
+        return self._cached_mean, self._cached_std
 
     @property
     def n(self):
-        return self.tp.sess.run(self._count)
+        with self._lock:
+            return self._cached_count + self._pending_count
 
     @property
     def mean(self):
-        return self.tp.sess.run(self._mean)
+        with self._lock:
+            self._step()
+            return self._get_statistics()[0]
 
     @property
     def var(self):
@@ -75,8 +164,9 @@ class SharedRunningStats(object):
 
     @property
     def std(self):
-        return self.tp.sess.run(self._std)
+        with self._lock:
+            return self._get_statistics()[1]
 
     @property
     def shape(self):
-        return self._shape
\ No newline at end of file
+        return self._shape
@@ -0,0 +1,86 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Micro-benchmark of the nearest neighbors indices of the NEC differentiable neural dictionary.
+Fills a single action dictionary with random keys in episode sized inserts, the way NECAgent does, and measures the
+insert throughput, the latency of querying a batch of keys and the recall@k of the results compared to an exact search.
+
+Usage: python3 benchmarks/dnd_index_benchmark.py [-s 100000] [-i AnnoyKNNIndex IVFKNNIndex BruteForceKNNIndex]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from memories.differentiable_neural_dictionary import AnnoyDictionary
+
+
+def exact_neighbors(dictionary, keys, k):
+    embeddings = dictionary.embeddings[:dictionary.curr_size]
+    distances = np.sum(embeddings ** 2, axis=1) - 2 * keys.dot(embeddings.T)
+    return np.argpartition(distances, k - 1, axis=1)[:, :k]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--index_types', help="(string) The index types to measure",
+                        default=['AnnoyKNNIndex', 'IVFKNNIndex', 'BruteForceKNNIndex'], type=str, nargs='+')
+    parser.add_argument('-s', '--dict_size', help="(int) The size of the dictionary", default=100000, type=int)
+    parser.add_argument('-w', '--key_width', help="(int) The size of each key", default=512, type=int)
+    parser.add_argument('-e', '--episode_length', help="(int) The number of keys in each insert", default=1000,
+                        type=int)
+    parser.add_argument('-k', '--knn', help="(int) The number of neighbors to query", default=50, type=int)
+    parser.add_argument('-b', '--batch_size', help="(int) The number of keys in each query", default=32, type=int)
+    args = parser.parse_args()
+
+    # the keys are drawn around a few hundred centers, since embeddings of consecutive states are clustered
+    rng = np.random.RandomState(0)
+    centers = rng.randn(256, args.key_width)
+
+    def random_keys(num_keys):
+        return centers[rng.randint(len(centers), size=num_keys)] + 0.3 * rng.randn(num_keys, args.key_width)
+
+    for index_type in args.index_types:
+        dictionary = AnnoyDictionary(args.dict_size, args.key_width, key_error_threshold=0, index_type=index_type)
+
+        # insert twice the dictionary size, so that half of the inserts evict old keys
+        num_inserted_keys = 0
+        start = time.time()
+        while num_inserted_keys < 2 * args.dict_size:
+            dictionary.add(random_keys(args.episode_length), rng.randn(args.episode_length, 1))
+            num_inserted_keys += args.episode_length
+        insert_time = time.time() - start
+
+        queries = random_keys(args.batch_size)
+        start = time.time()
+        num_queries = 20
+        for _ in range(num_queries):
+            _, _, indices = dictionary.query(queries, args.knn)
+        query_time = (time.time() - start) / num_queries
+
+        exact_indices = exact_neighbors(dictionary, queries, args.knn)
+        recall = np.mean([len(np.intersect1d(found, exact)) / float(args.knn)
+                          for found, exact in zip(indices, exact_indices)])
+
+        print("{}:".format(index_type))
+        print("  insert: {:.0f} keys per second".format(num_inserted_keys / insert_time))
+        print("  query: {:.2f} msec per batch of {}".format(query_time * 1e3, args.batch_size))
+        print("  recall@{}: {:.3f}".format(args.knn, recall))
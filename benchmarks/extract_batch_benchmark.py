@@ -0,0 +1,102 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Micro-benchmark of the batch assembly done by Agent.extract_batch.
+Measures the latency of turning a sampled batch of Atari like transitions (84x84 uint8 frames, stacked 4 times) into
+numpy arrays with the list comprehensions that were used before, with the reusable batch buffers, and with the
+columnar batches of ColumnarExperienceReplay which skip the Transition objects.
+
+Usage: python3 benchmarks/extract_batch_benchmark.py [-b 32 64 256]
+"""
+
+import argparse
+import os
+import sys
+import time
+from collections import deque
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from configurations import Preset, DQN, Atari, ExplorationParameters
+from memories.columnar_experience_replay import ColumnarExperienceReplay
+from memories.episodic_experience_replay import EpisodicExperienceReplay
+from memories.memory import Transition, BatchBuffers
+from utils import LazyStack
+
+
+def list_comprehension_extract(batch):
+    # the implementation of Agent.extract_batch before the batch buffers
+    current_states = {}
+    next_states = {}
+    current_states['observation'] = np.array([np.array(transition.state['observation']) for transition in batch])
+    next_states['observation'] = np.array([np.array(transition.next_state['observation']) for transition in batch])
+    actions = np.array([transition.action for transition in batch])
+    rewards = np.array([transition.reward for transition in batch])
+    game_overs = np.array([transition.game_over for transition in batch])
+    total_return = np.array([transition.total_return for transition in batch])
+    return current_states, next_states, actions, rewards, game_overs, total_return
+
+
+def fill_memory(memory, num_transitions, stack_size, episode_length=100):
+    stack = deque([np.zeros((84, 84), dtype=np.uint8)] * stack_size, maxlen=stack_size)
+    for i in range(num_transitions):
+        state = {'observation': LazyStack(stack, -1)}
+        stack.append(np.random.randint(256, size=(84, 84)).astype(np.uint8))
+        next_state = {'observation': LazyStack(stack, -1)}
+        game_over = (i + 1) % episode_length == 0
+        memory.store(Transition(state, np.random.randint(4), np.random.uniform(), next_state, game_over))
+
+
+def measure(func, num_iterations):
+    start = time.time()
+    for _ in range(num_iterations):
+        func()
+    return (time.time() - start) / num_iterations
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-b', '--batch_sizes', help="(int) Batch sizes to measure", default=[32, 64, 256], type=int,
+                        nargs='+')
+    parser.add_argument('-n', '--num_transitions', help="(int) Number of transitions in the memory", default=10000,
+                        type=int)
+    parser.add_argument('-i', '--iterations', help="(int) Number of timed iterations", default=200, type=int)
+    args = parser.parse_args()
+
+    tuning_parameters = Preset(DQN, Atari, ExplorationParameters)
+    tuning_parameters.agent.num_transitions_in_experience_replay = args.num_transitions
+    stack_size = tuning_parameters.env.observation_stack_size
+    episodic_memory = EpisodicExperienceReplay(tuning_parameters)
+    columnar_memory = ColumnarExperienceReplay(tuning_parameters)
+    fill_memory(episodic_memory, args.num_transitions, stack_size)
+    fill_memory(columnar_memory, args.num_transitions, stack_size)
+    batch_buffers = BatchBuffers()
+
+    for batch_size in args.batch_sizes:
+        print("batch size {}:".format(batch_size))
+        batch = episodic_memory.sample(batch_size)
+        for name, func in [('list comprehensions', lambda: list_comprehension_extract(batch)),
+                           ('batch buffers', lambda: batch_buffers.extract(batch))]:
+            print("  {}: {:.1f} usec per batch".format(name, measure(func, args.iterations) * 1e6))
+
+        # the columnar memory gathers the arrays while sampling, so sampling is included in both measurements
+        for name, func in [('columnar transitions + list comprehensions',
+                            lambda: list_comprehension_extract(columnar_memory.sample(batch_size).transitions)),
+                           ('columnar batch', lambda: columnar_memory.sample(batch_size).states)]:
+            print("  {}: {:.1f} usec per batch (including sampling)".format(name,
+                                                                          measure(func, args.iterations) * 1e6))
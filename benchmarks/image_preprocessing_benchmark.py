@@ -0,0 +1,89 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Micro-benchmark of the preprocessing of image observations, which converts them to grayscale and resizes them.
+Compares the scipy.misc.imresize path, when it is available, with the fast path on single observations and on batches
+of observations from a vectorized environment, and reports the largest difference between their outputs.
+
+Usage: python3 benchmarks/image_preprocessing_benchmark.py [-s 210 160] [-o 84 84] [-b 1 8 32]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from image_preprocessing import FastImagePreprocessor, ScipyImagePreprocessor
+
+
+def measure(preprocess, observations, batch_size, num_repeats):
+    start = time.time()
+    for _ in range(num_repeats):
+        for batch_start in range(0, len(observations), batch_size):
+            preprocess(observations[batch_start:batch_start + batch_size])
+    return (time.time() - start) / (num_repeats * len(observations))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--observation_size', help="(int) The height and width of the observations",
+                        default=[210, 160], type=int, nargs=2)
+    parser.add_argument('-o', '--output_size', help="(int) The height and width of the preprocessed observations",
+                        default=[84, 84], type=int, nargs=2)
+    parser.add_argument('-i', '--interpolation', help="(string) The interpolation type", default='bilinear', type=str)
+    parser.add_argument('-b', '--batch_sizes', help="(int) The number of observations which are preprocessed together "
+                                                    "by the fast path", default=[1, 8, 32], type=int, nargs='+')
+    parser.add_argument('-n', '--num_observations', help="(int) The number of observations to preprocess",
+                        default=256, type=int)
+    args = parser.parse_args()
+
+    # frames with large flat areas and some noise, like the frames of atari games
+    rng = np.random.RandomState(0)
+    height, width = args.observation_size
+    observations = []
+    for _ in range(args.num_observations):
+        frame = np.repeat(np.repeat(rng.randint(0, 256, size=(height // 10 + 1, width // 10 + 1, 3)), 10, axis=0),
+                          10, axis=1)[:height, :width]
+        frame[rng.rand(height, width) < 0.05] = 255
+        observations.append(frame.astype(np.uint8))
+    num_repeats = max(1, 2000 // args.num_observations)
+
+    fast = FastImagePreprocessor(args.output_size[0], args.output_size[1], args.interpolation)
+    scipy_preprocessor = ScipyImagePreprocessor(args.output_size[0], args.output_size[1], args.interpolation)
+
+    try:
+        scipy_preprocessor.preprocess(observations[0])
+    except (ImportError, AttributeError):
+        scipy_preprocessor = None
+        print("scipy.misc.imresize: not available (it requires scipy < 1.3 and PIL)")
+
+    if scipy_preprocessor is not None:
+        scipy_time = measure(lambda batch: [scipy_preprocessor.preprocess(o) for o in batch], observations, 1,
+                             num_repeats)
+        print("scipy.misc.imresize: {:.1f} usec per observation".format(scipy_time * 1e6))
+        max_difference = max(np.max(np.abs(scipy_preprocessor.preprocess(o).astype(np.int32) -
+                                           fast.preprocess(o).astype(np.int32))) for o in observations[:32])
+        print("  largest difference from the fast path: {}".format(max_difference))
+
+    fast_time = measure(lambda batch: [fast.preprocess(o) for o in batch], observations, 1, num_repeats)
+    print("fast: {:.1f} usec per observation".format(fast_time * 1e6))
+    for batch_size in args.batch_sizes:
+        batch_time = measure(fast.preprocess_batch, observations, batch_size, num_repeats)
+        print("fast batch of {}: {:.1f} usec per observation".format(batch_size, batch_time * 1e6))
@@ -0,0 +1,111 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Micro-benchmark of logging the signals of the agent at the end of each episode and dumping them to the csv file.
+Reports the logging time per episode over consecutive windows of episodes, for the row buffer logger and for the
+previous logger, which wrote each value to a cell of a growing pandas DataFrame.
+
+Usage: python3 benchmarks/logger_benchmark.py [-e 100000] [-s 40] [-w 10]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from pandas import DataFrame
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from logger import Logger
+
+
+class DataFrameLogger(object):
+    """
+    The previous logger, which writes each value to a cell of a DataFrame and appends its new rows to the csv file
+    """
+    def __init__(self, csv_path):
+        self.data = DataFrame()
+        self.csv_path = csv_path
+        self.last_line_idx_written_to_csv = 0
+
+    def create_signal_value(self, signal_name, value, time):
+        self.data.loc[time, signal_name] = value
+
+    def dump_output_csv(self):
+        self.data.index.name = "Episode #"
+        if os.path.exists(self.csv_path):
+            self.data[self.last_line_idx_written_to_csv:].to_csv(self.csv_path, mode='a', header=False)
+        else:
+            self.data.to_csv(self.csv_path)
+        self.last_line_idx_written_to_csv = len(self.data.index)
+
+
+def measure(create_signal_value, dump_output_csv, num_episodes, num_signals, dump_every, num_windows):
+    signal_names = ['Signal {}/Mean'.format(signal_idx) for signal_idx in range(num_signals)]
+    values = np.random.RandomState(0).randn(num_signals)
+    window_size = max(num_episodes // num_windows, 1)
+    window_times = []
+    start = time.time()
+    for episode in range(1, num_episodes + 1):
+        for signal_name, value in zip(signal_names, values):
+            create_signal_value(signal_name, value, episode)
+        if episode % dump_every == 0:
+            dump_output_csv()
+        if episode % window_size == 0:
+            window_times.append((episode, (time.time() - start) / window_size))
+            start = time.time()
+    return window_times
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-e', '--num_episodes', help="(int) The number of episodes to log",
+                        default=100000, type=int)
+    parser.add_argument('-b', '--baseline_episodes', help="(int) The number of episodes to log with the DataFrame "
+                                                          "logger, which gets much slower as the episodes accumulate",
+                        default=5000, type=int)
+    parser.add_argument('-s', '--num_signals', help="(int) The number of values which are logged in each episode",
+                        default=40, type=int)
+    parser.add_argument('-d', '--dump_every', help="(int) The number of episodes between dumps of the csv file",
+                        default=5, type=int)
+    parser.add_argument('-w', '--num_windows', help="(int) The number of windows of episodes which are reported",
+                        default=10, type=int)
+    args = parser.parse_args()
+
+    experiments_path = tempfile.mkdtemp()
+    try:
+        logger = Logger()
+        logger.set_dump_dir(experiments_path, filename='rows')
+        print("row buffer logger:")
+        for episode, episode_time in measure(lambda name, value, episode: logger.create_signal_value(name, value,
+                                                                                                     time=episode),
+                                             logger.dump_output_csv, args.num_episodes, args.num_signals,
+                                             args.dump_every, args.num_windows):
+            print("  until episode {}: {:.1f} usec per episode".format(episode, episode_time * 1e6))
+
+        if args.baseline_episodes > 0:
+            baseline_logger = DataFrameLogger(os.path.join(experiments_path, 'dataframe.csv'))
+            print("DataFrame logger:")
+            for episode, episode_time in measure(baseline_logger.create_signal_value, baseline_logger.dump_output_csv,
+                                                 args.baseline_episodes, args.num_signals, args.dump_every,
+                                                 args.num_windows):
+                print("  until episode {}: {:.1f} usec per episode".format(episode, episode_time * 1e6))
+    finally:
+        shutil.rmtree(experiments_path)
@@ -0,0 +1,78 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Micro-benchmark of the prioritized experience replay sum tree.
+Measures the throughput of sampling a batch and updating its priorities at a given capacity, and compares it to
+sampling with np.random.choice over the full priorities array.
+
+Usage: python3 benchmarks/prioritized_replay_benchmark.py [-c 1000000] [-b 32]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from memories.prioritized_experience_replay import SumTree, MinTree
+
+
+def measure(func, num_iterations):
+    start = time.time()
+    for _ in range(num_iterations):
+        func()
+    return (time.time() - start) / num_iterations
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--capacity', help="(int) Number of transitions in the memory", default=1000000, type=int)
+    parser.add_argument('-b', '--batch_size', help="(int) Number of transitions in a batch", default=32, type=int)
+    parser.add_argument('-i', '--iterations', help="(int) Number of timed iterations", default=1000, type=int)
+    args = parser.parse_args()
+
+    priorities = np.random.uniform(size=args.capacity)
+    sum_tree = SumTree(args.capacity)
+    min_tree = MinTree(args.capacity)
+    start = time.time()
+    sum_tree.update(np.arange(args.capacity), priorities)
+    min_tree.update(np.arange(args.capacity), priorities)
+    print("Filling the trees with {} priorities: {:.3f} sec".format(args.capacity, time.time() - start))
+
+    def tree_sample():
+        segment_length = sum_tree.reduce() / args.batch_size
+        prefix_sums = (np.arange(args.batch_size) + np.random.uniform(size=args.batch_size)) * segment_length
+        indices = sum_tree.find_prefix_sum_indices(prefix_sums)
+        return indices, (sum_tree.get(indices) / min_tree.reduce()) ** -0.4
+
+    def tree_update():
+        indices = np.random.randint(args.capacity, size=args.batch_size)
+        new_priorities = np.random.uniform(size=args.batch_size)
+        sum_tree.update(indices, new_priorities)
+        min_tree.update(indices, new_priorities)
+
+    def naive_sample():
+        probabilities = priorities / priorities.sum()
+        return np.random.choice(args.capacity, size=args.batch_size, p=probabilities)
+
+    for name, func, num_iterations in [('sum tree sample', tree_sample, args.iterations),
+                                       ('sum tree update', tree_update, args.iterations),
+                                       ('np.random.choice sample', naive_sample, max(1, args.iterations // 100))]:
+        seconds = measure(func, num_iterations)
+        print("{}: {:.1f} usec per batch, {:.0f} batches per sec".format(name, seconds * 1e6, 1.0 / seconds))
@@ -23,6 +23,8 @@ from utils import set_gpu, list_all_classes_in_module
 from architectures import *
 from environments import *
 from agents import *
+from memories.shared_experience_replay import create_shared_replay, destroy_shared_replay
+from memories.shared_dnd import start_shared_dnd, stop_shared_dnd
 from utils import *
 from logger import screen, logger
 import argparse
@@ -301,6 +303,18 @@ if __name__ == "__main__":
         screen.log_title("*** Distributed Training ***")
         time.sleep(1)
 
+        # a shared replay memory is created before the workers start, and removed after they exit
+        tuning_parameters = json_to_preset(run_dict_to_json(run_dict))
+        if tuning_parameters.memory == 'SharedExperienceReplay':
+            run_dict['agent.shared_replay_name'] = create_shared_replay(run_dict['experiment_path'],
+                                                                        run_dict['num_threads'])
+            atexit.register(destroy_shared_replay, run_dict['experiment_path'], run_dict['agent.shared_replay_name'])
+
+        # the workers of DND based agents share a single DND, which is owned by a writer process
+        if OutputTypes.DNDQ in tuning_parameters.agent.output_types:
+            run_dict['agent.shared_dnd_name'], dnd_writer = start_shared_dnd(tuning_parameters)
+            atexit.register(stop_shared_dnd, run_dict['agent.shared_dnd_name'], dnd_writer)
+
         # create N training workers and 1 evaluating worker
         workers = []
 
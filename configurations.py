@@ -80,6 +80,9 @@ class AgentParameters(Parameters):
     input_types = {'observation': InputTypes.Observation}
     output_types = [OutputTypes.Q]
     middleware_type = MiddlewareTypes.FC
+    rnn_sequence_length = None  # train the LSTM middleware on sequences of this many training steps
+    rnn_burn_in_steps = 0  # steps before each training sequence which only initialize the LSTM state
+    store_rnn_states = False  # store the LSTM state in the transitions and start the training sequences from it
     loss_weights = [1.0]
     stop_gradients_from_head = [False]
     embedder_complexity = EmbedderComplexity.Shallow
@@ -101,6 +104,16 @@ class AgentParameters(Parameters):
     n_step = -1
     num_episodes_in_experience_replay = 200
     num_transitions_in_experience_replay = None
+    deduplicate_observation_frames = False  # store each stacked frame once (ColumnarExperienceReplay only)
+    replay_storage = 'InMemoryReplayStorage'  # or 'MemoryMappedReplayStorage' (ColumnarExperienceReplay only)
+    replay_storage_path = None  # directory of the memory mapped replay. defaults to <experiment path>/replay_buffer
+    compress_observations = False  # keep the observations zlib compressed (ColumnarExperienceReplay only)
+    num_decompression_threads = 4
+    shared_replay_name = None  # set by coach.py for multi-worker runs with SharedExperienceReplay
+    prioritized_replay_alpha = 0.6
+    prioritized_replay_beta = 0.4
+    prioritized_replay_beta_annealing_steps = 1000000
+    prioritized_replay_epsilon = 1e-6
     discount = 0.99
     policy_gradient_rescaler = 'A_VALUE'
     apply_gradients_every_x_episodes = 5
@@ -113,7 +126,10 @@ class AgentParameters(Parameters):
     step_until_collecting_full_episodes = False
     targets_horizon = 'N-Step'
     replace_mse_with_huber_loss = False
-    load_memory_from_file_path = None
+    load_memory_from_file_path = None  # a chunked replay buffer directory or a pickled memory file
+    load_memory_in_background = False  # start training once the first chunk of a chunked replay buffer is loaded
+    num_memory_loading_threads = 4
+    replay_buffer_chunk_size = 10000  # minimal number of transitions in each chunk of a recorded replay buffer
     collect_new_data = True
     input_rescaler = 255.0
 
@@ -137,6 +153,11 @@ class AgentParameters(Parameters):
     new_value_shift_coefficient = 0.1
     number_of_knn = 50
     DND_key_error_threshold = 0.01
+    num_dnd_query_threads = 4  # the action dictionaries are queried in parallel by this many threads
+    dnd_index_type = 'AnnoyKNNIndex'  # or 'IVFKNNIndex' for an index which is updated without rebuilding, or
+    # 'BruteForceKNNIndex' for an exact search, which is usually faster for dictionaries of up to ~100K keys
+    shared_dnd_name = None  # set by coach.py for multi-worker NEC runs, where all the workers share a single DND
+    shared_dnd_publish_interval_sec = 30  # the interval between snapshots of the shared DND which the workers query
 
     # Framework support
     neon_support = False
@@ -145,6 +166,9 @@ class AgentParameters(Parameters):
     # distributed agents params
     shared_optimizer = True
     share_statistics_between_workers = True
+    # the shared statistics are cached by each worker, and synced with the parameter server on each training iteration
+    # and after this many pushes and reads of their mean. 0 syncs them on every push and read
+    shared_statistics_max_staleness_steps = 100
 
 
 class EnvironmentParameters(Parameters):
@@ -155,6 +179,9 @@ class EnvironmentParameters(Parameters):
     desired_observation_width = 76
     desired_observation_height = 60
     normalize_observation = False
+    # feed the raw observations to the network, which converts the images to grayscale, resizes them and normalizes
+    # the vector observations in the graph. the raw observations are the ones which are stored in the memory
+    preprocess_observation_in_graph = False
     crop_observation = False
     random_initialization_steps = 0
     reward_scaling = 1.0
@@ -207,9 +234,14 @@ class GeneralParameters(Parameters):
     num_threads = 1
     synchronize_over_num_threads = 1
     distributed = False
+    # each worker acts on this many copies of the environment, with a single batched action choice for all of them
+    num_envs_per_worker = 1
+    # 'sync' or 'async' to step the environments of the worker in subprocesses. in async mode the agent acts on the
+    # environments which finish their step first
+    environment_pool_mode = None
 
     # Agent blocks
-    memory = 'EpisodicExperienceReplay'
+    memory = 'EpisodicExperienceReplay'  # or 'ColumnarExperienceReplay' / 'PrioritizedExperienceReplay' / 'SharedExperienceReplay'
     architecture = 'GeneralTensorFlowNetwork'
 
     # General parameters
@@ -228,8 +260,19 @@ class GeneralParameters(Parameters):
     evaluation_episodes = 5
     evaluate_every_x_episodes = 1000000
     evaluate_every_x_training_iterations = 0
-    rescaling_interpolation_type = 'bilinear'
+    rescaling_interpolation_type = 'bilinear'  # or 'nearest' / 'area' / 'bicubic' / 'lanczos'
+    # the preprocessing of image observations. 'ScipyImagePreprocessor' uses scipy.misc.imresize, which was removed in
+    # scipy 1.3
+    image_preprocessor = 'FastImagePreprocessor'
     current_episode = 0
+    prefetch_batches = 0  # number of batches which are sampled ahead on a background thread. 0 disables prefetching
+    # act on a separate thread while training, instead of alternating between the consecutive playing and training
+    # steps. replay_ratio is the number of training steps per acting step, which is by default the ratio between the
+    # consecutive training and playing steps. each of the threads waits when it gets more than replay_ratio_max_lag
+    # training steps ahead of the ratio, which is by default the number of consecutive training steps
+    decoupled_acting_and_training = False
+    replay_ratio = None
+    replay_ratio_max_lag = None
 
     # setting a seed will only work for non-parallel algorithms. Parallel algorithms add uncontrollable noise in
     # the form of different workers starting at different times, and getting different assignments of CPU
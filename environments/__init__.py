@@ -19,6 +19,8 @@ from utils import Enum, get_open_port
 from environments.gym_environment_wrapper import *
 from environments.doom_environment_wrapper import *
 from environments.carla_environment_wrapper import *
+from environments.vectorized_environment_wrapper import *
+from environments.subprocess_environment_pool import *
 
 
 class EnvTypes(Enum):
@@ -28,9 +30,41 @@ class EnvTypes(Enum):
 
 
 def create_environment(tuning_parameters):
+    if tuning_parameters.environment_pool_mode is not None and tuning_parameters.num_envs_per_worker > 1:
+        # all the copies run in subprocesses, and the environment of the worker is the first of them
+        return SubprocessEnvironmentPool(tuning_parameters, tuning_parameters.environment_pool_mode).envs[0]
+    return create_single_environment(tuning_parameters)
+
+
+def create_single_environment(tuning_parameters):
     env_type_name, env_type = EnvTypes().verify(tuning_parameters.env.type)
     env = eval(env_type)(tuning_parameters)
     return env
 
 
+def create_vectorized_environment(tuning_parameters, env):
+    """
+    Create the copies of an environment for acting on num_envs_per_worker environments in a single worker
+    :param tuning_parameters: A Preset class instance with all the running paramaters
+    :param env: the environment which was already created for the worker. it is used as the first copy
+    :return: a VectorizedEnvironmentWrapper, or the SubprocessEnvironmentPool of env if environment_pool_mode is set
+    """
+    if tuning_parameters.environment_pool_mode is not None:
+        return env.pool
+
+    envs = [env]
+    seed = tuning_parameters.seed
+    render = tuning_parameters.visualization.render
+    try:
+        # only the first copy is rendered, and each copy is seeded differently
+        tuning_parameters.visualization.render = False
+        for env_idx in range(1, tuning_parameters.num_envs_per_worker):
+            tuning_parameters.seed = None if seed is None else seed + env_idx
+            envs.append(create_single_environment(tuning_parameters))
+    finally:
+        tuning_parameters.seed = seed
+        tuning_parameters.visualization.render = render
+    return VectorizedEnvironmentWrapper(envs)
+
+
 
@@ -0,0 +1,319 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import multiprocessing
+import time
+from multiprocessing.connection import wait
+
+import numpy as np
+from utils import Signal
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    # shared memory segments are available from python 3.8
+    shared_memory = None
+
+# each environment writes its observations to two alternating slots, so an observation which was returned by the pool
+# stays valid until the environment is stepped twice more
+NUM_OBSERVATION_SLOTS = 2
+
+# the properties of the action and observation spaces which are sent by each subprocess when its environment is created
+ENVIRONMENT_PROPERTIES = ['width', 'height', 'action_space_size', 'action_space_low', 'action_space_high',
+                          'action_space_abs_range', 'actions_description', 'discrete_controls', 'is_state_type_image',
+                          'measurements_size', 'timestep_limit']
+
+
+def _run_environment(create_environment, tuning_parameters, connection):
+    """
+    The main loop of an environment subprocess. The observations are written to a shared memory segment which is
+    created by the pool, and the rest of the results are sent through the connection.
+    """
+    env = create_environment(tuning_parameters)
+    observation = np.asarray(env.state['observation'])
+    connection.send(('environment', {name: getattr(env, name) for name in ENVIRONMENT_PROPERTIES if hasattr(env, name)},
+                     observation.shape, observation.dtype.str))
+    # the segment is attached through the resource tracker of the pool, so it stays registered until the pool
+    # unlinks it
+    segment = shared_memory.SharedMemory(name=connection.recv())
+    observation_buffer = np.ndarray((NUM_OBSERVATION_SLOTS,) + observation.shape, dtype=observation.dtype,
+                                    buffer=segment.buf)
+    slot = 0
+
+    def send_result(command, result, step_time=0):
+        nonlocal slot
+        state = dict(result['state'])
+        slot = (slot + 1) % NUM_OBSERVATION_SLOTS
+        observation_buffer[slot] = state.pop('observation')
+        connection.send((command, dict(result, state=state), slot, step_time))
+
+    # the environment is reset when it is created
+    send_result('reset', {'state': env.state, 'reward': env.reward, 'done': env.done,
+                          'action': env.last_action_idx, 'info': env.info})
+    try:
+        while True:
+            command, argument = connection.recv()
+            if command == 'step':
+                start_time = time.time()
+                result = env.step(argument)
+                send_result(command, result, time.time() - start_time)
+            elif command == 'reset':
+                send_result(command, env.reset(argument))
+            elif command == 'change_phase':
+                env.change_phase(argument)
+            elif command == 'get_rendered_image':
+                connection.send(env.get_rendered_image())
+            elif command == 'close':
+                break
+    except (EOFError, KeyboardInterrupt):
+        # the agent exited
+        pass
+
+
+class SubprocessEnvironment(object):
+    """
+    An environment which runs in a subprocess of a SubprocessEnvironmentPool, with the properties of its action and
+    observation spaces and its last state. It can also be stepped on its own, like an EnvironmentWrapper, so the first
+    environment of the pool serves as the environment of the agent.
+    """
+    def __init__(self, pool, env_idx, properties):
+        """
+        :param pool: the SubprocessEnvironmentPool which runs the environment
+        :param env_idx: the index of the environment in the pool
+        :param properties: the values of ENVIRONMENT_PROPERTIES in the environment
+        """
+        self.pool = pool
+        self.env_idx = env_idx
+        self.state = None
+        self.measurements = None
+        self.__dict__.update(properties)
+
+    def step(self, action_idx):
+        """
+        Perform a single step on the environment using the given action
+        :param action_idx: the action to perform on the environment
+        :return: A dictionary containing the state, reward, done flag and action
+        """
+        assert self.env_idx not in self.pool.pending_env_indices, 'The environment is already stepping'
+        self.pool.send([self.env_idx], [action_idx])
+        return self._copy_observation(self.pool._receive_step_result(self.env_idx))
+
+    def reset(self, force_environment_reset=False):
+        """
+        Reset the environment
+        :param force_environment_reset: forces environment reset even when the game did not end
+        :return: A dictionary containing the state, reward, done flag and action
+        """
+        # a step which was sent by the pool is dropped, since its episode is restarted anyway
+        if self.env_idx in self.pool.pending_env_indices:
+            self.pool._receive_step_result(self.env_idx)
+        return self._copy_observation(self.pool.reset(self.env_idx, force_environment_reset))
+
+    def change_phase(self, phase):
+        """
+        Change the current phase of the run
+        :param phase: The running phase of the algorithm
+        :type phase: RunPhase
+        """
+        self.pool.connections[self.env_idx].send(('change_phase', phase))
+
+    def get_random_action(self):
+        """
+        Returns an action picked uniformly from the available actions
+        :return: a numpy array with a random action
+        """
+        if self.discrete_controls:
+            return np.random.choice(self.action_space_size)
+        else:
+            return np.random.uniform(self.action_space_low, self.action_space_high)
+
+    def get_rendered_image(self):
+        """
+        :return: numpy array containing the image that will be rendered to the screen
+        """
+        assert self.env_idx not in self.pool.pending_env_indices, 'The environment is stepping'
+        self.pool.connections[self.env_idx].send(('get_rendered_image', None))
+        return self.pool.connections[self.env_idx].recv()
+
+    def _copy_observation(self, result):
+        # the observations which are kept by the agent across steps are copied out of the observation buffer
+        result['state']['observation'] = np.array(result['state']['observation'])
+        return result
+
+
+class SubprocessEnvironmentPool(object):
+    """
+    Runs copies of an environment in subprocesses, so that the environments are stepped in parallel to each other and
+    to the agent. The observations are written by the subprocesses to shared memory buffers, and only the actions,
+    rewards, done flags and infos go through the pipes. The returned observations are views of the shared buffers,
+    which are valid until the environment is stepped twice more, so they should be preprocessed or copied by then.
+
+    In 'sync' mode, receive waits for all the environments which were sent an action. In 'async' mode, it returns as
+    soon as one of them is done, together with any other environment which is done by then, so that the agent can act
+    on the first environments which are ready while the slower ones are still stepping.
+
+    The properties of the action and observation spaces are the ones of the first environment, which are sent by its
+    subprocess.
+    """
+    def __init__(self, tuning_parameters, mode='sync'):
+        """
+        :param tuning_parameters: A Preset class instance with all the running paramaters
+        :param mode: 'sync' or 'async'
+        """
+        assert shared_memory is not None, 'The subprocess environment pool requires python 3.8 or newer'
+        assert mode in ['sync', 'async'], 'The environment pool mode should be sync or async'
+        from environments import create_single_environment
+
+        self.mode = mode
+        self.num_envs = tuning_parameters.num_envs_per_worker
+        self.envs = []
+        self.pending_env_indices = set()
+        self.connections = []
+        self.processes = []
+        self.segments = []
+        self.observation_buffers = []
+
+        self.signals = []
+        self.step_time = [Signal('Environment {} Step Time'.format(env_idx)) for env_idx in range(self.num_envs)]
+        self.signals.extend(self.step_time)
+        self.wait_time = Signal('Environment Wait Time')
+        self.signals.append(self.wait_time)
+
+        # the environments are forked, since the tuning parameters hold objects which can't be pickled. they share the
+        # resource tracker of this process, which removes the shared memory segments if close is not called
+        context = multiprocessing.get_context('fork')
+        resource_tracker.ensure_running()
+        seed = tuning_parameters.seed
+        render = tuning_parameters.visualization.render
+        try:
+            # only the first copy is rendered, and each copy is seeded differently
+            for env_idx in range(self.num_envs):
+                tuning_parameters.seed = None if seed is None else seed + env_idx
+                tuning_parameters.visualization.render = render and env_idx == 0
+                connection, child_connection = context.Pipe()
+                process = context.Process(target=_run_environment,
+                                          args=(create_single_environment, tuning_parameters, child_connection))
+                process.daemon = True
+                process.start()
+                child_connection.close()
+                self.connections.append(connection)
+                self.processes.append(process)
+        finally:
+            tuning_parameters.seed = seed
+            tuning_parameters.visualization.render = render
+
+        # the observation buffers are created by the pool, so that they are removed by close even if a subprocess
+        # was killed
+        for env_idx, connection in enumerate(self.connections):
+            _, properties, shape, dtype = connection.recv()
+            shape, dtype = (NUM_OBSERVATION_SLOTS,) + tuple(shape), np.dtype(dtype)
+            segment = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+            self.segments.append(segment)
+            self.observation_buffers.append(np.ndarray(shape, dtype=dtype, buffer=segment.buf))
+            connection.send(segment.name)
+            self.envs.append(SubprocessEnvironment(self, env_idx, properties))
+
+        for env_idx in range(self.num_envs):
+            self._receive_result(env_idx)
+
+    def __getattr__(self, name):
+        # the action and observation space properties are the same for all the copies
+        if name.startswith('__') or name in ('env', 'envs'):
+            raise AttributeError(name)
+        return getattr(self.envs[0], name)
+
+    @property
+    def ready_env_indices(self):
+        """
+        :return: the indices of the environments which are waiting for an action
+        """
+        return [env_idx for env_idx in range(self.num_envs) if env_idx not in self.pending_env_indices]
+
+    def send(self, env_indices, actions):
+        """
+        Start a step of some of the environments
+        :param env_indices: the indices of the environments
+        :param actions: an action index for each of the environments
+        """
+        for env_idx, action in zip(env_indices, actions):
+            self.connections[env_idx].send(('step', action))
+            self.pending_env_indices.add(env_idx)
+
+    def receive(self):
+        """
+        Wait for the environments which were sent an action
+        :return: a list of (environment index, result dictionary) pairs
+        """
+        start_time = time.time()
+        pending_connections = {self.connections[env_idx]: env_idx for env_idx in self.pending_env_indices}
+        ready_env_indices = []
+        while pending_connections:
+            ready_connections = wait(list(pending_connections.keys()))
+            ready_env_indices += [pending_connections.pop(connection) for connection in ready_connections]
+            if self.mode == 'async':
+                break
+        self.wait_time.add_sample(time.time() - start_time)
+
+        return [(env_idx, self._receive_step_result(env_idx)) for env_idx in sorted(ready_env_indices)]
+
+    def reset(self, env_idx, force_environment_reset=False):
+        """
+        Reset one of the environments
+        :param env_idx: the index of the environment
+        :param force_environment_reset: forces environment reset even when the game did not end
+        :return: the result dictionary of the environment
+        """
+        assert env_idx not in self.pending_env_indices, 'An environment can not be reset while it is stepping'
+        self.connections[env_idx].send(('reset', force_environment_reset))
+        return self._receive_result(env_idx)
+
+    def change_phase(self, phase):
+        """
+        Change the current phase of the run in all the environments
+        :param phase: The running phase of the algorithm
+        :type phase: RunPhase
+        """
+        for connection in self.connections:
+            connection.send(('change_phase', phase))
+
+    def close(self):
+        """
+        Stop the environment subprocesses and remove their observation buffers
+        """
+        for connection, process in zip(self.connections, self.processes):
+            if process.is_alive():
+                connection.send(('close', None))
+            process.join()
+        # the views of the observation buffers are dropped before the segments are closed
+        self.observation_buffers = []
+        for env in self.envs:
+            env.state = None
+        for segment in self.segments:
+            segment.unlink()
+            segment.close()
+        self.segments = []
+
+    def _receive_step_result(self, env_idx):
+        self.pending_env_indices.remove(env_idx)
+        return self._receive_result(env_idx)
+
+    def _receive_result(self, env_idx):
+        command, result, slot, step_time = self.connections[env_idx].recv()
+        if command == 'step':
+            self.step_time[env_idx].add_sample(step_time)
+        result['state']['observation'] = self.observation_buffers[env_idx][slot]
+        self.envs[env_idx].state = result['state']
+        self.envs[env_idx].measurements = result['state'].get('measurements')
+        return result
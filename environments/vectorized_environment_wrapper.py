@@ -0,0 +1,77 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+class VectorizedEnvironmentWrapper(object):
+    """
+    Holds several copies of an environment, which are stepped together with one action for each copy. The properties
+    of the action and observation spaces are the ones of the first copy.
+    """
+    def __init__(self, envs):
+        """
+        :param envs: a list of EnvironmentWrapper instances of the same environment
+        """
+        self.envs = envs
+        self.num_envs = len(envs)
+        self.pending_actions = {}
+
+    def __getattr__(self, name):
+        # the action and observation space properties are the same for all the copies
+        if name.startswith('__') or name in ('env', 'envs'):
+            raise AttributeError(name)
+        return getattr(self.envs[0], name)
+
+    @property
+    def ready_env_indices(self):
+        """
+        :return: the indices of the environments which are waiting for an action
+        """
+        return [env_idx for env_idx in range(self.num_envs) if env_idx not in self.pending_actions]
+
+    def send(self, env_indices, actions):
+        """
+        Set the actions of some of the environments, which are performed by the next receive
+        :param env_indices: the indices of the environments
+        :param actions: an action index for each of the environments
+        """
+        self.pending_actions.update(zip(env_indices, actions))
+
+    def receive(self):
+        """
+        Perform the actions which were sent to the environments
+        :return: a list of (environment index, result dictionary) pairs
+        """
+        results = [(env_idx, self.envs[env_idx].step(action))
+                   for env_idx, action in sorted(self.pending_actions.items())]
+        self.pending_actions = {}
+        return results
+
+    def reset(self, env_idx, force_environment_reset=False):
+        """
+        Reset one of the environments
+        :param env_idx: the index of the environment
+        :param force_environment_reset: forces environment reset even when the game did not end
+        :return: the result dictionary of the environment
+        """
+        return self.envs[env_idx].reset(force_environment_reset)
+
+    def change_phase(self, phase):
+        """
+        Change the current phase of the run in all the environments
+        :param phase: The running phase of the algorithm
+        :type phase: RunPhase
+        """
+        for env in self.envs:
+            env.change_phase(phase)
@@ -0,0 +1,203 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import numpy as np
+
+# the luma weights of the r, g and b channels
+_LUMA_WEIGHTS = np.array([0.2989, 0.5870, 0.1140], dtype=np.float32)
+
+
+def _box_filter(x):
+    return ((x > -0.5) & (x <= 0.5)).astype(np.float64)
+
+
+def _triangle_filter(x):
+    return np.maximum(1.0 - np.abs(x), 0.0)
+
+
+def _cubic_filter(x, a=-0.5):
+    x = np.abs(x)
+    return np.where(x < 1.0, ((a + 2.0) * x - (a + 3.0)) * x * x + 1,
+                    np.where(x < 2.0, (((x - 5) * x + 8) * x - 4) * a, 0.0))
+
+
+def _lanczos_filter(x):
+    return np.where(np.abs(x) < 3.0, np.sinc(x) * np.sinc(x / 3.0), 0.0)
+
+
+# the support and the kernel of each of the interpolation types
+_RESAMPLING_FILTERS = {
+    'area': (0.5, _box_filter),
+    'bilinear': (1.0, _triangle_filter),
+    'bicubic': (2.0, _cubic_filter),
+    'cubic': (2.0, _cubic_filter),
+    'lanczos': (3.0, _lanczos_filter),
+}
+
+
+def resampling_matrix(input_size, output_size, interpolation):
+    """
+    Calculate the weights of the input pixels which make each output pixel when resizing an axis of an image, the way
+    PIL does. When downscaling, the filter is stretched over the input pixels which fall in each output pixel.
+    :param input_size: the size of the input axis
+    :param output_size: the size of the output axis
+    :param interpolation: 'nearest', 'area', 'bilinear', 'bicubic' or 'lanczos'
+    :return: an [output size, input size] float32 matrix
+    """
+    scale = float(input_size) / output_size
+    centers = (np.arange(output_size) + 0.5) * scale
+    matrix = np.zeros((output_size, input_size), dtype=np.float32)
+    if interpolation == 'nearest':
+        matrix[np.arange(output_size), np.minimum(centers.astype(np.int64), input_size - 1)] = 1
+        return matrix
+    if interpolation not in _RESAMPLING_FILTERS:
+        raise ValueError("The interpolation type {} is not supported".format(interpolation))
+
+    support, kernel = _RESAMPLING_FILTERS[interpolation]
+    filter_scale = max(scale, 1.0)
+    support *= filter_scale
+    num_taps = int(np.ceil(support)) * 2 + 1
+    indices = np.floor(centers - support + 0.5).astype(np.int64)[:, np.newaxis] + np.arange(num_taps)
+    weights = kernel((indices + 0.5 - centers[:, np.newaxis]) / filter_scale)
+    # pixels outside of the image are dropped, and the weights of the rest are normalized
+    inside = (indices >= 0) & (indices < input_size)
+    weights[~inside] = 0
+    weights /= np.sum(weights, axis=1, keepdims=True)
+    rows = np.repeat(np.arange(output_size)[:, np.newaxis], num_taps, axis=1)
+    matrix[rows[inside], indices[inside]] = weights[inside]
+    return matrix
+
+
+class ImagePreprocessor(object):
+    """
+    Converts the image observations of an environment to grayscale uint8 images of the size which the networks get
+    """
+    def __init__(self, height, width, interpolation='bilinear'):
+        """
+        :param height: the height of the preprocessed images
+        :param width: the width of the preprocessed images
+        :param interpolation: the interpolation type which is used for resizing the images
+        """
+        self.height = height
+        self.width = width
+        self.interpolation = interpolation
+
+    def preprocess(self, observation, out=None):
+        """
+        :param observation: an [height, width] or [height, width, channels] image
+        :param out: an optional [height, width] uint8 array to write the preprocessed image to
+        :return: the [height, width] uint8 preprocessed image
+        """
+        pass
+
+    def preprocess_batch(self, observations, out=None):
+        """
+        :param observations: a list of images of the same shape, like the observations of a vectorized environment
+        :param out: an optional [batch, height, width] uint8 array to write the preprocessed images to
+        :return: the [batch, height, width] uint8 preprocessed images
+        """
+        if out is None:
+            out = np.empty((len(observations), self.height, self.width), dtype=np.uint8)
+        for observation, observation_out in zip(observations, out):
+            self.preprocess(observation, out=observation_out)
+        return out
+
+
+class ScipyImagePreprocessor(ImagePreprocessor):
+    """
+    Resizes the images with scipy.misc.imresize, which goes through PIL, and converts them to grayscale afterwards in
+    float64. This requires scipy < 1.3 and PIL.
+    """
+    def preprocess(self, observation, out=None):
+        import scipy.misc
+        observation = scipy.misc.imresize(observation, (self.height, self.width), interp=self.interpolation)
+        # rgb to y
+        if len(observation.shape) > 2 and observation.shape[2] > 1:
+            r, g, b = observation[:, :, 0], observation[:, :, 1], observation[:, :, 2]
+            observation = 0.2989 * r + 0.5870 * g + 0.1140 * b
+        if out is None:
+            return observation.astype('uint8')
+        out[...] = observation
+        return out
+
+
+class FastImagePreprocessor(ImagePreprocessor):
+    """
+    Converts the images to grayscale before resizing them, and resizes them with the separable filters of PIL as two
+    float32 matrix products, one for the columns and one for the rows. The resampling matrices and the intermediate
+    buffers are created once for each input shape. A batch of images is resized with a single product for the columns
+    of all the images and a single batched product for their rows.
+    The supported interpolation types are 'nearest', 'area', 'bilinear', 'bicubic' and 'lanczos'.
+    """
+    def __init__(self, height, width, interpolation='bilinear'):
+        super(FastImagePreprocessor, self).__init__(height, width, interpolation)
+        # fails early on an unsupported interpolation type
+        resampling_matrix(2, 1, interpolation)
+        self.resampling_matrices = {}
+        self.buffers = {}
+
+    def preprocess(self, observation, out=None):
+        return self.preprocess_batch([observation], None if out is None else out[np.newaxis])[0]
+
+    def preprocess_batch(self, observations, out=None):
+        observations = [np.asarray(observation) for observation in observations]
+        if out is None:
+            out = np.empty((len(observations), self.height, self.width), dtype=np.uint8)
+        if len(observations) == 0:
+            return out
+
+        input_height, input_width = observations[0].shape[:2]
+        rows_matrix, columns_matrix = self._get_resampling_matrices(input_height, input_width)
+        rgb, gray, resized_columns, resized = self._get_buffers(len(observations), observations[0].shape)
+
+        for observation, gray_observation in zip(observations, gray):
+            if observation.ndim == 2:
+                np.copyto(gray_observation, observation)
+            elif observation.shape[2] == 1:
+                np.copyto(gray_observation, observation[:, :, 0])
+            else:
+                # the channels are weighted with a single matrix product, which is much faster than weighting the
+                # strided channels separately
+                np.copyto(rgb, observation[:, :, :3])
+                np.dot(rgb.reshape(-1, 3), _LUMA_WEIGHTS, out=gray_observation.reshape(-1))
+
+        np.dot(gray.reshape(-1, input_width), columns_matrix, out=resized_columns.reshape(-1, self.width))
+        np.matmul(rows_matrix, resized_columns, out=resized)
+        resized += 0.5
+        np.clip(resized, 0, 255, out=resized)
+        np.copyto(out, resized, casting='unsafe')
+        return out
+
+    def _get_resampling_matrices(self, input_height, input_width):
+        key = (input_height, input_width)
+        if key not in self.resampling_matrices:
+            self.resampling_matrices[key] = (
+                resampling_matrix(input_height, self.height, self.interpolation),
+                np.ascontiguousarray(resampling_matrix(input_width, self.width, self.interpolation).T))
+        return self.resampling_matrices[key]
+
+    def _get_buffers(self, batch_size, observation_shape):
+        key = (batch_size,) + observation_shape
+        if key not in self.buffers:
+            input_height, input_width = observation_shape[:2]
+            is_rgb = len(observation_shape) > 2 and observation_shape[2] > 1
+            self.buffers[key] = (
+                np.empty((input_height, input_width, 3), dtype=np.float32) if is_rgb else None,
+                np.empty((batch_size, input_height, input_width), dtype=np.float32),
+                np.empty((batch_size, input_height, self.width), dtype=np.float32),
+                np.empty((batch_size, self.height, self.width), dtype=np.float32),
+            )
+        return self.buffers[key]
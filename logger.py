@@ -15,6 +15,7 @@
 #
 
 from pandas import *
+import csv
 import os
 import re
 from pprint import pprint
@@ -26,6 +27,7 @@ from six.moves import input
 from PIL import Image
 from typing import Union
 import shutil
+from collections import OrderedDict
 
 global failed_imports
 failed_imports = []
@@ -154,9 +156,26 @@ class BaseLogger(object):
 
 
 class Logger(BaseLogger):
-    def __init__(self):
+    """
+    Logs the values of the signals in rows, which are indexed by the time (the episode number). The rows are kept in
+    dictionaries and are appended to the csv file when it is dumped, so logging a value takes a constant time. Only the
+    rows which were not written yet and a bounded tail of the written rows are kept in memory. The columns of the csv
+    file are the signals in the order in which they were first logged. When a new signal is logged after the header
+    was written, the csv file is rewritten once with the new header.
+    """
+    def __init__(self, max_rows_in_memory=1000):
+        """
+        :param max_rows_in_memory: the number of rows which are kept in memory after they were written to the csv file
+        """
         BaseLogger.__init__(self)
-        self.data = DataFrame()
+        self.max_rows_in_memory = max_rows_in_memory
+        self.rows = OrderedDict()
+        # the values are logged by the acting thread and by the training thread, when they run separately
+        self.lock = threading.RLock()
+        self.columns = []
+        self.csv_columns = []
+        self.num_rows = 0
+        self.num_written_rows_in_memory = 0
         self.csv_path = ''
         self.doc_path = ''
         self.aggregated_data_across_threads = None
@@ -164,9 +183,18 @@ class Logger(BaseLogger):
         self.start_time = None
         self.time = None
         self.experiments_path = ""
-        self.last_line_idx_written_to_csv = 0
         self.experiment_name = ""
 
+    @property
+    def data(self):
+        """
+        :return: a DataFrame with the rows which are kept in memory
+        """
+        with self.lock:
+            data = DataFrame.from_dict(self.rows, orient='index', columns=self.columns)
+            data.index.name = "Episode #"
+            return data
+
     def set_current_time(self, time):
         self.time = time
 
@@ -196,45 +224,89 @@ class Logger(BaseLogger):
             path_exists = os.path.exists(self.csv_path) or os.path.exists(self.doc_path)
             idx += 1
 
+    def _get_row(self, time):
+        if time not in self.rows:
+            self.rows[time] = {}
+            self.num_rows += 1
+            # the oldest rows are dropped once they were written
+            while len(self.rows) > self.max_rows_in_memory and self.num_written_rows_in_memory > 0:
+                self.rows.popitem(last=False)
+                self.num_written_rows_in_memory -= 1
+        return self.rows[time]
+
     def create_signal_value(self, signal_name, value, overwrite=True, time=None):
         if not time:
             time = self.time
-        # create only if it doesn't already exist
-        if overwrite or not self.signal_value_exists(time, signal_name):
-            self.data.loc[time, signal_name] = value
-            return True
-        return False
+        with self.lock:
+            # create only if it doesn't already exist
+            if overwrite or not self.signal_value_exists(time, signal_name):
+                if signal_name not in self.columns:
+                    self.columns.append(signal_name)
+                self._get_row(time)[signal_name] = value
+                return True
+            return False
 
     def change_signal_value(self, signal_name, time, value):
-        # change only if it already exists
-        if self.signal_value_exists(time, signal_name):
-            self.data.loc[time, signal_name] = value
-            return True
-        return False
+        with self.lock:
+            # change only if it already exists
+            if self.signal_value_exists(time, signal_name):
+                self.rows[time][signal_name] = value
+                return True
+            return False
 
     def signal_value_exists(self, time, signal_name):
-        try:
-            value = self.get_signal_value(time, signal_name)
-            if value != value:  # value is nan
-                return False
-        except:
-            return False
-        return True
+        with self.lock:
+            value = self.rows.get(time, {}).get(signal_name)
+        # a nan value is not considered as set
+        return value is not None and value == value
 
     def get_signal_value(self, time, signal_name):
-        return self.data.loc[time, signal_name]
+        with self.lock:
+            return self.rows[time][signal_name]
 
     def dump_output_csv(self, append=True):
-        self.data.index.name = "Episode #"
-        if len(self.data.index) == 1:
-            self.start_time = time.time()
-
-        if os.path.exists(self.csv_path) and append:
-            self.data[self.last_line_idx_written_to_csv:].to_csv(self.csv_path, mode='a', header=False)
-        else:
-            self.data.to_csv(self.csv_path)
-
-        self.last_line_idx_written_to_csv = len(self.data.index)
+        """
+        Append the rows which were not written yet to the csv file
+        :param append: when False, the csv file is rewritten, which also happens when new signals were logged
+        :return: None
+        """
+        with self.lock:
+            if self.num_rows == 1:
+                self.start_time = time.time()
+
+            if not os.path.exists(self.csv_path) or not append or self.csv_columns != self.columns:
+                self._rewrite_csv_header()
+
+            rows = list(self.rows.items())[self.num_written_rows_in_memory:]
+            with open(self.csv_path, 'a', newline='') as csv_file:
+                writer = csv.writer(csv_file)
+                for row_time, row in rows:
+                    writer.writerow([row_time] +
+                                    [self._format_value(row.get(column, '')) for column in self.csv_columns])
+            self.num_written_rows_in_memory = len(self.rows)
+
+    def _rewrite_csv_header(self):
+        # the rows which were already written are copied to a file with the current columns, and missing values are
+        # left empty
+        with open(self.csv_path + '.tmp', 'w', newline='') as new_csv_file:
+            writer = csv.writer(new_csv_file)
+            writer.writerow(["Episode #"] + self.columns)
+            if os.path.exists(self.csv_path):
+                with open(self.csv_path, newline='') as csv_file:
+                    reader = csv.reader(csv_file)
+                    header = next(reader, None)
+                    for line in reader:
+                        values = dict(zip(header[1:], line[1:]))
+                        writer.writerow(line[:1] + [values.get(column, '') for column in self.columns])
+        os.replace(self.csv_path + '.tmp', self.csv_path)
+        self.csv_columns = list(self.columns)
+
+    @staticmethod
+    def _format_value(value):
+        # nan values are written as empty cells, like pandas writes them
+        if isinstance(value, float) and value != value:
+            return ''
+        return value
 
     def update_wall_clock_time(self, episode):
         if self.start_time:
@@ -259,8 +331,12 @@ class Logger(BaseLogger):
         screen.separator()
         screen.log_title("Results stored at: {}".format(self.experiments_path))
         screen.log_title("Total runtime: {}".format(datetime.datetime.now() - self.time_started))
-        if 'Training Reward' in self.data.keys() and 'Evaluation Reward' in self.data.keys():
-            screen.log_title("Max training reward: {}, max evaluation reward: {}".format(self.data['Training Reward'].max(), self.data['Evaluation Reward'].max()))
+        # only the tail of the rows is kept in memory, so the rest are read from the csv file
+        data = self.data
+        if os.path.exists(self.csv_path):
+            data = concat([read_csv(self.csv_path, index_col=0), data])
+        if 'Training Reward' in data.keys() and 'Evaluation Reward' in data.keys():
+            screen.log_title("Max training reward: {}, max evaluation reward: {}".format(data['Training Reward'].max(), data['Evaluation Reward'].max()))
         screen.separator()
         if screen.ask_yes_no("Do you want to discard the experiment results (Warning: this cannot be undone)?", False):
             self.remove_experiment_dir()
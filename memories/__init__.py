@@ -14,6 +14,14 @@
 # limitations under the License.
 #
 
+from memories.batch_prefetcher import *
+from memories.chunked_replay_buffer import *
+from memories.columnar_experience_replay import *
 from memories.differentiable_neural_dictionary import *
+from memories.dnd_index import *
 from memories.episodic_experience_replay import *
 from memories.memory import *
+from memories.prioritized_experience_replay import *
+from memories.replay_storage import *
+from memories.shared_dnd import *
+from memories.shared_experience_replay import *
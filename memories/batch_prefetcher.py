@@ -0,0 +1,90 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import threading
+import time
+from queue import Queue, Full
+
+from memories.columnar_experience_replay import *
+
+
+class BatchPrefetcher(object):
+    """
+    Samples batches from a memory and assembles them into arrays on a background thread, so that the next batches are
+    ready while the network trains on the current one. The memory is sampled while holding memory_lock, which must
+    also be held by anyone who changes the memory while the prefetcher is running.
+    """
+    def __init__(self, memory, batch_size, num_batches, memory_lock, use_measurements=False):
+        """
+        :param memory: the memory to sample the batches from
+        :param batch_size: the number of transitions in each batch
+        :param num_batches: the maximal number of batches which are prepared ahead
+        :param memory_lock: a threading.Lock which protects the memory
+        :param use_measurements: assemble the measurements of the states as well
+        """
+        self.memory = memory
+        self.batch_size = batch_size
+        self.memory_lock = memory_lock
+        self.use_measurements = use_measurements
+        self.queue = Queue(maxsize=num_batches)
+        # the queued batches must not share their arrays
+        self.batch_buffers = BatchBuffers(reuse_buffers=False)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._prefetch)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def get(self):
+        """
+        Get the next batch. Blocks until a batch is ready.
+        :return: the batch, the number of batches that were ready before the call and the time in seconds that was
+                 spent waiting for the batch
+        """
+        queue_occupancy = self.queue.qsize()
+        start_time = time.time()
+        batch = self.queue.get()
+        wait_time = time.time() - start_time
+        if isinstance(batch, Exception):
+            # the prefetching thread failed. the error is raised to the learner
+            raise batch
+        return batch, queue_occupancy, wait_time
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def _prefetch(self):
+        try:
+            while not self.stopped.is_set():
+                with self.memory_lock:
+                    batch = self.memory.sample(self.batch_size)
+                if not isinstance(batch, ColumnarBatch):
+                    states, next_states, actions, rewards, game_overs, total_returns = \
+                        self.batch_buffers.extract(batch, self.use_measurements)
+                    batch = ColumnarBatch(states, next_states, actions, rewards, game_overs, total_returns, info={},
+                                          transitions=batch)
+                self._put(batch)
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item):
+        # a timeout is used so that the thread can be stopped while the queue is full
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except Full:
+                pass
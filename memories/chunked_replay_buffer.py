@@ -0,0 +1,201 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from memories.memory import *
+
+# A recorded replay buffer is a directory with a manifest.json file and a list of chunk files. Each chunk holds a
+# few complete episodes as a compressed .npz file with one array per transition field, so the recording can be
+# appended to as episodes are finished, and the chunks can be read independently of each other.
+CHUNKED_REPLAY_BUFFER_FORMAT_VERSION = 1
+
+
+def is_chunked_replay_buffer(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, 'manifest.json'))
+
+
+class ChunkedReplayBufferWriter(object):
+    def __init__(self, path, transitions_per_chunk):
+        """
+        :param path: the directory to write the replay buffer to
+        :param transitions_per_chunk: the minimal number of transitions in each chunk. chunks contain only complete
+                                      episodes, so a chunk is written once this number of transitions is reached
+        """
+        self.path = path
+        self.transitions_per_chunk = transitions_per_chunk
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self.manifest_path = os.path.join(self.path, 'manifest.json')
+        self.chunks = []
+        self.pending_episodes = []
+        self.num_pending_transitions = 0
+
+    def add_episode(self, episode):
+        """
+        Add a complete episode to the recording
+        :param episode: an Episode object
+        """
+        if episode is None or episode.length() == 0:
+            return
+        self.pending_episodes.append(episode)
+        self.num_pending_transitions += episode.length()
+        if self.num_pending_transitions >= self.transitions_per_chunk:
+            self.flush()
+
+    def flush(self):
+        """
+        Write all the pending episodes to a new chunk
+        """
+        if not self.pending_episodes:
+            return
+        transitions = [transition for episode in self.pending_episodes for transition in episode.transitions]
+        columns = {
+            'episode_length': np.array([episode.length() for episode in self.pending_episodes]),
+            'action': np.array([transition.action for transition in transitions]),
+            'reward': np.array([transition.reward for transition in transitions], dtype='float'),
+            'game_over': np.array([transition.game_over for transition in transitions], dtype=np.bool_)
+        }
+        for prefix in ['state', 'next_state']:
+            for key in getattr(transitions[0], prefix).keys():
+                columns['{}/{}'.format(prefix, key)] = \
+                    np.array([np.array(getattr(transition, prefix)[key]) for transition in transitions])
+        # only numeric info fields which are set for all the transitions can be stored as arrays
+        for key in transitions[0].info.keys():
+            if all(key in transition.info for transition in transitions):
+                values = np.array([transition.info[key] for transition in transitions])
+                if values.dtype.kind in 'biuf':
+                    columns['info/{}'.format(key)] = values
+
+        file_name = 'chunk_{:05d}.npz'.format(len(self.chunks))
+        np.savez_compressed(os.path.join(self.path, file_name), **columns)
+        self.chunks.append({'file': file_name, 'num_episodes': len(self.pending_episodes),
+                            'num_transitions': len(transitions)})
+        self.pending_episodes = []
+        self.num_pending_transitions = 0
+        self._write_manifest()
+
+    def close(self):
+        self.flush()
+        self._write_manifest()
+
+    def _write_manifest(self):
+        # the manifest is replaced atomically, so a recording which was interrupted can still be read
+        temp_manifest_path = self.manifest_path + '.tmp'
+        with open(temp_manifest_path, 'w') as f:
+            json.dump({'format_version': CHUNKED_REPLAY_BUFFER_FORMAT_VERSION, 'chunks': self.chunks}, f)
+        os.replace(temp_manifest_path, self.manifest_path)
+
+
+class ChunkedReplayBufferReader(object):
+    def __init__(self, path, num_threads=4):
+        """
+        :param path: the directory of a replay buffer which was written by ChunkedReplayBufferWriter
+        :param num_threads: the number of chunks which are read and decompressed in parallel
+        """
+        self.path = path
+        self.num_threads = num_threads
+        with open(os.path.join(self.path, 'manifest.json'), 'r') as f:
+            manifest = json.load(f)
+        assert manifest['format_version'] == CHUNKED_REPLAY_BUFFER_FORMAT_VERSION, \
+            'Unsupported replay buffer format version {}'.format(manifest['format_version'])
+        self.chunks = manifest['chunks']
+
+    def num_transitions(self):
+        return sum(chunk['num_transitions'] for chunk in self.chunks)
+
+    def read_chunk(self, chunk):
+        """
+        :param chunk: a chunk description from the manifest
+        :return: a list of the Episode objects in the chunk
+        """
+        with np.load(os.path.join(self.path, chunk['file'])) as chunk_file:
+            columns = {name: chunk_file[name] for name in chunk_file.files}
+        states = {name.split('/', 1)[1]: column for name, column in columns.items() if name.startswith('state/')}
+        next_states = {name.split('/', 1)[1]: column for name, column in columns.items()
+                       if name.startswith('next_state/')}
+        info = {name.split('/', 1)[1]: column for name, column in columns.items() if name.startswith('info/')}
+
+        episodes = []
+        transition_idx = 0
+        for episode_length in columns['episode_length']:
+            episode = Episode()
+            for i in range(transition_idx, transition_idx + episode_length):
+                transition = Transition({key: val[i] for key, val in states.items()}, columns['action'][i],
+                                        columns['reward'][i], {key: val[i] for key, val in next_states.items()},
+                                        columns['game_over'][i])
+                for key, val in info.items():
+                    transition.info[key] = val[i]
+                episode.insert(transition)
+            transition_idx += episode_length
+            episodes.append(episode)
+        return episodes
+
+    def episodes(self):
+        """
+        Iterate over the recorded episodes in order. The following chunks are read in parallel while the episodes of
+        the current chunk are consumed.
+        """
+        with ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+            # at most num_threads chunks are held in memory before they are consumed
+            pending_chunks = deque(executor.submit(self.read_chunk, chunk) for chunk in self.chunks[:self.num_threads])
+            next_chunk_idx = len(pending_chunks)
+            while pending_chunks:
+                episodes = pending_chunks.popleft().result()
+                if next_chunk_idx < len(self.chunks):
+                    pending_chunks.append(executor.submit(self.read_chunk, self.chunks[next_chunk_idx]))
+                    next_chunk_idx += 1
+                for episode in episodes:
+                    yield episode
+
+    def load_into(self, memory, memory_lock, background=False):
+        """
+        Store all the recorded episodes in the given memory
+        :param memory: a Memory object
+        :param memory_lock: a threading.Lock which is held while storing each episode
+        :param background: keep loading in a background thread, and return once the first chunk was stored
+        :return: the loading thread if loading in the background, or None otherwise
+        """
+        if not background:
+            self._store_episodes(memory, memory_lock)
+            return None
+
+        first_chunk_stored = threading.Event()
+        loading_thread = threading.Thread(target=self._store_episodes, args=(memory, memory_lock, first_chunk_stored))
+        loading_thread.daemon = True
+        loading_thread.start()
+        first_chunk_stored.wait()
+        return loading_thread
+
+    def _store_episodes(self, memory, memory_lock, first_chunk_stored=None):
+        num_stored_transitions = 0
+        first_chunk_length = self.chunks[0]['num_transitions'] if self.chunks else 0
+        try:
+            for episode in self.episodes():
+                with memory_lock:
+                    for transition in episode.transitions:
+                        memory.store(transition)
+                num_stored_transitions += episode.length()
+                if first_chunk_stored is not None and num_stored_transitions >= first_chunk_length:
+                    first_chunk_stored.set()
+        finally:
+            # never leave the agent waiting, even if the loading failed
+            if first_chunk_stored is not None:
+                first_chunk_stored.set()
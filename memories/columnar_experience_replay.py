@@ -0,0 +1,629 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from memories.memory import *
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import time
+from typing import Union
+from utils import LazyStack, Signal
+from memories.replay_storage import *
+
+
+def gather_transitions(transitions):
+    """
+    Gather a list of Transition objects into arrays
+    :param transitions: a list of transitions
+    :return: a dictionary of the gathered columns, which matches the arguments of ColumnarBatch
+    """
+    def column(values, dtype=None):
+        return np.array([np.array(value) for value in values], dtype=dtype)
+
+    # only the info fields which are set for all the transitions are gathered
+    info_keys = [key for key in transitions[0].info.keys()
+                 if all(key in transition.info for transition in transitions)]
+    return {
+        'states': {key: column([transition.state[key] for transition in transitions])
+                   for key in transitions[0].state.keys()},
+        'next_states': {key: column([transition.next_state[key] for transition in transitions])
+                        for key in transitions[0].next_state.keys()},
+        'actions': column([transition.action for transition in transitions]),
+        'rewards': column([transition.reward for transition in transitions], np.float64),
+        'game_overs': column([transition.game_over for transition in transitions], np.bool_),
+        'total_returns': column([transition.total_return for transition in transitions], np.float64),
+        'info': {key: (column([transition.info[key] for transition in transitions]),
+                       np.ones(len(transitions), dtype=np.bool_)) for key in info_keys},
+        'transitions': transitions
+    }
+
+
+class ColumnarBatch(object):
+    """
+    A batch of transitions which is kept as one numpy array per transition field, as gathered from a
+    ColumnarExperienceReplay. Agent.extract_batch uses the arrays as they are, and the Transition objects are created
+    only if the batch is accessed as a list of transitions.
+    """
+    def __init__(self, states, next_states, actions, rewards, game_overs, total_returns, info, transitions=None):
+        """
+        :param states: a dictionary of the batched state arrays
+        :param next_states: a dictionary of the batched next state arrays
+        :param actions: a numpy array of the actions
+        :param rewards: a numpy array of the rewards
+        :param game_overs: a numpy array of the game over flags
+        :param total_returns: a numpy array of the total returns or None if the returns are not known yet
+        :param info: a dictionary of (values array, is set array) for each of the transitions info fields
+        :param transitions: the Transition objects of the batch, if the arrays were assembled from them
+        """
+        self.states = states
+        self.next_states = next_states
+        self.actions = actions
+        self.rewards = rewards
+        self.game_overs = game_overs
+        self.total_returns = total_returns
+        self.info = info
+        self._transitions = transitions
+
+    @property
+    def transitions(self):
+        if self._transitions is None:
+            self._transitions = []
+            for i in range(len(self)):
+                transition = Transition({key: val[i] for key, val in self.states.items()}, self.actions[i],
+                                        self.rewards[i], {key: val[i] for key, val in self.next_states.items()},
+                                        self.game_overs[i])
+                if self.total_returns is not None:
+                    transition.total_return = self.total_returns[i]
+                for key, (values, is_set) in self.info.items():
+                    if is_set[i]:
+                        transition.info[key] = values[i]
+                self._transitions.append(transition)
+        return self._transitions
+
+    def __len__(self):
+        return len(self.actions)
+
+    def __iter__(self):
+        return iter(self.transitions)
+
+    def __getitem__(self, index):
+        return self.transitions[index]
+
+
+class SequenceBatch(ColumnarBatch):
+    """
+    A batch of sequences of consecutive transitions for training recurrent networks, as sampled by sample_sequences.
+    Each sequence starts at a random transition and never crosses the end of its episode. Sequences which reach the
+    end of their episode are padded by repeating the last transition, and the padding is masked out. The columns are
+    flattened to num_sequences * sequence_length entries, sequence after sequence, which is how the LSTM middleware
+    expects its input.
+    """
+    def __init__(self, num_sequences, sequence_length, burn_in, mask, **columns):
+        """
+        :param num_sequences: the number of sequences in the batch
+        :param sequence_length: the number of steps in each sequence, including the burn in steps
+        :param burn_in: the number of steps at the start of each sequence which are used only to initialize the
+                        recurrent state
+        :param mask: a (num_sequences, sequence_length) boolean array which is False for the padding steps
+        :param columns: the flattened columns, as accepted by ColumnarBatch
+        """
+        ColumnarBatch.__init__(self, **columns)
+        self.num_sequences = num_sequences
+        self.sequence_length = sequence_length
+        self.burn_in = burn_in
+        self.mask = mask
+
+        # the padding and the burn in steps are excluded from the loss through the per-sample loss weights
+        importance_weights = mask.astype(np.float32)
+        importance_weights[:, :burn_in] = 0
+        self.importance_weights = importance_weights.reshape(-1)
+
+        # the recurrent state which was stored with the first transition of each sequence, if there is one
+        self.initial_rnn_states = None
+        if 'rnn_state' in self.info:
+            values, is_set = self.info['rnn_state']
+            if self.to_sequences(is_set)[:, 0].all():
+                self.initial_rnn_states = self.to_sequences(values)[:, 0]
+
+    def to_sequences(self, values):
+        """
+        :param values: a flattened column of the batch
+        :return: the column reshaped to (num_sequences, sequence_length, ...)
+        """
+        return values.reshape((self.num_sequences, self.sequence_length) + values.shape[1:])
+
+    @property
+    def rnn_inputs(self):
+        """
+        :return: the inputs of the LSTM middleware which describe the sequences
+        """
+        inputs = {'rnn_num_sequences': self.num_sequences, 'rnn_burn_in_steps': self.burn_in}
+        if self.initial_rnn_states is not None:
+            inputs['rnn_c_in'], inputs['rnn_h_in'] = np.split(self.initial_rnn_states, 2, axis=-1)
+        return inputs
+
+
+class ColumnarExperienceReplay(Memory):
+    """
+    An experience replay which stores the transitions in preallocated numpy arrays (one array per transition field)
+    that are used as a ring buffer. Storing a transition, evicting the oldest episode and sampling a batch do not
+    depend on the number of transitions in the memory. The API is the same as the EpisodicExperienceReplay API, but
+    the Transition and Episode objects it returns are copies of the stored data, so changing them does not change
+    the memory.
+
+    When agent.deduplicate_observation_frames is set, stacked observations are not stored as is. Every frame is
+    written once to a frame store, and each transition keeps only the indices of the frames in its state and next
+    state stacks. The stacks are rebuilt from the frame store when the transitions are read.
+
+    The columns are allocated by the storage class named in agent.replay_storage. With MemoryMappedReplayStorage the
+    columns are memory mapped files and the memory indices are saved whenever an episode is completed or evicted, so
+    the complete episodes can be reopened by a new process.
+
+    When agent.compress_observations is set, the observations (or the frames of the frame store) are kept zlib
+    compressed and are decompressed in bulk when a batch is gathered.
+    """
+    def __init__(self, tuning_parameters):
+        """
+        :param tuning_parameters: A Preset class instance with all the running paramaters
+        :type tuning_parameters: Preset
+        """
+        Memory.__init__(self, tuning_parameters)
+        self.tp = tuning_parameters
+        self.capacity = tuning_parameters.agent.num_transitions_in_experience_replay
+        assert self.capacity, 'ColumnarExperienceReplay requires agent.num_transitions_in_experience_replay to be set'
+        self.discount = tuning_parameters.agent.discount
+        self.return_is_bootstrapped = tuning_parameters.agent.bootstrap_total_return_from_old_policy
+        self.storage = self._create_storage(tuning_parameters)
+
+        # the columns are allocated lazily when the first transition that contains them is stored
+        self.states = {}
+        self.next_states = {}
+        self.actions = None
+        self.rewards = None
+        self.game_overs = None
+        self.total_returns = None
+        self.episode_starts = None
+        self.info = {}
+        self.info_is_set = {}
+
+        # frame store for the deduplicated observations. each episode adds one frame more than its length, so a bit
+        # of extra space is kept to avoid evicting transitions before the memory is full
+        self.deduplicate_frames = tuning_parameters.agent.deduplicate_observation_frames
+        self.frame_capacity = int(self.capacity * 1.1) + tuning_parameters.env.observation_stack_size
+        self.frames = None
+        self.frame_indices = {}
+        self.stack_axis = -1
+
+        self.signals = []
+        self.compress_observations = tuning_parameters.agent.compress_observations
+        if self.compress_observations:
+            assert not self.storage.is_persistent, 'Compressed observations can not be persisted'
+            self.num_decompression_threads = tuning_parameters.agent.num_decompression_threads
+            self.decompression_executor = ThreadPoolExecutor(max_workers=self.num_decompression_threads)
+            self.compression_ratio = Signal('Observations Compression Ratio')
+            self.signals.append(self.compression_ratio)
+            self.decompression_time = Signal('Observations Decompression Time')
+            self.signals.append(self.decompression_time)
+
+        self._reset_indices()
+        indices, columns = self.storage.load()
+        if indices is not None:
+            self._restore(indices, columns)
+
+    def _create_storage(self, tuning_parameters):
+        return eval(tuning_parameters.agent.replay_storage + '(tuning_parameters)')
+
+    def _reset_indices(self):
+        self._head = 0  # the slot that the next transition will be written to
+        self._tail = 0  # the slot of the oldest transition
+        self._num_transitions = 0
+        self._num_transitions_in_complete_episodes = 0
+        # [first slot, length] of each episode. the last episode is the one that is currently being played
+        self._episodes = deque([[0, 0]])
+        self._next_frame = 0  # a running counter of the frames written to the frame store
+        self._recent_frames = []  # (frame, frame counter) of the frames in the last stored next state
+
+    def _allocate_column(self, name, shape, dtype, length=None, compressed=False):
+        """
+        Allocate the storage of a single column
+        :param name: a unique name for the column
+        :param shape: the shape of a single entry in the column
+        :param dtype: the type of the column entries
+        :param length: the number of entries in the column. defaults to the memory capacity
+        :param compressed: keep the column entries compressed
+        :return: a numpy array (or a CompressedColumn) with the requested number of entries
+        """
+        if length is None:
+            length = self.capacity
+        if compressed:
+            return CompressedColumn(length, shape, dtype, self.decompression_executor, self.num_decompression_threads)
+        return self.storage.allocate(name, shape, dtype, length)
+
+    def _compressed_columns(self):
+        columns = list(self.states.values()) + list(self.next_states.values()) + [self.frames]
+        return [column for column in columns if isinstance(column, CompressedColumn)]
+
+    def _save_indices(self):
+        """
+        Persist the indices of the complete episodes. The currently played episode is not persisted.
+        """
+        if not self.storage.is_persistent:
+            return
+        self.storage.save_indices({
+            'capacity': self.capacity,
+            'tail': self._tail,
+            'num_transitions_in_complete_episodes': self._num_transitions_in_complete_episodes,
+            'next_frame': self._next_frame,
+            'stack_axis': self.stack_axis
+        })
+
+    # the attributes of the columns which are not kept in a dictionary
+    _column_attributes = {'action': 'actions', 'reward': 'rewards', 'game_over': 'game_overs',
+                          'total_return': 'total_returns', 'episode_start': 'episode_starts', 'frames': 'frames'}
+
+    def _restore(self, indices, columns):
+        """
+        Reopen the complete episodes of a persisted memory
+        :param indices: the indices dictionary which was saved by _save_indices
+        :param columns: a dictionary of the persisted columns by their names
+        """
+        assert indices['capacity'] == self.capacity, \
+            'The persisted replay memory has a capacity of {} transitions instead of {}'\
+                .format(indices['capacity'], self.capacity)
+        for name, column in columns.items():
+            if name in self._column_attributes:
+                setattr(self, self._column_attributes[name], column)
+            else:
+                prefix, key = name.split('/', 1)
+                {'state': self.states, 'next_state': self.next_states, 'frame_indices': self.frame_indices,
+                 'info': self.info, 'info_is_set': self.info_is_set}[prefix][key] = column
+
+        num_transitions = indices['num_transitions_in_complete_episodes']
+        self._tail = indices['tail']
+        self._head = (self._tail + num_transitions) % self.capacity
+        self._num_transitions = num_transitions
+        self._num_transitions_in_complete_episodes = num_transitions
+        self._next_frame = indices['next_frame']
+        self.stack_axis = indices['stack_axis']
+
+        # rebuild the episodes from the episode start flags. the oldest transition might have been the middle of an
+        # episode which was partially evicted
+        self._episodes = deque()
+        if num_transitions > 0:
+            is_episode_start = self.episode_starts[self._slots(self._tail, num_transitions)]
+            is_episode_start[0] = True
+            first_offsets = np.flatnonzero(is_episode_start)
+            lengths = np.diff(np.append(first_offsets, num_transitions))
+            for first_offset, length in zip(first_offsets, lengths):
+                self._episodes.append([int((self._tail + first_offset) % self.capacity), int(length)])
+        self._episodes.append([self._head, 0])
+
+    def _slots(self, first_slot, length):
+        return (first_slot + np.arange(length)) % self.capacity
+
+    def length(self):
+        """ Get the number of episodes in the ER (even if they are not complete) """
+        if self._episodes[-1][1] == 0:
+            return len(self._episodes) - 1
+        return len(self._episodes)
+
+    def num_complete_episodes(self):
+        """ Get the number of complete episodes in ER """
+        return len(self._episodes) - 1
+
+    def num_transitions(self):
+        return self._num_transitions
+
+    def num_transitions_in_complete_episodes(self):
+        return self._num_transitions_in_complete_episodes
+
+    def sample(self, size):
+        assert self.num_transitions_in_complete_episodes() > size, \
+            'There are not enough transitions in the replay buffer. ' \
+            'Available transitions: {}. Requested transitions: {}.'\
+                .format(self.num_transitions_in_complete_episodes(), size)
+        # the complete episodes are stored contiguously (modulo the capacity) starting from the tail
+        offsets = np.random.randint(self.num_transitions_in_complete_episodes(), size=size)
+        return ColumnarBatch(**self.gather((self._tail + offsets) % self.capacity))
+
+    def sample_sequences(self, size, sequence_length, burn_in=0):
+        """
+        Sample sequences of consecutive transitions for training recurrent networks
+        :param size: the number of sequences
+        :param sequence_length: the number of training steps in each sequence
+        :param burn_in: the number of steps before the training steps, which are used only to initialize the
+                        recurrent state
+        :return: a SequenceBatch
+        """
+        num_transitions = self.num_transitions_in_complete_episodes()
+        assert num_transitions > size, \
+            'There are not enough transitions in the replay buffer. ' \
+            'Available transitions: {}. Requested sequences: {}.'.format(num_transitions, size)
+        steps = np.arange(burn_in + sequence_length)
+        offsets = np.random.randint(num_transitions, size=(size, 1)) + steps
+
+        # a sequence ends with the complete episodes, or right before the start of the next episode
+        crossed_episode_start = np.cumsum(self.episode_starts[(self._tail + offsets) % self.capacity] & (steps > 0),
+                                          axis=1) > 0
+        mask = (offsets < num_transitions) & ~crossed_episode_start
+
+        # the padding repeats the last transition of the sequence
+        last_steps = mask.sum(axis=1, keepdims=True) - 1
+        slots = (self._tail + np.minimum(offsets, offsets[:, :1] + last_steps)) % self.capacity
+        return SequenceBatch(size, len(steps), burn_in, mask, **self.gather(slots.reshape(-1)))
+
+    def store(self, transition):
+        self._write_transition(transition)
+        if transition.game_over:
+            self._close_episode(is_bootstrapped=self.return_is_bootstrapped, n_step_return=self.tp.agent.n_step)
+
+    def insert_full_episode(self, episode):
+        # Do not add a new episode if the last one is not closed yet
+        if self._episodes[-1][1] != 0:
+            return False
+
+        for transition in episode.transitions:
+            self._write_transition(transition)
+        self._close_episode()
+
+        return True
+
+    def get_episode(self, episode_index):
+        if self.length() == 0:
+            return None
+        first_slot, length = self._episodes[episode_index]
+        is_complete = episode_index < len(self._episodes) - 1 if episode_index >= 0 else episode_index < -1
+        episode = Episode()
+        for transition in self.get_transitions(self._slots(first_slot, length), with_returns=is_complete):
+            episode.insert(transition)
+        return episode
+
+    def remove_episode(self, episode_index):
+        # removing an episode from the middle of the ring buffer would leave a hole in it
+        assert episode_index == 0, 'ColumnarExperienceReplay can only remove its oldest episode'
+        if len(self._episodes) > 1:
+            self._evict_oldest_episode()
+        else:
+            # the only episode is the one currently being played
+            self._tail = self._head
+            self._num_transitions = 0
+            self._episodes[0] = [self._head, 0]
+        self._save_indices()
+
+    # for API compatibility
+    def get(self, index):
+        return self.get_episode(index)
+
+    def get_last_complete_episode(self) -> Union[None, Episode]:
+        """
+        Returns the last complete episode in the memory or None if there are no complete episodes
+        :return: None or the last complete episode
+        """
+        last_complete_episode_index = self.num_complete_episodes()-1
+        if last_complete_episode_index >= 0:
+            return self.get(last_complete_episode_index)
+        else:
+            return None
+
+    def update_last_transition_info(self, info):
+        if self._num_transitions == 0:
+            return
+        last_slot = (self._head - 1) % self.capacity
+        for key, val in info.items():
+            self._write_info(key, last_slot, val)
+
+    def clean(self):
+        self._reset_indices()
+        self._save_indices()
+
+    def gather(self, slots, with_returns=True):
+        """
+        Gather the transitions stored in the given slots. Each column is gathered with a single indexing operation.
+        :param slots: a numpy array of slot indices
+        :param with_returns: gather the total returns of the transitions. should be False for incomplete episodes
+        :return: a dictionary of the gathered columns, which matches the arguments of ColumnarBatch
+        """
+        start_time = time.time()
+        frames = self._gather_frames(slots)
+        states = self._gather_states(self.states, 'state', slots, frames)
+        next_states = self._gather_states(self.next_states, 'next_state', slots, frames)
+        if self.compress_observations:
+            self.decompression_time.add_sample(time.time() - start_time)
+        return {
+            'states': states,
+            'next_states': next_states,
+            'actions': self.actions[slots],
+            'rewards': self.rewards[slots],
+            'game_overs': self.game_overs[slots],
+            'total_returns': self.total_returns[slots] if with_returns else None,
+            'info': {key: (column[slots], self.info_is_set[key][slots]) for key, column in self.info.items()}
+        }
+
+    def get_transitions(self, slots, with_returns=True):
+        """
+        Gather the transitions stored in the given slots
+        :param slots: a numpy array of slot indices
+        :param with_returns: fill the total return of the transitions. should be False for incomplete episodes
+        :return: a list of Transition objects
+        """
+        return ColumnarBatch(**self.gather(slots, with_returns)).transitions
+
+    def _write_transition(self, transition):
+        if self._num_transitions == self.capacity:
+            if len(self._episodes) > 1:
+                self._evict_oldest_episode()
+            else:
+                self._evict_oldest_transition_of_current_episode()
+
+        slot = self._head
+        self._write_state(self.states, 'state', slot, transition.state)
+        self._write_state(self.next_states, 'next_state', slot, transition.next_state)
+
+        if self.actions is None:
+            action = np.asarray(transition.action)
+            dtype = np.int64 if action.dtype.kind in 'biu' else action.dtype
+            self.actions = self._allocate_column('action', action.shape, dtype)
+            self.rewards = self._allocate_column('reward', (), np.float64)
+            self.game_overs = self._allocate_column('game_over', (), np.bool_)
+            self.total_returns = self._allocate_column('total_return', (), np.float64)
+            self.episode_starts = self._allocate_column('episode_start', (), np.bool_)
+        self.actions[slot] = transition.action
+        self.rewards[slot] = transition.reward
+        self.game_overs[slot] = transition.game_over
+        self.episode_starts[slot] = self._episodes[-1][1] == 0
+
+        for key in self.info.keys():
+            if key not in transition.info:
+                self.info_is_set[key][slot] = False
+        for key, val in transition.info.items():
+            self._write_info(key, slot, val)
+
+        self._head = (self._head + 1) % self.capacity
+        self._num_transitions += 1
+        self._episodes[-1][1] += 1
+        return slot
+
+    def _gather_frames(self, slots):
+        """
+        Gather the frames of the deduplicated observations of both the states and the next states at once, since
+        they share most of their frames
+        :return: a dictionary of (batch, stack, frame shape) arrays by the state prefix
+        """
+        if not self.frame_indices:
+            return {}
+        prefixes = list(self.frame_indices.keys())
+        frame_indices = np.stack([self.frame_indices[prefix][slots] for prefix in prefixes])
+        return dict(zip(prefixes, self.frames[frame_indices % self.frame_capacity]))
+
+    def _gather_states(self, columns, prefix, slots, frames):
+        states = {key: column[slots] for key, column in columns.items()}
+        if prefix in frames:
+            # the stack axis of the frames is moved to its original position
+            states['observation'] = np.moveaxis(frames[prefix], 1, self.stack_axis + 1 if self.stack_axis >= 0
+                                                else self.stack_axis)
+        return states
+
+    def _write_state(self, columns, prefix, slot, state):
+        for key, val in state.items():
+            if key == 'observation' and self.deduplicate_frames and isinstance(val, LazyStack):
+                self._write_observation_frames(prefix, slot, val)
+                continue
+            val = np.asarray(val)
+            if key not in columns:
+                columns[key] = self._allocate_column('{}/{}'.format(prefix, key), val.shape, val.dtype,
+                                                     compressed=key == 'observation' and self.compress_observations)
+            columns[key][slot] = val
+
+    def _write_observation_frames(self, prefix, slot, stack):
+        if prefix not in self.frame_indices:
+            self.stack_axis = stack.axis
+            self.frame_indices[prefix] = self._allocate_column('frame_indices/{}'.format(prefix),
+                                                               (len(stack.history),), np.int64)
+
+        # consecutive stacks share all their frames but one. the frames are matched by identity since the agent
+        # keeps the same frame objects in its observation stack
+        frame_indices = []
+        for frame in stack.history:
+            for known_frame, frame_index in self._recent_frames:
+                if known_frame is frame:
+                    break
+            else:
+                frame_index = self._write_frame(frame)
+                self._recent_frames.append((frame, frame_index))
+            frame_indices.append(frame_index)
+        self.frame_indices[prefix][slot] = frame_indices
+
+        if prefix == 'next_state':
+            # only the frames of the last next state can be shared with the following transition
+            self._recent_frames = list(zip(stack.history, frame_indices))
+
+    def _write_frame(self, frame):
+        if self.frames is None:
+            frame = np.asarray(frame)
+            self.frames = self._allocate_column('frames', frame.shape, frame.dtype, length=self.frame_capacity,
+                                                compressed=self.compress_observations)
+
+        # make sure that the frame is not overwriting a frame which is still used by a stored transition
+        while self._num_transitions > 0 and \
+                self._next_frame - self.frame_indices['state'][self._tail].min() >= self.frame_capacity:
+            if len(self._episodes) > 1:
+                self._evict_oldest_episode()
+            else:
+                self._evict_oldest_transition_of_current_episode()
+
+        self.frames[self._next_frame % self.frame_capacity] = frame
+        self._next_frame += 1
+        return self._next_frame - 1
+
+    def _write_info(self, key, slot, val):
+        if key not in self.info:
+            val = np.asarray(val)
+            # numeric values are kept as floats since the first value of a field (e.g. the action value during
+            # heatup) is not always of the same type as the following values
+            dtype = np.float64 if val.dtype.kind in 'biuf' else object
+            self.info[key] = self._allocate_column('info/{}'.format(key), val.shape, dtype)
+            self.info_is_set[key] = self._allocate_column('info_is_set/{}'.format(key), (), np.bool_)
+        self.info[key][slot] = val
+        self.info_is_set[key][slot] = True
+
+    def _write_info_column(self, key, slots, values):
+        if len(slots) == 0:
+            return
+        if key not in self.info:
+            self._write_info(key, slots[0], values[0])
+        self.info[key][slots] = values
+        self.info_is_set[key][slots] = True
+
+    def _close_episode(self, is_bootstrapped=False, n_step_return=-1):
+        first_slot, length = self._episodes[-1]
+        slots = self._slots(first_slot, length)
+
+        # calculate the returns and the measurements targets directly on the columns, the same way Episode does
+        bootstraps = None
+        if is_bootstrapped:
+            n_step = length if n_step_return == -1 or n_step_return > length else n_step_return
+            bootstraps = self.info['max_action_value'][slots[n_step:]].reshape(length - n_step)
+        self.total_returns[slots] = discounted_returns(self.rewards[slots], self.discount, n_step_return, bootstraps)
+        if 'measurements' in self.states:
+            self._write_info_column('future_measurements', slots, future_measurements_targets(
+                self.states['measurements'][slots], self.next_states['measurements'][slots],
+                self.tp.agent.num_predicted_steps_ahead))
+            self._write_info_column('total_episode_return', slots, np.full(length, np.sum(self.rewards[slots])))
+
+        self._num_transitions_in_complete_episodes += length
+        self._episodes.append([self._head, 0])
+        self._save_indices()
+
+        if self.compress_observations:
+            compressed_columns = self._compressed_columns()
+            self.compression_ratio.add_sample(sum(column.raw_bytes for column in compressed_columns) /
+                                              max(sum(column.compressed_bytes for column in compressed_columns), 1))
+
+    def _evict_oldest_episode(self):
+        _, length = self._episodes.popleft()
+        self._tail = (self._tail + length) % self.capacity
+        self._num_transitions -= length
+        self._num_transitions_in_complete_episodes -= length
+        # the evicted slots are about to be overwritten, so the persisted indices must not point to them anymore
+        self._save_indices()
+
+    def _evict_oldest_transition_of_current_episode(self):
+        # the current episode fills the entire memory
+        self._episodes[0][0] = (self._episodes[0][0] + 1) % self.capacity
+        self._episodes[0][1] -= 1
+        self._tail = (self._tail + 1) % self.capacity
+        self._num_transitions -= 1
+        # the persisted indices cover only the complete episodes, and there are none while the current episode fills
+        # the memory, so they are saved when the episode is closed rather than on each step
@@ -15,24 +15,32 @@
 #
 
 import numpy as np
-from annoy import AnnoyIndex
-import os, pickle
+import os, pickle, json, shutil
+from collections import deque
+from memories.dnd_index import *
+from concurrent.futures import ThreadPoolExecutor
 
 
 class AnnoyDictionary(object):
-    def __init__(self, dict_size, key_width, new_value_shift_coefficient=0.1, batch_size=100, key_error_threshold=0.01):
+    def __init__(self, dict_size, key_width, new_value_shift_coefficient=0.1, batch_size=100, key_error_threshold=0.01,
+                 index_type='AnnoyKNNIndex'):
         self.max_size = dict_size
         self.curr_size = 0
         self.new_value_shift_coefficient = new_value_shift_coefficient
 
-        self.index = AnnoyIndex(key_width, metric='euclidean')
-        self.index.set_seed(1)
+        # the nearest neighbors index of the keys. incremental indices are updated on every insert, and the others
+        # are rebuilt once enough inserts are buffered
+        self.index = eval(index_type)(key_width, dict_size)
 
         self.embeddings = np.zeros((dict_size, key_width))
         self.values = np.zeros(dict_size)
 
         self.lru_timestamps = np.zeros(dict_size)
         self.current_timestamp = 0.0
+        # the entries ordered by the time they were last used, as a queue of (indices, timestamps) pairs. the queue is
+        # appended to whenever entries are used, and an entry is valid only if its timestamp is still the last one
+        self.lru_queue = deque()
+        self.lru_queue_length = 0
 
         # keys that are in this distance will be considered as the same key
         self.key_error_threshold = key_error_threshold
@@ -47,35 +55,34 @@ class AnnoyDictionary(object):
 
     def add(self, keys, values):
         # Adds new embeddings and values to the dictionary
-        indices = []
-        indices_to_remove = []
-        for i in range(keys.shape[0]):
-            index = self._lookup_key_index(keys[i])
-            if index:
-                # update existing value
-                self.values[index] += self.new_value_shift_coefficient * (values[i] - self.values[index])
-                self.lru_timestamps[index] = self.current_timestamp
-                indices_to_remove.append(i)
-            else:
-                # add new
-                if self.curr_size >= self.max_size:
-                    # find the LRU entry
-                    index = np.argmin(self.lru_timestamps)
-                else:
-                    index = self.curr_size
-                    self.curr_size += 1
-                self.lru_timestamps[index] = self.current_timestamp
-                indices.append(index)
-
-        for i in reversed(indices_to_remove):
-            keys = np.delete(keys, i, 0)
-            values = np.delete(values, i, 0)
+        self._grow_to_capacity()
+        keys = np.asarray(keys)
+        values = np.asarray(values).reshape(len(keys), self.value_dimension)
+
+        # a single lookup finds the keys which are already in the dictionary, and their values are updated
+        distances, nearest_indices = self.index.query(keys, 1)
+        if distances.shape[1] > 0:
+            is_existing_key = distances[:, 0] <= self.key_error_threshold
+        else:
+            is_existing_key = np.zeros(len(keys), dtype=np.bool_)
+        if is_existing_key.any():
+            self._update_values(nearest_indices[is_existing_key, 0], values[is_existing_key, 0])
+
+        # the new keys take the free entries first, and then replace the least recently used entries
+        keys = keys[~is_existing_key]
+        values = values[~is_existing_key]
+        num_free_entries = min(len(keys), self.max_size - self.curr_size)
+        indices = np.concatenate([np.arange(self.curr_size, self.curr_size + num_free_entries),
+                                  self._pop_least_recently_used(len(keys) - num_free_entries)]).astype(np.int64)
+        self.curr_size += num_free_entries
+        self._touch(indices)
+        indices = indices.tolist()
 
         self.buffered_keys = np.vstack((self.buffered_keys, keys))
         self.buffered_values = np.vstack((self.buffered_values, values))
         self.buffered_indices = self.buffered_indices + indices
 
-        if len(self.buffered_indices) >= self.min_update_size:
+        if self.index.is_incremental or len(self.buffered_indices) >= self.min_update_size:
             self.min_update_size = max(self.initial_update_size, int(self.curr_size * 0.02))
             self._rebuild_index()
 
@@ -83,70 +90,196 @@ class AnnoyDictionary(object):
 
     # Returns the stored embeddings and values of the closest embeddings
     def query(self, keys, k):
+        """
+        :param keys: a batch of keys
+        :param k: the number of neighbors to return for each key
+        :return: [batch, k, key width] embeddings, [batch, k] values and [batch, k] indices of the nearest neighbors
+        """
         if not self.has_enough_entries(k):
             # this will only happen when the DND is not yet populated with enough entries, which is only during heatup
             # these values won't be used and therefore they are meaningless
-            return [0.0], [0.0], [0]
-
-        _, indices = self._get_k_nearest_neighbors_indices(keys, k)
-
-        embeddings = []
-        values = []
-        for ind in indices:
-            self.lru_timestamps[ind] = self.current_timestamp
-            embeddings.append(self.embeddings[ind])
-            values.append(self.values[ind])
+            return np.zeros((len(keys), k, self.key_dimension)), np.zeros((len(keys), k)), \
+                np.zeros((len(keys), k), dtype=np.int64)
 
+        _, indices = self.index.query(keys, k)
+        self._touch(indices)
         self.current_timestamp += 1
 
-        return embeddings, values, indices
+        return self.embeddings[indices], self.values[indices], indices
 
     def has_enough_entries(self, k):
         return self.curr_size > k and (self.built_capacity > k)
 
-    def _get_k_nearest_neighbors_indices(self, keys, k):
-        distances = []
-        indices = []
-        for key in keys:
-            index, distance = self.index.get_nns_by_vector(key, k, include_distances=True)
-            distances.append(distance)
-            indices.append(index)
-        return distances, indices
-
     def _rebuild_index(self):
-        self.index.unbuild()
         self.embeddings[self.buffered_indices] = self.buffered_keys
-        self.values[self.buffered_indices] = np.squeeze(self.buffered_values)
-        for idx, key in zip(self.buffered_indices, self.buffered_keys):
-            self.index.add_item(idx, key)
+        self.values[self.buffered_indices] = np.squeeze(self.buffered_values, -1)
+        if self.index.is_read_only:
+            # a saved or loaded index can't be changed, so a new index is created with all the keys. annoy indices are
+            # rebuilt over all the keys anyway, so this only adds the cost of adding the existing keys again
+            self.index = type(self.index)(self.key_dimension, self.max_size)
+            self.index.add(range(self.curr_size), self.embeddings[:self.curr_size])
+        else:
+            self.index.add(self.buffered_indices, self.buffered_keys)
 
         self._reset_buffer()
 
-        self.index.build(50)
+        self.index.build()
         self.built_capacity = self.curr_size
 
+    def _grow_to_capacity(self):
+        # only the used entries are saved, so the arrays of a loaded dictionary are extended before new entries are
+        # written to them
+        if len(self.embeddings) < self.max_size:
+            for name in ['embeddings', 'values', 'lru_timestamps']:
+                array = getattr(self, name)
+                grown_array = np.zeros((self.max_size,) + array.shape[1:], dtype=array.dtype)
+                grown_array[:len(array)] = array
+                setattr(self, name, grown_array)
+
     def _reset_buffer(self):
         self.buffered_keys = np.zeros((0, self.key_dimension))
         self.buffered_values = np.zeros((0, self.value_dimension))
         self.buffered_indices = []
 
-    def _lookup_key_index(self, key):
-        distance, index = self._get_k_nearest_neighbors_indices([key], 1)
-        if distance != [[]] and distance[0][0] <= self.key_error_threshold:
-            return index
-        return None
+    def _update_values(self, indices, values):
+        """
+        Move the values of existing entries towards new values. When an entry is updated more than once, the updates
+        are applied in order, as if they were done one after the other.
+        """
+        alpha = self.new_value_shift_coefficient
+        unique_indices, inverse_indices, counts = np.unique(indices, return_inverse=True, return_counts=True)
+        # the number of later updates of the same entry, which decay each of the updates
+        update_order = np.argsort(inverse_indices, kind='mergesort')
+        rank = np.empty(len(indices), dtype=np.int64)
+        rank[update_order] = np.arange(len(indices)) - np.repeat(np.cumsum(counts) - counts, counts)
+        num_later_updates = counts[inverse_indices] - 1 - rank
+
+        self.values[unique_indices] *= (1 - alpha) ** counts
+        np.add.at(self.values, indices, alpha * (1 - alpha) ** num_later_updates * values)
+        self._touch(unique_indices)
+
+    def _touch(self, indices):
+        """
+        Mark entries as used at the current timestamp
+        """
+        indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+        if len(indices) == 0:
+            return
+        self.lru_timestamps[indices] = self.current_timestamp
+        self.lru_queue.append((indices, np.full(len(indices), self.current_timestamp)))
+        self.lru_queue_length += len(indices)
+
+        # the invalid entries are dropped from the queue by sorting the valid ones again, once they take most of it
+        if self.lru_queue_length > 4 * self.max_size:
+            self._rebuild_lru_queue()
+
+    def _rebuild_lru_queue(self):
+        indices = np.argsort(self.lru_timestamps[:self.curr_size], kind='mergesort')
+        self.lru_queue = deque([(indices, self.lru_timestamps[indices])])
+        self.lru_queue_length = len(indices)
+
+    def _pop_least_recently_used(self, num_entries):
+        """
+        Find the least recently used entries and mark them as used, so that they will not be found again
+        :param num_entries: the number of entries to find
+        :return: the indices of the entries
+        """
+        found_indices = []
+        num_found_entries = 0
+        while num_found_entries < num_entries:
+            indices, timestamps = self.lru_queue.popleft()
+            self.lru_queue_length -= len(indices)
+            # all the entries of a single use have the same timestamp, so their order doesn't matter
+            indices = np.unique(indices[self.lru_timestamps[indices] == timestamps])
+            num_taken_entries = min(len(indices), num_entries - num_found_entries)
+            if num_taken_entries < len(indices):
+                remaining_indices = indices[num_taken_entries:]
+                self.lru_queue.appendleft((remaining_indices, self.lru_timestamps[remaining_indices]))
+                self.lru_queue_length += len(remaining_indices)
+            found_indices.append(indices[:num_taken_entries])
+            num_found_entries += num_taken_entries
+        found_indices = np.concatenate(found_indices) if found_indices else np.zeros(0, dtype=np.int64)
+        self.lru_timestamps[found_indices] = self.current_timestamp
+        return found_indices
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # dictionaries that were pickled before the lru queue was added
+        if 'lru_queue' not in state:
+            self._rebuild_lru_queue()
+
+    def save(self, path):
+        """
+        Save the dictionary as .npy arrays and an index file, which are memory mapped when the dictionary is loaded
+        :param path: the path of the saved files, without an extension
+        :return: the metadata which is needed for loading the dictionary
+        """
+        # only the used entries are saved, since the arrays are allocated for the full dictionary size
+        np.save(path + '.embeddings.npy', self.embeddings[:self.curr_size])
+        np.save(path + '.values.npy', self.values[:self.curr_size])
+        np.save(path + '.lru_timestamps.npy', self.lru_timestamps[:self.curr_size])
+        np.save(path + '.buffered_keys.npy', self.buffered_keys)
+        np.save(path + '.buffered_values.npy', self.buffered_values)
+        np.save(path + '.buffered_indices.npy', np.array(self.buffered_indices, dtype=np.int64))
+        # the index has no keys before it is first built
+        if self.built_capacity > 0:
+            self.index.save(path + '.index')
+
+        return {
+            'dict_size': self.max_size,
+            'key_width': self.key_dimension,
+            'index_type': type(self.index).__name__,
+            'index_saved': self.built_capacity > 0,
+            'curr_size': int(self.curr_size),
+            'built_capacity': int(self.built_capacity),
+            'current_timestamp': float(self.current_timestamp),
+            'new_value_shift_coefficient': self.new_value_shift_coefficient,
+            'key_error_threshold': self.key_error_threshold,
+            'initial_update_size': self.initial_update_size,
+            'min_update_size': int(self.min_update_size)
+        }
+
+    @classmethod
+    def load(cls, path, metadata):
+        """
+        Load a dictionary which was saved by save. The arrays are memory mapped copy on write, so processes which load
+        the same dictionary share their pages until they change them
+        :param path: the path of the saved files, without an extension
+        :param metadata: the metadata which was returned by save
+        :return: the dictionary
+        """
+        dictionary = cls(metadata['dict_size'], metadata['key_width'], metadata['new_value_shift_coefficient'],
+                         metadata['initial_update_size'], metadata['key_error_threshold'], metadata['index_type'])
+        dictionary.embeddings = np.load(path + '.embeddings.npy', mmap_mode='c')
+        dictionary.values = np.load(path + '.values.npy', mmap_mode='c')
+        dictionary.lru_timestamps = np.load(path + '.lru_timestamps.npy', mmap_mode='c')
+        dictionary.buffered_keys = np.load(path + '.buffered_keys.npy')
+        dictionary.buffered_values = np.load(path + '.buffered_values.npy')
+        dictionary.buffered_indices = np.load(path + '.buffered_indices.npy').tolist()
+        if metadata['index_saved']:
+            dictionary.index.load(path + '.index')
+
+        dictionary.curr_size = metadata['curr_size']
+        dictionary.built_capacity = metadata['built_capacity']
+        dictionary.current_timestamp = metadata['current_timestamp']
+        dictionary.min_update_size = metadata['min_update_size']
+        dictionary._rebuild_lru_queue()
+        return dictionary
 
 
 class QDND:
     def __init__(self, dict_size, key_width, num_actions, new_value_shift_coefficient=0.1, key_error_threshold=0.01,
-                 learning_rate=0.01):
+                 learning_rate=0.01, num_query_threads=4, index_type='AnnoyKNNIndex'):
         self.num_actions = num_actions
         self.dicts = []
         self.learning_rate = learning_rate
+        self.num_query_threads = num_query_threads
+        self._executor = None
 
         # create a dict for each action
         for a in range(num_actions):
-            new_dict = AnnoyDictionary(dict_size, key_width, new_value_shift_coefficient, key_error_threshold=key_error_threshold)
+            new_dict = AnnoyDictionary(dict_size, key_width, new_value_shift_coefficient,
+                                       key_error_threshold=key_error_threshold, index_type=index_type)
             self.dicts.append(new_dict)
 
     def add(self, embeddings, actions, values):
@@ -164,16 +297,36 @@ class QDND:
 
     def query(self, embeddings, action, k):
         # query for nearest neighbors to the given embeddings
-        dnd_embeddings = []
-        dnd_values = []
-        dnd_indices = []
-        for i in range(len(embeddings)):
-            embedding, value, indices = self.dicts[action].query([embeddings[i]], k)
-            dnd_embeddings.append(embedding[0])
-            dnd_values.append(value[0])
-            dnd_indices.append(indices[0])
-
-        return dnd_embeddings, dnd_values, dnd_indices
+        return self.dicts[action].query(embeddings, k)
+
+    def query_all_actions(self, embeddings, k):
+        """
+        Query the dictionaries of all the actions with the same batch of embeddings. The dictionaries are queried in
+        parallel by a thread pool, which runs concurrently when the index lookups release the GIL.
+        :param embeddings: a batch of embeddings
+        :param k: the number of neighbors to return for each embedding
+        :return: [batch, actions, k, key width] embeddings, [batch, actions, k] values and [batch, actions, k] indices
+                 of the nearest neighbors
+        """
+        if self.num_query_threads > 1:
+            results = list(self._get_executor().map(lambda action: self.query(embeddings, action, k),
+                                                    range(self.num_actions)))
+        else:
+            results = [self.query(embeddings, action, k) for action in range(self.num_actions)]
+        dnd_embeddings, dnd_values, dnd_indices = zip(*results)
+        return np.stack(dnd_embeddings, axis=1), np.stack(dnd_values, axis=1), np.stack(dnd_indices, axis=1)
+
+    def _get_executor(self):
+        # dictionaries that were pickled before the thread pool was added don't have it
+        if getattr(self, '_executor', None) is None:
+            self._executor = ThreadPoolExecutor(max_workers=getattr(self, 'num_query_threads', 4))
+        return self._executor
+
+    def __getstate__(self):
+        # the thread pool can't be pickled, and it is created again when it is needed
+        state = self.__dict__.copy()
+        state['_executor'] = None
+        return state
 
     def has_enough_entries(self, k):
         # check if each of the action dictionaries has at least k entries
@@ -182,6 +335,49 @@ class QDND:
                 return False
         return True
 
+    def save(self, path):
+        """
+        Save the dictionaries to a directory, with a metadata file and the arrays and index files of each action.
+        The directory is written under a temporary name and renamed when it is complete, so an interrupted save
+        doesn't leave a partial checkpoint.
+        :param path: the path of the directory
+        """
+        temp_path = path + '.tmp'
+        shutil.rmtree(temp_path, ignore_errors=True)
+        os.makedirs(temp_path)
+        metadata = {
+            'num_actions': self.num_actions,
+            'learning_rate': self.learning_rate,
+            'num_query_threads': getattr(self, 'num_query_threads', 4),
+            'dicts': [self.dicts[a].save(os.path.join(temp_path, 'action_{}'.format(a)))
+                      for a in range(self.num_actions)]
+        }
+        with open(os.path.join(temp_path, 'metadata.json'), 'w') as f:
+            json.dump(metadata, f)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load dictionaries which were saved by save. The arrays and the index files are memory mapped, so loading
+        doesn't rebuild the indices
+        :param path: the path of the directory
+        :return: the loaded QDND
+        """
+        with open(os.path.join(path, 'metadata.json')) as f:
+            metadata = json.load(f)
+
+        dnd = cls.__new__(cls)
+        dnd.num_actions = metadata['num_actions']
+        dnd.learning_rate = metadata['learning_rate']
+        dnd.num_query_threads = metadata['num_query_threads']
+        dnd._executor = None
+        dnd.dicts = [AnnoyDictionary.load(os.path.join(path, 'action_{}'.format(a)), dict_metadata)
+                     for a, dict_metadata in enumerate(metadata['dicts'])]
+        return dnd
+
 
 def load_dnd(model_dir):
     max_id = 0
@@ -190,17 +386,20 @@ def load_dnd(model_dir):
         if int(f.split('.')[0]) > max_id:
             max_id = int(f.split('.')[0])
 
-    model_path = str(max_id) + '.dnd'
-    with open(os.path.join(model_dir, model_path), 'rb') as f:
+    model_path = os.path.join(model_dir, str(max_id) + '.dnd')
+    if os.path.isdir(model_path):
+        return QDND.load(model_path)
+
+    # dictionaries that were pickled before they were saved as arrays and index files
+    with open(model_path, 'rb') as f:
         DND = pickle.load(f)
 
         for a in range(DND.num_actions):
-            DND.dicts[a].index = AnnoyIndex(512, metric='euclidean')
-            DND.dicts[a].index.set_seed(1)
-
-            for idx, key in zip(range(DND.dicts[a].curr_size), DND.dicts[a].embeddings[:DND.dicts[a].curr_size]):
-                DND.dicts[a].index.add_item(idx, key)
-
-            DND.dicts[a].index.build(50)
+            # annoy indices are not pickled, so they are built again from the stored keys
+            dictionary = DND.dicts[a]
+            if not getattr(dictionary.index, 'is_incremental', False):
+                dictionary.index = AnnoyKNNIndex(dictionary.key_dimension, dictionary.max_size)
+                dictionary.index.add(range(dictionary.curr_size), dictionary.embeddings[:dictionary.curr_size])
+                dictionary.index.build()
 
     return DND
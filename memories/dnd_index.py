@@ -0,0 +1,468 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+
+import numpy as np
+from annoy import AnnoyIndex
+
+
+def _pad_neighbors(distances, ids, k):
+    """
+    Pad each list of neighbors to k neighbors by repeating the farthest one
+    :return: [num queries, k] arrays of the distances and the ids (or [num queries, 0] arrays if there are no neighbors)
+    """
+    if len(ids) == 0 or any(len(neighbors) == 0 for neighbors in ids):
+        return np.zeros((len(ids), 0)), np.zeros((len(ids), 0), dtype=np.int64)
+    padded_distances = np.array([list(d) + [d[-1]] * (k - len(d)) for d in distances], dtype=np.float64)
+    padded_ids = np.array([list(i) + [i[-1]] * (k - len(i)) for i in ids], dtype=np.int64)
+    return padded_distances, padded_ids
+
+
+def _exact_distances(keys, neighbor_keys):
+    """
+    Compute the euclidean distances of the nearest neighbors again from the differences of the keys. The neighbors are
+    found with |k|^2 - 2q.k + |q|^2 in float32, which loses small distances to cancellation, so a key which is already
+    in the index might not be found at a distance of 0, and the dictionary would not recognize it as a duplicate.
+    :param keys: the query keys, broadcastable to the shape of the neighbor keys
+    :param neighbor_keys: the keys of the neighbors
+    :return: the distances, in the shape of the neighbor keys without their last axis
+    """
+    # the differences don't suffer from the cancellation, so they are accurate in float32 as well
+    differences = neighbor_keys - keys
+    return np.sqrt(np.einsum('...i,...i->...', differences, differences))
+
+
+class AnnoyKNNIndex(object):
+    """
+    An Annoy index of the dictionary keys. Annoy indices can't be changed after they are built, so the index is
+    unbuilt and built again over all the keys whenever keys are added.
+    """
+    is_incremental = False
+    # saved and loaded annoy indices are memory mapped from their file, and keys can't be added to them anymore
+    is_read_only = False
+
+    def __init__(self, key_width, capacity, num_trees=50):
+        """
+        :param key_width: the size of each key
+        :param capacity: the maximal number of keys in the index
+        :param num_trees: the number of trees to build. more trees give a better recall and slower builds
+        """
+        self.key_width = key_width
+        self.num_trees = num_trees
+        self._create_index()
+
+    def _create_index(self):
+        self.index = AnnoyIndex(self.key_width, metric='euclidean')
+        self.index.set_seed(1)
+
+    def __getstate__(self):
+        # annoy indices can't be pickled. an empty index is created when unpickling, and the keys should be added again
+        state = self.__dict__.copy()
+        del state['index']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.is_read_only = False
+        self._create_index()
+
+    def add(self, ids, keys):
+        """
+        Add keys to the index, or replace the keys of ids which are already in the index
+        :param ids: the ids of the keys
+        :param keys: a [num keys, key width] array
+        """
+        self.index.unbuild()
+        for id, key in zip(ids, keys):
+            self.index.add_item(int(id), key)
+
+    def build(self):
+        """
+        Make the added keys searchable
+        """
+        self.index.build(self.num_trees)
+
+    def query(self, keys, k):
+        """
+        :param keys: a [num queries, key width] array
+        :param k: the number of neighbors to return for each key
+        :return: [num queries, k] arrays of the euclidean distances and the ids of the nearest neighbors. when less than
+                 k neighbors are found, the farthest one is repeated
+        """
+        distances = []
+        ids = []
+        for key in keys:
+            neighbor_ids, neighbor_distances = self.index.get_nns_by_vector(key, k, include_distances=True)
+            distances.append(neighbor_distances)
+            ids.append(neighbor_ids)
+        return _pad_neighbors(distances, ids, k)
+
+    def save(self, path):
+        """
+        Save the built index to a file. Annoy loads the saved file in place of the index, so the index becomes read only
+        :param path: the path of the saved files, without an extension
+        """
+        self.index.save(path + '.ann')
+        self.is_read_only = True
+
+    def load(self, path):
+        """
+        Load an index which was saved by save. The file is memory mapped, so processes which load the same index share
+        its pages, and the index becomes read only
+        :param path: the path of the saved files, without an extension
+        """
+        self.index.load(path + '.ann')
+        self.is_read_only = True
+
+
+class IVFKNNIndex(object):
+    """
+    An inverted file index of the dictionary keys, which supports adding and replacing keys without rebuilding.
+    The key space is partitioned to num_lists cells by k-means centroids, and each cell keeps a list of the ids and the
+    keys which are closest to its centroid. The keys of each list are kept contiguous, so a batch of queries is grouped
+    by the lists which they probe, and each list is scanned with a single matrix multiplication for all the queries
+    which probe it. Each query probes the lists of the num_probes cells which are closest to it. Until there are enough
+    keys for training the centroids, all the keys are kept in a single list and the search is exact.
+    """
+    is_incremental = True
+    is_read_only = False
+
+    def __init__(self, key_width, capacity, num_lists=None, num_probes=16, kmeans_iterations=10):
+        """
+        :param key_width: the size of each key
+        :param capacity: the maximal number of keys in the index. the ids should be in the range [0, capacity)
+        :param num_lists: the number of cells. defaults to the square root of the capacity
+        :param num_probes: the number of cells to scan for each query. more probes give a better recall and slower
+                           queries
+        :param kmeans_iterations: the number of k-means iterations when training the centroids
+        """
+        self.key_width = key_width
+        self.num_lists = num_lists or max(1, int(np.sqrt(capacity)))
+        self.num_probes = min(num_probes, self.num_lists)
+        self.kmeans_iterations = kmeans_iterations
+        # the centroids are trained once there are enough keys per cell for a reasonable partitioning
+        self.training_size = min(capacity, self.num_lists * 32)
+        self.centroids = None
+
+        self.list_of_id = np.full(capacity, -1, dtype=np.int64)
+        self.position_of_id = np.zeros(capacity, dtype=np.int64)
+        self._reset_lists(1)
+        self.num_items = 0
+
+    def _reset_lists(self, num_lists):
+        # the ids, the keys and the squared norms of the keys of each list. each list has room for more keys than it
+        # holds, and it is grown by doubling
+        self.lists = [np.zeros(0, dtype=np.int64) for _ in range(num_lists)]
+        self.list_keys = [np.zeros((0, self.key_width), dtype=np.float32) for _ in range(num_lists)]
+        self.list_squared_norms = [np.zeros(0, dtype=np.float32) for _ in range(num_lists)]
+        self.list_sizes = np.zeros(num_lists, dtype=np.int64)
+
+    def add(self, ids, keys):
+        """
+        Add keys to the index, or replace the keys of ids which are already in the index
+        :param ids: the ids of the keys
+        :param keys: a [num keys, key width] array
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0:
+            return
+        # when an id appears more than once, its last key is the one that is kept
+        ids, last_occurrences = np.unique(ids[::-1], return_index=True)
+        keys = np.asarray(keys, dtype=np.float32)[::-1][last_occurrences]
+
+        self._remove(ids[self.list_of_id[ids] >= 0])
+        self._append(ids, keys, self._nearest_lists(keys))
+        self.num_items += len(ids)
+
+        if self.centroids is None and self.num_items >= self.training_size:
+            self._train()
+
+    def build(self):
+        # the added keys are searchable right away
+        pass
+
+    def query(self, keys, k):
+        """
+        :param keys: a [num queries, key width] array
+        :param k: the number of neighbors to return for each key
+        :return: [num queries, k] arrays of the euclidean distances and the ids of the nearest neighbors. when less than
+                 k neighbors are found, the farthest one is repeated
+        """
+        keys = np.asarray(keys, dtype=np.float32)
+        if self.centroids is None:
+            probes = np.zeros((len(keys), 1), dtype=np.int64)
+        else:
+            centroid_distances = self._centroid_distances(keys)
+            probes = np.argpartition(centroid_distances, self.num_probes - 1, axis=1)[:, :self.num_probes]
+
+        # the nearest neighbors of each query in each of its probed lists are collected to a row of candidates
+        num_probes = probes.shape[1]
+        candidate_distances = np.full((len(keys), num_probes * k), np.inf, dtype=np.float32)
+        candidate_ids = np.full((len(keys), num_probes * k), -1, dtype=np.int64)
+        probe_order = np.argsort(probes.reshape(-1), kind='mergesort')
+        probed_lists, starts = np.unique(probes.reshape(-1)[probe_order], return_index=True)
+        for l, probe_group in zip(probed_lists, np.split(probe_order, starts[1:])):
+            size = self.list_sizes[l]
+            if size == 0:
+                continue
+            rows, probe_indices = probe_group // num_probes, probe_group % num_probes
+            # the squared norm of the queries is the same for all the keys, so it is left out
+            distances = self.list_squared_norms[l][:size] - 2 * keys[rows].dot(self.list_keys[l][:size].T)
+            if size > k:
+                nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+                distances = np.take_along_axis(distances, nearest, axis=1)
+                ids = self.lists[l][nearest]
+            else:
+                ids = np.broadcast_to(self.lists[l][:size], distances.shape)
+            columns = probe_indices[:, np.newaxis] * k + np.arange(distances.shape[1])
+            candidate_distances[rows[:, np.newaxis], columns] = distances
+            candidate_ids[rows[:, np.newaxis], columns] = ids
+
+        if candidate_distances.shape[1] > k:
+            nearest = np.argpartition(candidate_distances, k - 1, axis=1)[:, :k]
+            candidate_ids = np.take_along_axis(candidate_ids, nearest, axis=1)
+
+        # queries which probed less than k keys have missing candidates, which are sorted last
+        is_found = candidate_ids >= 0
+        distances = np.full(candidate_ids.shape, np.inf)
+        distances[is_found] = _exact_distances(keys[np.nonzero(is_found)[0]],
+                                               self._gather_keys(candidate_ids[is_found]))
+        order = np.argsort(distances, axis=1)
+        distances = np.take_along_axis(distances, order, axis=1)
+        candidate_ids = np.take_along_axis(candidate_ids, order, axis=1)
+        is_found = np.take_along_axis(is_found, order, axis=1)
+        if not is_found.all():
+            return _pad_neighbors([d[found] for d, found in zip(distances, is_found)],
+                                  [i[found] for i, found in zip(candidate_ids, is_found)], k)
+        return distances, candidate_ids
+
+    def save(self, path):
+        """
+        Save the index arrays as .npy files
+        :param path: the path of the saved files, without an extension
+        """
+        np.save(path + '.list_of_id.npy', self.list_of_id)
+        np.save(path + '.position_of_id.npy', self.position_of_id)
+        np.save(path + '.list_sizes.npy', self.list_sizes)
+        np.save(path + '.lists.npy', np.concatenate([self.lists[l][:size] for l, size in enumerate(self.list_sizes)]))
+        np.save(path + '.list_keys.npy',
+                np.concatenate([self.list_keys[l][:size] for l, size in enumerate(self.list_sizes)]))
+        if self.centroids is not None:
+            np.save(path + '.centroids.npy', self.centroids)
+
+    def load(self, path):
+        """
+        Load an index which was saved by save. The keys are memory mapped copy on write, so processes which load the
+        same index share their pages until they change them
+        :param path: the path of the saved files, without an extension
+        """
+        self.list_of_id = np.load(path + '.list_of_id.npy')
+        self.position_of_id = np.load(path + '.position_of_id.npy')
+        self.list_sizes = np.load(path + '.list_sizes.npy')
+        # the lists are views of the loaded arrays, and they are copied when keys are appended to them
+        splits = np.cumsum(self.list_sizes)[:-1]
+        self.lists = [np.array(ids) for ids in np.split(np.load(path + '.lists.npy'), splits)]
+        self.list_keys = np.split(np.load(path + '.list_keys.npy', mmap_mode='c'), splits)
+        self.list_squared_norms = [np.sum(list_keys ** 2, axis=1) for list_keys in self.list_keys]
+        self.num_items = int(np.sum(self.list_sizes))
+        if os.path.exists(path + '.centroids.npy'):
+            self.centroids = np.load(path + '.centroids.npy')
+            self.num_lists = len(self.centroids)
+            self.num_probes = min(self.num_probes, self.num_lists)
+
+    def _gather_keys(self, ids):
+        # the keys are gathered from the lists which hold them
+        keys = np.empty((len(ids), self.key_width), dtype=np.float32)
+        list_ids = self.list_of_id[ids]
+        order = np.argsort(list_ids, kind='mergesort')
+        unique_lists, starts = np.unique(list_ids[order], return_index=True)
+        for l, group in zip(unique_lists, np.split(order, starts[1:])):
+            keys[group] = self.list_keys[l][self.position_of_id[ids[group]]]
+        return keys
+
+    def _centroid_distances(self, keys):
+        # the squared norm of the keys is the same for all the centroids, so it is left out
+        return np.sum(self.centroids ** 2, axis=1) - 2 * keys.dot(self.centroids.T)
+
+    def _nearest_lists(self, keys):
+        if self.centroids is None:
+            return np.zeros(len(keys), dtype=np.int64)
+        return np.argmin(self._centroid_distances(keys), axis=1)
+
+    def _append(self, ids, keys, list_ids):
+        order = np.argsort(list_ids, kind='mergesort')
+        ids, keys, list_ids = ids[order], keys[order], list_ids[order]
+        unique_lists, starts = np.unique(list_ids, return_index=True)
+        ends = np.append(starts[1:], len(ids))
+        for l, start, end in zip(unique_lists, starts, ends):
+            size, group_size = self.list_sizes[l], end - start
+            if size + group_size > len(self.lists[l]):
+                self._grow_list(l, max(2 * len(self.lists[l]), size + group_size, 16))
+            self.lists[l][size:size + group_size] = ids[start:end]
+            self.list_keys[l][size:size + group_size] = keys[start:end]
+            self.list_squared_norms[l][size:size + group_size] = np.sum(keys[start:end] ** 2, axis=1)
+            self.list_of_id[ids[start:end]] = l
+            self.position_of_id[ids[start:end]] = np.arange(size, size + group_size)
+            self.list_sizes[l] += group_size
+
+    def _grow_list(self, l, new_length):
+        size = self.list_sizes[l]
+        for arrays in (self.lists, self.list_keys, self.list_squared_norms):
+            grown_array = np.zeros((new_length,) + arrays[l].shape[1:], dtype=arrays[l].dtype)
+            grown_array[:size] = arrays[l][:size]
+            arrays[l] = grown_array
+
+    def _remove(self, ids):
+        # each removed id is replaced by the last id of its list
+        for id in ids:
+            l, position = self.list_of_id[id], self.position_of_id[id]
+            last_position = self.list_sizes[l] - 1
+            last_id = self.lists[l][last_position]
+            self.lists[l][position] = last_id
+            self.list_keys[l][position] = self.list_keys[l][last_position]
+            self.list_squared_norms[l][position] = self.list_squared_norms[l][last_position]
+            self.position_of_id[last_id] = position
+            self.list_sizes[l] -= 1
+            self.list_of_id[id] = -1
+        self.num_items -= len(ids)
+
+    def _train(self):
+        size = self.list_sizes[0]
+        ids, keys = self.lists[0][:size].copy(), self.list_keys[0][:size].copy()
+
+        # k-means, initialized from random keys
+        self.centroids = keys[np.random.choice(len(keys), self.num_lists, replace=False)].copy()
+        for _ in range(self.kmeans_iterations):
+            assignments = np.argmin(self._centroid_distances(keys), axis=1)
+            counts = np.bincount(assignments, minlength=self.num_lists)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, assignments, keys)
+            # empty cells keep their previous centroid
+            non_empty = counts > 0
+            self.centroids[non_empty] = sums[non_empty] / counts[non_empty, np.newaxis]
+
+        self._reset_lists(self.num_lists)
+        self._append(ids, keys, self._nearest_lists(keys))
+
+
+class BruteForceKNNIndex(object):
+    """
+    An exact index of the dictionary keys, which compares each query to all the keys. The squared distances are
+    computed as |k|^2 - 2q.k + |q|^2, where the squared norms of the keys are cached and updated on insert, so a batch of
+    queries costs a single matrix multiplication per chunk of keys. The distances of the nearest keys are then computed
+    again from their differences from the queries. There are no rebuilds and the recall is exact, and
+    for dictionaries of up to ~100K keys it is usually faster than the approximate indices.
+    """
+    is_incremental = True
+    is_read_only = False
+
+    def __init__(self, key_width, capacity, max_chunk_elements=2**22):
+        """
+        :param key_width: the size of each key
+        :param capacity: the maximal number of keys in the index. the ids should be in the range [0, capacity), and are
+                         expected to be filled in order, as the dictionary does
+        :param max_chunk_elements: the maximal size of the [num queries, chunk size] distances matrix, which bounds the
+                                   memory used by a query
+        """
+        self.max_chunk_elements = max_chunk_elements
+        self.capacity = capacity
+        self.keys = np.zeros((capacity, key_width), dtype=np.float32)
+        self.squared_norms = np.zeros(capacity, dtype=np.float32)
+        self.num_keys = 0
+
+    def add(self, ids, keys):
+        """
+        Add keys to the index, or replace the keys of ids which are already in the index
+        :param ids: the ids of the keys
+        :param keys: a [num keys, key width] array
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0:
+            return
+        keys = np.asarray(keys, dtype=np.float32)
+        if len(self.keys) < self.capacity:
+            # a loaded index holds only the saved keys, so it is extended before new keys are added
+            keys_of_capacity = np.zeros((self.capacity, self.keys.shape[1]), dtype=np.float32)
+            keys_of_capacity[:len(self.keys)] = self.keys
+            squared_norms_of_capacity = np.zeros(self.capacity, dtype=np.float32)
+            squared_norms_of_capacity[:len(self.squared_norms)] = self.squared_norms
+            self.keys, self.squared_norms = keys_of_capacity, squared_norms_of_capacity
+        self.keys[ids] = keys
+        self.squared_norms[ids] = np.sum(keys ** 2, axis=1)
+        self.num_keys = max(self.num_keys, int(ids.max()) + 1)
+
+    def build(self):
+        # the added keys are searchable right away
+        pass
+
+    def query(self, keys, k):
+        """
+        :param keys: a [num queries, key width] array
+        :param k: the number of neighbors to return for each key
+        :return: [num queries, k] arrays of the euclidean distances and the ids of the nearest neighbors. when less than
+                 k neighbors are found, the farthest one is repeated
+        """
+        keys = np.asarray(keys, dtype=np.float32)
+        num_queries = len(keys)
+        if num_queries == 0 or self.num_keys == 0:
+            return np.zeros((num_queries, 0)), np.zeros((num_queries, 0), dtype=np.int64)
+
+        num_neighbors = min(k, self.num_keys)
+        chunk_size = max(num_neighbors, self.max_chunk_elements // num_queries)
+        rows = np.arange(num_queries)[:, np.newaxis]
+        best_distances = np.zeros((num_queries, 0), dtype=np.float32)
+        best_ids = np.zeros((num_queries, 0), dtype=np.int64)
+        for start in range(0, self.num_keys, chunk_size):
+            end = min(start + chunk_size, self.num_keys)
+            # the squared norm of the queries is the same for all the keys, so it is added only to the results
+            distances = self.squared_norms[start:end] - 2 * keys.dot(self.keys[start:end].T)
+            if distances.shape[1] > num_neighbors:
+                nearest = np.argpartition(distances, num_neighbors - 1, axis=1)[:, :num_neighbors]
+                distances = distances[rows, nearest]
+                ids = nearest + start
+            else:
+                ids = np.broadcast_to(np.arange(start, end), distances.shape)
+
+            # the nearest neighbors of the chunk are merged with the nearest neighbors of the previous chunks
+            best_distances = np.hstack((best_distances, distances))
+            best_ids = np.hstack((best_ids, ids))
+            if best_distances.shape[1] > num_neighbors:
+                nearest = np.argpartition(best_distances, num_neighbors - 1, axis=1)[:, :num_neighbors]
+                best_distances, best_ids = best_distances[rows, nearest], best_ids[rows, nearest]
+
+        best_distances = _exact_distances(keys[:, np.newaxis], self.keys[best_ids])
+        order = np.argsort(best_distances, axis=1)
+        return _pad_neighbors(best_distances[rows, order], best_ids[rows, order], k)
+
+    def save(self, path):
+        """
+        Save the index arrays of the added keys as .npy files
+        :param path: the path of the saved files, without an extension
+        """
+        np.save(path + '.keys.npy', self.keys[:self.num_keys])
+        np.save(path + '.squared_norms.npy', self.squared_norms[:self.num_keys])
+        np.save(path + '.num_keys.npy', np.array(self.num_keys))
+
+    def load(self, path):
+        """
+        Load an index which was saved by save. The keys are memory mapped copy on write, so processes which load the
+        same index share their pages until they change them
+        :param path: the path of the saved files, without an extension
+        """
+        self.keys = np.load(path + '.keys.npy', mmap_mode='c')
+        self.squared_norms = np.load(path + '.squared_norms.npy', mmap_mode='c')
+        self.num_keys = int(np.load(path + '.num_keys.npy'))
@@ -15,6 +15,7 @@
 #
 
 from memories.memory import *
+from memories.columnar_experience_replay import SequenceBatch, gather_transitions
 import threading
 from typing import Union
 
@@ -85,6 +86,33 @@ class EpisodicExperienceReplay(Memory):
 
         return batch
 
+    def sample_sequences(self, size, sequence_length, burn_in=0):
+        """
+        Sample sequences of consecutive transitions for training recurrent networks
+        :param size: the number of sequences
+        :param sequence_length: the number of training steps in each sequence
+        :param burn_in: the number of steps before the training steps, which are used only to initialize the
+                        recurrent state
+        :return: a SequenceBatch
+        """
+        num_transitions = self.num_transitions_in_complete_episodes()
+        assert num_transitions > size, \
+            'There are not enough transitions in the replay buffer. ' \
+            'Available transitions: {}. Requested sequences: {}.'.format(num_transitions, size)
+        total_length = burn_in + sequence_length
+        mask = np.zeros((size, total_length), dtype=np.bool_)
+        transitions = []
+        for sequence_idx, transition_idx in enumerate(np.random.randint(num_transitions, size=size)):
+            # a sequence ends with its episode, and is padded by repeating the last transition
+            for step in range(total_length):
+                mask[sequence_idx, step] = transition_idx < num_transitions and \
+                    (step == 0 or (mask[sequence_idx, step - 1] and not self.transitions[transition_idx - 1].game_over))
+                if mask[sequence_idx, step]:
+                    last_transition = self.transitions[transition_idx]
+                transitions.append(last_transition)
+                transition_idx += 1
+        return SequenceBatch(size, total_length, burn_in, mask, **gather_transitions(transitions))
+
     def enforce_length(self):
         # clean up if necessary
         if self.max_size_in_transitions is not None:
@@ -15,8 +15,10 @@
 #
 
 import numpy as np
+import scipy.signal
 import copy
 from configurations import *
+from utils import LazyStack
 
 
 class Memory(object):
@@ -43,6 +45,50 @@ class Memory(object):
         pass
 
 
+def discounted_returns(rewards, discount, n_step_return=-1, bootstraps=None):
+    """
+    Calculate the (n step) discounted return from each step of an episode in O(episode length)
+    :param rewards: a numpy array of the rewards of the episode
+    :param discount: the discount factor
+    :param n_step_return: the number of rewards to sum. -1 (or more than the episode length) sums all the rewards
+                          until the end of the episode
+    :param bootstraps: an optional numpy array with the value estimations of the states from step n_step_return
+                       onwards, which are added to the returns of the steps n_step_return steps before them
+    :return: a numpy array of the returns
+    """
+    length = len(rewards)
+    if n_step_return == -1 or n_step_return > length:
+        n_step_return = length
+    if length == 0:
+        return np.zeros(0)
+
+    # the discounted return until the end of the episode is a discounted cumulative sum of the reversed rewards
+    returns = scipy.signal.lfilter([1], [1, -discount], np.asarray(rewards, dtype='float')[::-1])[::-1]
+    # the n step return is the return until the end of the episode minus the discounted return n steps later
+    n_step_discount = discount ** n_step_return
+    returns[:length - n_step_return] -= n_step_discount * returns[n_step_return:]
+    if bootstraps is not None:
+        returns[:length - n_step_return] += n_step_discount * bootstraps
+    return returns
+
+
+def future_measurements_targets(measurements, next_measurements, num_steps):
+    """
+    Calculate the DFP targets of each step of an episode - the change in the measurements after 1, 2, 4, ...,
+    2^(num_steps-1) steps. The measurements at the end of the episode are used for offsets beyond it.
+    :param measurements: a numpy array with the measurements of the states of the episode
+    :param next_measurements: a numpy array with the measurements of the next states of the episode
+    :param num_steps: the number of future offsets
+    :return: a numpy array of shape (episode length, num_steps, measurements size)
+    """
+    measurements = np.asarray(measurements, dtype='float')
+    next_measurements = np.asarray(next_measurements, dtype='float')
+    length = len(measurements)
+    offsets = np.arange(length)[:, np.newaxis] + 2 ** np.arange(num_steps)[np.newaxis, :]
+    offsets[offsets >= length] = length - 1
+    return next_measurements[offsets] - measurements[:, np.newaxis]
+
+
 class Episode(object):
     def __init__(self):
         self.transitions = []
@@ -73,36 +119,26 @@ class Episode(object):
         if n_step_return == -1 or n_step_return > self.length():
             n_step_return = self.length()
         rewards = np.array([t.reward for t in self.transitions])
-        rewards = rewards.astype('float')
-        total_return = rewards.copy()
-        current_discount = discount
-        for i in range(1, n_step_return):
-            total_return += current_discount * np.pad(rewards[i:], (0, i), 'constant', constant_values=0)
-            current_discount *= discount
 
         # calculate the bootstrapped returns
-        bootstraps = np.array([np.squeeze(t.info['max_action_value']) for t in self.transitions[n_step_return:]])
-        bootstrapped_return = total_return + current_discount * np.pad(bootstraps, (0, n_step_return), 'constant',
-                                                                       constant_values=0)
+        bootstraps = None
         if is_bootstrapped:
-            total_return = bootstrapped_return
+            bootstraps = np.array([np.squeeze(t.info['max_action_value']) for t in self.transitions[n_step_return:]],
+                                  dtype='float')
 
-        for transition_idx in range(self.length()):
-            self.transitions[transition_idx].total_return = total_return[transition_idx]
+        total_return = discounted_returns(rewards, discount, n_step_return, bootstraps)
+        for transition, transition_return in zip(self.transitions, total_return):
+            transition.total_return = transition_return
 
     def update_measurements_targets(self, num_steps):
         if 'measurements' not in self.transitions[0].state:
             return
-        measurements_size = self.transitions[0].state['measurements'].shape[-1]
         total_return = sum([transition.reward for transition in self.transitions])
-        for transition_idx, transition in enumerate(self.transitions):
-            transition.info['future_measurements'] = np.zeros((num_steps, measurements_size))
-            for step in range(num_steps):
-                offset_idx = transition_idx + 2 ** step
-                if offset_idx >= self.length():
-                    offset_idx = -1
-                transition.info['future_measurements'][step] = self.transitions[offset_idx].next_state['measurements'] - \
-                                                               transition.state['measurements']
+        future_measurements = future_measurements_targets(
+            np.array([transition.state['measurements'] for transition in self.transitions]),
+            np.array([transition.next_state['measurements'] for transition in self.transitions]), num_steps)
+        for transition, transition_future_measurements in zip(self.transitions, future_measurements):
+            transition.info['future_measurements'] = transition_future_measurements
             transition.info['total_episode_return'] = total_return
 
     def update_actions_probabilities(self):
@@ -159,3 +195,93 @@ class Transition(object):
         self.next_state = next_state
         self.game_over = game_over
         self.info = {}
+
+
+class BatchBuffers(object):
+    """
+    Assembles a list of transitions into one numpy array per transition field. The arrays are preallocated once and
+    are overwritten by the next batch of the same shape, so the returned arrays are valid only until the next call.
+    """
+    def __init__(self, reuse_buffers=True):
+        """
+        :param reuse_buffers: reuse the arrays between calls. when False, new arrays are allocated for every batch
+        """
+        self.reuse_buffers = reuse_buffers
+        self.buffers = {}
+
+    def get_buffer(self, name, shape, dtype):
+        buffer = self.buffers.get(name)
+        if not self.reuse_buffers or buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype=dtype)
+            self.buffers[name] = buffer
+        return buffer
+
+    def fill_scalars(self, name, values, dtype):
+        buffer = self.get_buffer(name, (len(values),), dtype)
+        buffer[:] = values
+        return buffer
+
+    def fill_arrays(self, name, values):
+        """
+        Copy a list of arrays (or LazyStacks) into a single batch array
+        :param name: the name of the reused buffer
+        :param values: a list of arrays with the same shape or a list of LazyStacks with the same frames shape
+        :return: a numpy array of shape (len(values),) + value shape
+        """
+        first_value = values[0]
+        if isinstance(first_value, LazyStack):
+            frame = np.asarray(first_value.history[0])
+            stack_axis = (first_value.axis or 0) % (frame.ndim + 1)
+            shape = frame.shape[:stack_axis] + (len(first_value.history),) + frame.shape[stack_axis:]
+            dtype = frame.dtype
+        else:
+            first_value = np.asarray(first_value)
+            shape, dtype = first_value.shape, first_value.dtype
+        buffer = self.get_buffer(name, (len(values),) + shape, dtype)
+
+        for i, value in enumerate(values):
+            if isinstance(value, LazyStack):
+                # the frames are copied straight to their place in the batch instead of being stacked first
+                frames = np.moveaxis(buffer[i], stack_axis, 0)
+                for j, frame in enumerate(value.history):
+                    frames[j] = frame
+            else:
+                buffer[i] = value
+        return buffer
+
+    def extract(self, batch, use_measurements=False):
+        """
+        :param batch: a list of transitions
+        :param use_measurements: extract the measurements of the states as well
+        :return: the states and next states dictionaries, the actions, the rewards, the game overs and the total
+                 returns
+        """
+        current_states = {}
+        next_states = {}
+        current_states['observation'] = self.fill_arrays('state/observation',
+                                                         [transition.state['observation'] for transition in batch])
+        next_states['observation'] = self.fill_arrays('next_state/observation',
+                                                      [transition.next_state['observation'] for transition in batch])
+        if use_measurements:
+            current_states['measurements'] = \
+                self.fill_arrays('state/measurements', [transition.state['measurements'] for transition in batch])
+            next_states['measurements'] = \
+                self.fill_arrays('next_state/measurements',
+                                 [transition.next_state['measurements'] for transition in batch])
+
+        actions = [transition.action for transition in batch]
+        action_dtype = np.asarray(actions[0]).dtype
+        if action_dtype.kind in 'biu':
+            actions = self.fill_scalars('action', actions, np.int64)
+        else:
+            actions = self.fill_arrays('action', actions)
+        rewards = self.fill_scalars('reward', [transition.reward for transition in batch], np.float64)
+        game_overs = self.fill_scalars('game_over', [transition.game_over for transition in batch], np.bool_)
+        total_returns = [transition.total_return for transition in batch]
+        if any(total_return is None for total_return in total_returns):
+            # the returns of incomplete episodes are not known yet
+            total_returns = np.array(total_returns)
+        else:
+            total_returns = self.fill_scalars('total_return', total_returns, np.float64)
+
+        return current_states, next_states, actions, rewards, game_overs, total_returns
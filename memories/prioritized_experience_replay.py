@@ -0,0 +1,207 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from memories.columnar_experience_replay import *
+
+
+class SegmentTree(object):
+    """
+    An array based binary tree over a fixed number of leaves, where each node holds the result of applying an
+    associative operation on its two children. All the operations work on a batch of leaves at once and take
+    O(batch size * log(capacity)) time.
+    """
+    def __init__(self, capacity, operation, neutral_element):
+        """
+        :param capacity: the number of leaves in the tree
+        :param operation: a numpy ufunc which is applied on the children of each node (e.g. np.add)
+        :param neutral_element: the value of an empty leaf for the given operation
+        """
+        self.capacity = capacity
+        self.operation = operation
+        self.neutral_element = neutral_element
+        # the number of leaves is rounded up to a power of 2, so that all the leaves are at the same depth
+        self.num_leaves = 1 << max(capacity - 1, 1).bit_length()
+        self.tree = np.full(2 * self.num_leaves, neutral_element, dtype=np.float64)
+
+    def reset(self):
+        self.tree[:] = self.neutral_element
+
+    def update(self, indices, values):
+        """
+        Set the values of the given leaves and update their ancestors
+        :param indices: a numpy array of leaf indices
+        :param values: a numpy array of values or a single value for all the leaves
+        """
+        nodes = np.asarray(indices, dtype=np.int64) + self.num_leaves
+        if len(nodes) == 0:
+            return
+        self.tree[nodes] = values
+        # all the nodes are at the same depth, so they reach the root together. nodes with a common ancestor just
+        # write the same value to it more than once
+        nodes = nodes // 2
+        while True:
+            self.tree[nodes] = self.operation(self.tree[2 * nodes], self.tree[2 * nodes + 1])
+            if nodes[0] == 1:
+                break
+            nodes //= 2
+
+    def get(self, indices):
+        return self.tree[np.asarray(indices, dtype=np.int64) + self.num_leaves]
+
+    def reduce(self):
+        """
+        :return: the result of the operation over all the leaves
+        """
+        return self.tree[1]
+
+
+class SumTree(SegmentTree):
+    def __init__(self, capacity):
+        SegmentTree.__init__(self, capacity, np.add, 0.0)
+
+    def find_prefix_sum_indices(self, prefix_sums):
+        """
+        For each of the given prefix sums, find the first leaf for which the sum of the leaves up to it (including
+        it) is larger than the prefix sum. All the prefix sums are descended through the tree together.
+        :param prefix_sums: a numpy array of values in the range [0, sum of all leaves)
+        :return: a numpy array of leaf indices
+        """
+        prefix_sums = np.array(prefix_sums, dtype=np.float64)
+        nodes = np.ones(len(prefix_sums), dtype=np.int64)
+        while nodes[0] < self.num_leaves:
+            left_children = 2 * nodes
+            left_sums = self.tree[left_children]
+            # numerical errors can make a prefix sum go past the last non empty leaf. going right into an empty
+            # subtree is therefore not allowed
+            go_right = (prefix_sums >= left_sums) & (self.tree[left_children + 1] > 0)
+            prefix_sums = np.where(go_right, prefix_sums - left_sums, prefix_sums)
+            nodes = np.where(go_right, left_children + 1, left_children)
+        return nodes - self.num_leaves
+
+
+class MinTree(SegmentTree):
+    def __init__(self, capacity):
+        SegmentTree.__init__(self, capacity, np.minimum, np.inf)
+
+
+class PrioritizedBatch(ColumnarBatch):
+    """
+    A batch of transitions sampled from a PrioritizedExperienceReplay, along with the memory indices of the
+    transitions and their importance sampling weights
+    """
+    def __init__(self, indices, importance_weights, **columns):
+        ColumnarBatch.__init__(self, **columns)
+        self.indices = indices
+        self.importance_weights = importance_weights
+
+
+# Prioritized Experience Replay - https://arxiv.org/abs/1511.05952
+class PrioritizedExperienceReplay(ColumnarExperienceReplay):
+    """
+    A ColumnarExperienceReplay which samples the transitions proportionally to their priority. The priorities are
+    kept in a sum tree which is indexed by the memory slots, so sampling a batch and updating its priorities takes
+    O(batch size * log(capacity)). New transitions get the maximal priority seen so far once their episode is
+    complete.
+    """
+    def __init__(self, tuning_parameters):
+        """
+        :param tuning_parameters: A Preset class instance with all the running paramaters
+        :type tuning_parameters: Preset
+        """
+        # the trees are created first since a persisted memory is restored by the base class constructor
+        self.sum_tree = SumTree(tuning_parameters.agent.num_transitions_in_experience_replay)
+        self.min_tree = MinTree(tuning_parameters.agent.num_transitions_in_experience_replay)
+        self.max_priority = 1.0
+        ColumnarExperienceReplay.__init__(self, tuning_parameters)
+        self.alpha = tuning_parameters.agent.prioritized_replay_alpha
+        self.initial_beta = tuning_parameters.agent.prioritized_replay_beta
+        self.beta_annealing_steps = tuning_parameters.agent.prioritized_replay_beta_annealing_steps
+        self.epsilon = tuning_parameters.agent.prioritized_replay_epsilon
+        self.num_sampled_batches = 0
+
+    @property
+    def beta(self):
+        # beta is annealed linearly towards 1 so that the updates are fully corrected at the end of the training
+        if self.beta_annealing_steps <= 0:
+            return 1.0
+        progress = min(1.0, self.num_sampled_batches / float(self.beta_annealing_steps))
+        return self.initial_beta + progress * (1.0 - self.initial_beta)
+
+    def sample(self, size):
+        assert self.num_transitions_in_complete_episodes() > size, \
+            'There are not enough transitions in the replay buffer. ' \
+            'Available transitions: {}. Requested transitions: {}.'\
+                .format(self.num_transitions_in_complete_episodes(), size)
+
+        # stratified sampling - a single prefix sum is drawn uniformly from each of size equal segments
+        total_priority = self.sum_tree.reduce()
+        segment_length = total_priority / size
+        prefix_sums = (np.arange(size) + np.random.uniform(size=size)) * segment_length
+        slots = self.sum_tree.find_prefix_sum_indices(prefix_sums)
+
+        # w_i = (N * P(i)) ^ -beta, normalized by the maximal weight which belongs to the minimal priority
+        priorities = self.sum_tree.get(slots)
+        importance_weights = (priorities / self.min_tree.reduce()) ** -self.beta
+        self.num_sampled_batches += 1
+
+        return PrioritizedBatch(slots, importance_weights, **self.gather(slots))
+
+    def update_priorities(self, indices, td_errors):
+        """
+        Update the priorities of sampled transitions according to their new TD errors
+        :param indices: the memory indices of the transitions, as returned in the sampled batch
+        :param td_errors: a numpy array of TD errors (or any other error measure) for the transitions
+        """
+        indices = np.asarray(indices)
+        priorities = (np.abs(td_errors) + self.epsilon) ** self.alpha
+
+        # transitions which were evicted since they were sampled have no priority and should not get one back
+        still_stored = self.sum_tree.get(indices) > 0
+        indices, priorities = indices[still_stored], priorities[still_stored]
+
+        self.sum_tree.update(indices, priorities)
+        self.min_tree.update(indices, priorities)
+        if len(priorities) > 0:
+            self.max_priority = max(self.max_priority, np.max(priorities))
+
+    def clean(self):
+        ColumnarExperienceReplay.clean(self)
+        self.sum_tree.reset()
+        self.min_tree.reset()
+
+    def _close_episode(self, is_bootstrapped=False, n_step_return=-1):
+        first_slot, length = self._episodes[-1]
+        ColumnarExperienceReplay._close_episode(self, is_bootstrapped, n_step_return)
+        # transitions can be sampled only after their episode is complete
+        slots = self._slots(first_slot, length)
+        self.sum_tree.update(slots, self.max_priority)
+        self.min_tree.update(slots, self.max_priority)
+
+    def _restore(self, indices, columns):
+        ColumnarExperienceReplay._restore(self, indices, columns)
+        # the priorities are not persisted, so all the restored transitions start with the maximal priority
+        slots = self._slots(self._tail, self._num_transitions_in_complete_episodes)
+        self.sum_tree.update(slots, self.max_priority)
+        self.min_tree.update(slots, self.max_priority)
+
+    def _evict_oldest_episode(self):
+        self._clear_priorities(*self._episodes[0])
+        ColumnarExperienceReplay._evict_oldest_episode(self)
+
+    def _clear_priorities(self, first_slot, length):
+        slots = self._slots(first_slot, length)
+        self.sum_tree.update(slots, 0.0)
+        self.min_tree.update(slots, np.inf)
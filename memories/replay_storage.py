@@ -0,0 +1,173 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import os
+import zlib
+
+import numpy as np
+
+
+class InMemoryReplayStorage(object):
+    """
+    Allocates the columns of a ColumnarExperienceReplay as regular numpy arrays in the process memory
+    """
+    is_persistent = False
+
+    def __init__(self, tuning_parameters):
+        """
+        :param tuning_parameters: A Preset class instance with all the running paramaters
+        :type tuning_parameters: Preset
+        """
+        pass
+
+    def allocate(self, name, shape, dtype, length):
+        """
+        Allocate the storage of a single column
+        :param name: a unique name for the column
+        :param shape: the shape of a single entry in the column
+        :param dtype: the type of the column entries
+        :param length: the number of entries in the column
+        :return: a numpy array (or an object which behaves like one) with the requested number of entries
+        """
+        return np.zeros((length,) + tuple(shape), dtype=dtype)
+
+    def save_indices(self, indices):
+        """
+        Persist the indices that describe which parts of the columns are in use
+        :param indices: a json serializable dictionary
+        """
+        pass
+
+    def load(self):
+        """
+        Load a previously persisted memory
+        :return: the persisted indices dictionary (or None if there is no persisted memory) and a dictionary of the
+                 persisted columns by their names
+        """
+        return None, {}
+
+
+class MemoryMappedReplayStorage(InMemoryReplayStorage):
+    """
+    Allocates each column of a ColumnarExperienceReplay as a memory mapped .npy file, so that the memory can be larger
+    than the available RAM and the caching of the columns is left to the OS page cache. The memory indices are kept
+    in a small json manifest next to the columns, so the memory can be reopened after the process restarts by pointing
+    agent.replay_storage_path to the same directory.
+    """
+    is_persistent = True
+
+    def __init__(self, tuning_parameters):
+        """
+        :param tuning_parameters: A Preset class instance with all the running paramaters
+        :type tuning_parameters: Preset
+        """
+        InMemoryReplayStorage.__init__(self, tuning_parameters)
+        self.path = tuning_parameters.agent.replay_storage_path
+        if self.path is None:
+            self.path = os.path.join(tuning_parameters.experiment_path, 'replay_buffer')
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self.manifest_path = os.path.join(self.path, 'manifest.json')
+        self.column_files = {}
+
+    def allocate(self, name, shape, dtype, length):
+        if np.dtype(dtype).hasobject:
+            # python objects can't be memory mapped. they are kept in memory and are not persisted
+            return InMemoryReplayStorage.allocate(self, name, shape, dtype, length)
+        file_name = '{}.npy'.format(name.replace('/', '.'))
+        self.column_files[name] = file_name
+        return np.lib.format.open_memmap(os.path.join(self.path, file_name), mode='w+', dtype=dtype,
+                                         shape=(length,) + tuple(shape))
+
+    def save_indices(self, indices):
+        # the manifest is replaced atomically so that a crash will never leave a partially written manifest
+        temp_manifest_path = self.manifest_path + '.tmp'
+        with open(temp_manifest_path, 'w') as f:
+            json.dump({'indices': indices, 'columns': self.column_files}, f)
+        os.replace(temp_manifest_path, self.manifest_path)
+
+    def load(self):
+        if not os.path.exists(self.manifest_path):
+            return None, {}
+        with open(self.manifest_path, 'r') as f:
+            manifest = json.load(f)
+        self.column_files = manifest['columns']
+        columns = {name: np.lib.format.open_memmap(os.path.join(self.path, file_name), mode='r+')
+                   for name, file_name in self.column_files.items()}
+        return manifest['indices'], columns
+
+
+class CompressedColumn(object):
+    """
+    A column of equally shaped arrays which are kept zlib compressed. Entries are compressed one at a time when they
+    are written, and a batch of entries is decompressed at once when it is read. Each of the unique entries in the
+    batch is decompressed only once, and the work is split over a thread pool since zlib releases the GIL.
+    """
+    min_entries_per_thread = 16
+
+    def __init__(self, length, shape, dtype, executor, num_threads, compression_level=1):
+        """
+        :param length: the number of entries in the column
+        :param shape: the shape of a single entry
+        :param dtype: the type of the entries
+        :param executor: a concurrent.futures executor to decompress with
+        :param num_threads: the number of parts to split each batch to
+        :param compression_level: the zlib compression level. 1 is the fastest
+        """
+        self.data = np.empty(length, dtype=object)
+        self.entry_shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.shape = (length,) + self.entry_shape
+        self.executor = executor
+        self.num_threads = num_threads
+        self.compression_level = compression_level
+        # the sizes of the stored entries, before and after compression
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def __setitem__(self, index, value):
+        value = np.ascontiguousarray(value, dtype=self.dtype)
+        compressed_value = zlib.compress(value.tobytes(), self.compression_level)
+        # the sizes count only the entries which are currently stored, so the overwritten entry is subtracted
+        previous_value = self.data[index]
+        if previous_value is not None:
+            self.raw_bytes -= value.nbytes
+            self.compressed_bytes -= len(previous_value)
+        self.data[index] = compressed_value
+        self.raw_bytes += value.nbytes
+        self.compressed_bytes += len(compressed_value)
+
+    def __getitem__(self, indices):
+        indices = np.asarray(indices)
+        unique_indices, inverse_indices = np.unique(indices, return_inverse=True)
+        entries = np.empty((len(unique_indices),) + self.entry_shape, dtype=self.dtype)
+        flat_entries = entries.reshape(len(unique_indices), -1)
+
+        def decompress(part):
+            for i in part:
+                flat_entries[i] = np.frombuffer(zlib.decompress(self.data[unique_indices[i]]), dtype=self.dtype)
+
+        # the batch is split only to parts that are large enough to be worth the thread pool overhead
+        num_parts = min(self.num_threads, len(unique_indices) // self.min_entries_per_thread)
+        if num_parts > 1:
+            list(self.executor.map(decompress, np.array_split(np.arange(len(unique_indices)), num_parts)))
+        else:
+            decompress(range(len(unique_indices)))
+        return entries[inverse_indices].reshape(indices.shape + self.entry_shape)
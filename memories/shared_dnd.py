@@ -0,0 +1,253 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import multiprocessing
+from multiprocessing.connection import Client, Listener, wait
+
+from memories.differentiable_neural_dictionary import *
+
+# the published snapshots are kept in memory backed files when possible, so that loading them only maps their pages
+_SNAPSHOTS_ROOT = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+# older snapshots are kept for a while, since readers might still be loading them
+_NUM_KEPT_SNAPSHOTS = 3
+
+
+def _shared_dnd_directory(shared_dnd_name):
+    return os.path.join(_SNAPSHOTS_ROOT, shared_dnd_name)
+
+
+def _dnd_checkpoint_exists(model_dir):
+    return model_dir is not None and os.path.isdir(model_dir) and \
+        any(s.endswith('.dnd') for s in os.listdir(model_dir))
+
+
+def start_shared_dnd(tuning_parameters):
+    """
+    Start the writer process of a shared DND. This is done by the launcher before the workers start.
+    The workers connect to the writer with a SharedQDND, and send it their inserts. The writer applies the inserts of
+    all the workers in batches, and periodically publishes a snapshot of the dictionaries, which the workers query
+    locally. The writer also saves the dictionaries to the model directory every save_model_sec seconds.
+    :param tuning_parameters: A Preset class instance with all the running paramaters
+    :return: the name of the shared DND, which should be passed to the workers in agent.shared_dnd_name, and the
+             writer process
+    """
+    shared_dnd_name = 'coach_dnd_{}'.format(uuid.uuid4().hex[:8])
+    directory = _shared_dnd_directory(shared_dnd_name)
+    os.makedirs(directory)
+
+    authkey = uuid.uuid4().hex
+    listener = Listener(('localhost', 0), authkey=authkey.encode())
+    service_path = os.path.join(directory, 'service.json')
+    with open(os.open(service_path, os.O_WRONLY | os.O_CREAT, 0o600), 'w') as f:
+        json.dump({'address': list(listener.address), 'authkey': authkey}, f)
+
+    # the writer is forked, so that it inherits the listener which the workers connect to
+    writer = multiprocessing.get_context('fork').Process(
+        target=_run_writer, args=(listener, directory, tuning_parameters.agent.shared_dnd_publish_interval_sec,
+                                  tuning_parameters.checkpoint_restore_dir, tuning_parameters.save_model_dir,
+                                  tuning_parameters.save_model_sec))
+    writer.daemon = True
+    writer.start()
+    listener.close()
+    return shared_dnd_name, writer
+
+
+def stop_shared_dnd(shared_dnd_name, writer):
+    """
+    Stop the writer process of a shared DND and remove its snapshots. This is done by the launcher after the workers
+    exit.
+    """
+    if writer.is_alive():
+        writer.terminate()
+        writer.join()
+    shutil.rmtree(_shared_dnd_directory(shared_dnd_name), ignore_errors=True)
+
+
+def _run_writer(listener, directory, publish_interval_sec, checkpoint_restore_dir, save_model_dir, save_model_sec):
+    dnd = load_dnd(checkpoint_restore_dir) if _dnd_checkpoint_exists(checkpoint_restore_dir) else None
+    version = 0
+    last_publish_time = time.time()
+    last_save_time = time.time()
+    is_changed = dnd is not None
+
+    # the workers are accepted by a separate thread, and the writer waits for messages from all of them
+    connections = []
+
+    def accept_connections():
+        while True:
+            connections.append(listener.accept())
+    threading.Thread(target=accept_connections, daemon=True).start()
+
+    while True:
+        if connections:
+            ready_connections = wait(list(connections), timeout=0.1)
+        else:
+            time.sleep(0.1)
+            ready_connections = []
+
+        additions = []
+        for connection in ready_connections:
+            try:
+                messages = [connection.recv()]
+                while connection.poll():
+                    messages.append(connection.recv())
+            except (EOFError, OSError):
+                # the worker exited
+                connections.remove(connection)
+                continue
+
+            for message in messages:
+                if message[0] == 'create' and dnd is None:
+                    dnd = QDND(**message[1])
+                elif message[0] == 'add':
+                    additions.append(message[1:])
+
+        # the inserts of all the workers are applied with a single insert to each of the dictionaries
+        if dnd is not None and additions:
+            for embeddings, actions, values, used_indices, snapshot_version in additions:
+                # the used entries are indices of the snapshot which the worker queried. entries of older snapshots
+                # might have been replaced since, so they are dropped. entries which were replaced after the latest
+                # snapshot was published are still marked as used, which only delays their replacement
+                if snapshot_version != version:
+                    continue
+                for a, indices in enumerate(used_indices):
+                    dnd.dicts[a]._touch(indices)
+            additions = [addition for addition in additions if len(addition[0]) > 0]
+            if additions:
+                dnd.add(np.concatenate([addition[0] for addition in additions]),
+                        np.concatenate([addition[1] for addition in additions]),
+                        np.concatenate([addition[2] for addition in additions]))
+            is_changed = True
+
+        if is_changed and time.time() - last_publish_time >= publish_interval_sec:
+            version += 1
+            _publish_snapshot(dnd, directory, version)
+            last_publish_time = time.time()
+            is_changed = False
+
+        # this is the only place where the dictionaries are checkpointed, since the workers don't own them
+        if save_model_sec and save_model_dir and dnd is not None and time.time() - last_save_time >= save_model_sec:
+            last_save_time = time.time()
+            dnd.save(os.path.join(save_model_dir, '{}.dnd'.format(int(last_save_time))))
+
+
+def _publish_snapshot(dnd, directory, version):
+    # only the used entries of the dictionaries are saved, so the size of a snapshot grows with the number of entries
+    dnd.save(os.path.join(directory, '{}.dnd'.format(version)))
+    # the version file is replaced atomically, so readers never read a partial version
+    version_path = os.path.join(directory, 'version')
+    with open(version_path + '.tmp', 'w') as f:
+        f.write(str(version))
+    os.replace(version_path + '.tmp', version_path)
+    shutil.rmtree(os.path.join(directory, '{}.dnd'.format(version - _NUM_KEPT_SNAPSHOTS)), ignore_errors=True)
+
+
+class SharedQDND(object):
+    """
+    A QDND which is shared by all the local worker processes of a run. The dictionaries are owned by a single writer
+    process, which is started by start_shared_dnd. Inserts are sent to the writer, which applies the inserts of all
+    the workers in batches, and queries are done locally on the latest published snapshot of the dictionaries. The
+    snapshots are memory mapped, so all the workers share the same pages. The entries which are used by the queries
+    are reported to the writer with the next insert, so that its least recently used entries are the ones which are
+    replaced.
+    """
+    def __init__(self, shared_dnd_name, dict_size, key_width, num_actions, new_value_shift_coefficient=0.1,
+                 key_error_threshold=0.01, learning_rate=0.01, num_query_threads=4, index_type='AnnoyKNNIndex',
+                 refresh_interval_sec=1):
+        """
+        :param shared_dnd_name: the name of the shared DND, which was returned by start_shared_dnd
+        :param refresh_interval_sec: the interval in seconds between checks for a newer snapshot
+        The rest of the parameters are the parameters of the QDND, which is created by the writer when the first worker
+        connects to it.
+        """
+        directory = _shared_dnd_directory(shared_dnd_name)
+        with open(os.path.join(directory, 'service.json'), 'r') as f:
+            service = json.load(f)
+        self.directory = directory
+        self.connection = Client(tuple(service['address']), authkey=service['authkey'].encode())
+        self.connection.send(('create', {
+            'dict_size': dict_size, 'key_width': key_width, 'num_actions': num_actions,
+            'new_value_shift_coefficient': new_value_shift_coefficient, 'key_error_threshold': key_error_threshold,
+            'learning_rate': learning_rate, 'num_query_threads': num_query_threads, 'index_type': index_type
+        }))
+
+        self.key_width = key_width
+        self.num_actions = num_actions
+        self.refresh_interval_sec = refresh_interval_sec
+        self.snapshot = None
+        self.snapshot_version = 0
+        self.last_refresh_time = 0
+        self.used_indices = [[] for _ in range(num_actions)]
+
+    def add(self, embeddings, actions, values):
+        # the inserts are applied by the writer, and become visible to the queries in the next snapshot
+        used_indices = [np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64)
+                        for indices in self.used_indices]
+        self.used_indices = [[] for _ in range(self.num_actions)]
+        self.connection.send(('add', np.array(embeddings).reshape(-1, self.key_width), np.array(actions),
+                              np.array(values), used_indices, self.snapshot_version))
+        return True
+
+    def query_all_actions(self, embeddings, k):
+        """
+        Query the dictionaries of all the actions in the latest snapshot
+        :param embeddings: a batch of embeddings
+        :param k: the number of neighbors to return for each embedding
+        :return: [batch, actions, k, key width] embeddings, [batch, actions, k] values and [batch, actions, k] indices
+                 of the nearest neighbors
+        """
+        self._refresh()
+        if self.snapshot is None:
+            # no snapshot was published yet, which only happens during heatup. these values won't be used
+            return np.zeros((len(embeddings), self.num_actions, k, self.key_width)), \
+                np.zeros((len(embeddings), self.num_actions, k)), \
+                np.zeros((len(embeddings), self.num_actions, k), dtype=np.int64)
+
+        dnd_embeddings, dnd_values, dnd_indices = self.snapshot.query_all_actions(embeddings, k)
+        for a in range(self.num_actions):
+            self.used_indices[a].append(dnd_indices[:, a].reshape(-1))
+        return dnd_embeddings, dnd_values, dnd_indices
+
+    def has_enough_entries(self, k):
+        self._refresh()
+        return self.snapshot is not None and self.snapshot.has_enough_entries(k)
+
+    def save(self, path):
+        # the dictionaries are saved periodically by the writer, which owns them, so the workers don't save them
+        pass
+
+    def _refresh(self):
+        if time.time() - self.last_refresh_time < self.refresh_interval_sec:
+            return
+        self.last_refresh_time = time.time()
+        try:
+            with open(os.path.join(self.directory, 'version'), 'r') as f:
+                version = int(f.read())
+            if version > self.snapshot_version:
+                self.snapshot = QDND.load(os.path.join(self.directory, '{}.dnd'.format(version)))
+                self.snapshot_version = version
+                # the entries which were used in the previous snapshot are not reported anymore
+                self.used_indices = [[] for _ in range(self.num_actions)]
+        except (IOError, OSError, ValueError):
+            # no snapshot was published yet, or the snapshot was replaced while it was loaded
+            pass
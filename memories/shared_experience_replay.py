@@ -0,0 +1,230 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import atexit
+import os
+import time
+import uuid
+
+from memories.columnar_experience_replay import *
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    # shared memory segments are available from python 3.8
+    shared_memory = None
+
+# the fields of each partition in the control segment
+TAIL, NUM_TRANSITIONS_IN_COMPLETE_EPISODES, VERSION = range(3)
+
+
+def _segments_registry_path(experiment_path, shared_replay_name):
+    return os.path.join(experiment_path, '{}.segments'.format(shared_replay_name))
+
+
+def _open_segment(name, size=None):
+    """
+    Create a shared memory segment, or attach to it if it was already created by another process
+    :param name: the name of the segment
+    :param size: the size of the segment in bytes. if None, the segment is only attached to
+    :return: the segment and whether it was created by this call
+    """
+    while True:
+        try:
+            if size is None:
+                raise FileExistsError
+            segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+            created = True
+        except FileExistsError:
+            try:
+                segment = shared_memory.SharedMemory(name=name)
+            except ValueError:
+                # the segment was created by another process, which did not set its size yet
+                time.sleep(0.01)
+                continue
+            created = False
+        # the segments are removed by destroy_shared_replay and not when the process which opened them exits
+        resource_tracker.unregister(segment._name, 'shared_memory')
+        return segment, created
+
+
+def create_shared_replay(experiment_path, num_partitions):
+    """
+    Create the control segment of a SharedExperienceReplay. This is done by the launcher before the workers start.
+    :param experiment_path: the experiment directory, where the names of the shared memory segments are registered
+    :param num_partitions: the number of workers which write to the memory
+    :return: the name of the shared replay, which should be passed to the workers in agent.shared_replay_name
+    """
+    shared_replay_name = 'coach_replay_{}'.format(uuid.uuid4().hex[:8])
+    control_segment_name = '{}_control'.format(shared_replay_name)
+    control_segment, _ = _open_segment(control_segment_name, num_partitions * 3 * np.dtype(np.int64).itemsize)
+    np.ndarray((num_partitions, 3), dtype=np.int64, buffer=control_segment.buf)[:] = 0
+    control_segment.close()
+    with open(_segments_registry_path(experiment_path, shared_replay_name), 'a') as f:
+        f.write(control_segment_name + '\n')
+    return shared_replay_name
+
+
+def destroy_shared_replay(experiment_path, shared_replay_name):
+    """
+    Remove all the shared memory segments of a SharedExperienceReplay. This is done by the launcher after the
+    workers exit.
+    """
+    registry_path = _segments_registry_path(experiment_path, shared_replay_name)
+    if not os.path.exists(registry_path):
+        return
+    with open(registry_path, 'r') as f:
+        segment_names = f.read().split()
+    for segment_name in segment_names:
+        try:
+            segment = shared_memory.SharedMemory(name=segment_name)
+        except FileNotFoundError:
+            continue
+        segment.close()
+        segment.unlink()
+    os.remove(registry_path)
+
+
+class SharedMemoryReplayStorage(InMemoryReplayStorage):
+    """
+    Allocates each column of a SharedExperienceReplay as a shared memory segment that holds the partitions of all the
+    workers. The column segments are created by the first worker which stores the column, and the other workers
+    attach to them. The indices of each partition are published in a control segment which is created by the
+    launcher.
+    """
+    # the indices are not persisted, but they have to be published to the other workers whenever they change
+    is_persistent = True
+
+    def __init__(self, tuning_parameters):
+        """
+        :param tuning_parameters: A Preset class instance with all the running paramaters
+        :type tuning_parameters: Preset
+        """
+        InMemoryReplayStorage.__init__(self, tuning_parameters)
+        assert shared_memory is not None, 'Shared memory replay requires python 3.8 or newer'
+        self.experiment_path = tuning_parameters.experiment_path
+        self.num_partitions = tuning_parameters.num_threads
+        self.partition = getattr(tuning_parameters, 'task_id', 0)
+        self.shared_replay_name = tuning_parameters.agent.shared_replay_name
+        if self.shared_replay_name is None:
+            # not launched by coach.py with multiple workers. the memory is shared with no one
+            self.shared_replay_name = create_shared_replay(self.experiment_path, self.num_partitions)
+            atexit.register(destroy_shared_replay, self.experiment_path, self.shared_replay_name)
+
+        self.segments = []
+        control_segment, _ = _open_segment('{}_control'.format(self.shared_replay_name))
+        self.segments.append(control_segment)
+        self.control = np.ndarray((self.num_partitions, 3), dtype=np.int64, buffer=control_segment.buf)
+        self.full_columns = {}
+
+    def allocate(self, name, shape, dtype, length):
+        # the evaluation worker has no partition, and it never stores transitions
+        assert self.partition < self.num_partitions, 'Worker {} has no partition in the shared memory replay'\
+            .format(self.partition)
+        dtype = np.dtype(dtype)
+        assert not dtype.hasobject, 'Python objects can not be stored in shared memory. Column: {}'.format(name)
+        full_shape = (length * self.num_partitions,) + tuple(shape)
+        segment_name = '{}_{}'.format(self.shared_replay_name, name.replace('/', '.'))
+        segment, created = _open_segment(segment_name, max(int(np.prod(full_shape)) * dtype.itemsize, 1))
+        if created:
+            with open(_segments_registry_path(self.experiment_path, self.shared_replay_name), 'a') as f:
+                f.write(segment_name + '\n')
+        self.segments.append(segment)
+
+        self.full_columns[name] = np.ndarray(full_shape, dtype=dtype, buffer=segment.buf)
+        return self.full_columns[name][self.partition * length:(self.partition + 1) * length]
+
+    def save_indices(self, indices):
+        # the version is changed before the indices, so that readers can tell that the partition was changed while
+        # they were reading from it
+        partition_control = self.control[self.partition]
+        partition_control[VERSION] += 1
+        partition_control[TAIL] = indices['tail']
+        partition_control[NUM_TRANSITIONS_IN_COMPLETE_EPISODES] = indices['num_transitions_in_complete_episodes']
+
+    def partition_indices(self):
+        """
+        :return: a (num partitions, 3) array with the tail, the number of transitions in complete episodes and the
+                 version of each partition
+        """
+        return self.control.copy()
+
+
+class SharedExperienceReplay(ColumnarExperienceReplay):
+    """
+    A ColumnarExperienceReplay which is shared by all the local worker processes of a run. The memory is split to one
+    partition per worker, and agent.num_transitions_in_experience_replay is the total size of all the partitions.
+    Each worker stores transitions only in its own partition, so the write cursors need no locking, but it samples
+    uniformly from the complete episodes of all the partitions.
+    """
+    def __init__(self, tuning_parameters):
+        """
+        :param tuning_parameters: A Preset class instance with all the running paramaters
+        :type tuning_parameters: Preset
+        """
+        assert not tuning_parameters.agent.deduplicate_observation_frames and \
+            not tuning_parameters.agent.compress_observations, \
+            'SharedExperienceReplay does not support deduplicated or compressed observations'
+        ColumnarExperienceReplay.__init__(self, tuning_parameters)
+        # the columns are allocated lazily, so the capacity can still be changed to the partition capacity
+        self.capacity = self.capacity // self.storage.num_partitions
+
+    def _create_storage(self, tuning_parameters):
+        return SharedMemoryReplayStorage(tuning_parameters)
+
+    def sample(self, size):
+        while True:
+            partition_indices = self.storage.partition_indices()
+            num_transitions = partition_indices[:, NUM_TRANSITIONS_IN_COMPLETE_EPISODES]
+            assert num_transitions.sum() > size, \
+                'There are not enough transitions in the replay buffer. ' \
+                'Available transitions: {}. Requested transitions: {}.'.format(num_transitions.sum(), size)
+
+            # the complete episodes of each partition are stored contiguously (modulo the partition capacity)
+            # starting from its tail
+            offsets = np.random.randint(num_transitions.sum(), size=size)
+            partition_ends = np.cumsum(num_transitions)
+            partitions = np.searchsorted(partition_ends, offsets, side='right')
+            offsets -= partition_ends[partitions] - num_transitions[partitions]
+            partition_slots = (partition_indices[partitions, TAIL] + offsets) % self.capacity
+            batch = ColumnarBatch(**self._gather_shared(partitions * self.capacity + partition_slots))
+
+            # the other workers might have evicted some of the sampled transitions while they were gathered. such
+            # batches are sampled again
+            current_partition_indices = self.storage.partition_indices()
+            changed = current_partition_indices[partitions, VERSION] != partition_indices[partitions, VERSION]
+            if not changed.any():
+                return batch
+            current_offsets = (partition_slots - current_partition_indices[partitions, TAIL]) % self.capacity
+            if np.all(current_offsets < current_partition_indices[partitions, NUM_TRANSITIONS_IN_COMPLETE_EPISODES]):
+                return batch
+
+    def _gather_shared(self, slots):
+        """
+        Gather transitions from all the partitions
+        :param slots: a numpy array of slot indices in the full columns
+        :return: a dictionary of the gathered columns, which matches the arguments of ColumnarBatch
+        """
+        full_columns = self.storage.full_columns
+        return {
+            'states': {key: full_columns['state/{}'.format(key)][slots] for key in self.states.keys()},
+            'next_states': {key: full_columns['next_state/{}'.format(key)][slots] for key in self.next_states.keys()},
+            'actions': full_columns['action'][slots],
+            'rewards': full_columns['reward'][slots],
+            'game_overs': full_columns['game_over'][slots],
+            'total_returns': full_columns['total_return'][slots],
+            'info': {key: (full_columns['info/{}'.format(key)][slots], full_columns['info_is_set/{}'.format(key)][slots])
+                     for key in self.info.keys()}
+        }
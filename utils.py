@@ -16,6 +16,8 @@
 
 import json
 import inspect
+import math
+import numbers
 import os
 import numpy as np
 import threading
@@ -183,49 +185,220 @@ def threaded_cmd_line_run(run_cmd, id=-1):
 
 class Signal(object):
     """
-    Stores a stream of values and provides methods like get_mean and get_max
+    Accumulates a stream of values and provides methods like get_mean and get_max
     which returns the statistics about accumulated values.
+    The statistics are updated as the samples arrive, so the memory and the time which they take don't grow with the
+    number of samples. The mean and the variance are accumulated with the parallel form of Welford's algorithm, which
+    merges the statistics of each sample array into the running statistics. When percentiles are requested, a uniform
+    sample of the values is kept in a bounded reservoir for estimating them.
+    Samples can be added from several threads, like the acting and the training threads of an agent.
     """
-    def __init__(self, name):
+    def __init__(self, name, percentiles=(), reservoir_size=1000):
+        """
+        :param name: the name of the signal
+        :param percentiles: the percentiles of the values which are logged, between 0 and 100
+        :param reservoir_size: the number of values which are kept for estimating the percentiles
+        """
         self.name = name
-        self.sample_count = 0
-        self.values = []
+        self.percentiles = tuple(percentiles)
+        self.reservoir_size = reservoir_size if self.percentiles else 0
+        self.reservoir = np.empty(self.reservoir_size, dtype=np.float64)
+        # the reservoir is sampled with its own random state, so that logging doesn't change the runs of seeded agents
+        self.random_state = np.random.RandomState(0)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def __getstate__(self):
+        # locks can't be pickled, and a new one is created when unpickling
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
 
     def reset(self):
+        with self.lock:
+            self._reset()
+
+    def _reset(self):
         self.sample_count = 0
-        self.values = []
+        self.last_sample = None
+        self.mean = 0.0
+        self.sum_squared_deviations = 0.0
+        self.min = np.inf
+        self.max = -np.inf
 
     def add_sample(self, sample):
         """
         :param sample: either a single value or an array of values
         """
-        self.values.append(sample)
-
-    def _get_values(self):
-        if type(self.values[0]) == np.ndarray:
-            return np.concatenate(self.values)
+        with self.lock:
+            self._add_sample(sample)
+
+    def _add_sample(self, sample):
+        self.last_sample = sample
+        if isinstance(sample, numbers.Real) and self.reservoir_size == 0:
+            # welford's update of a single value
+            value = float(sample)
+            self.sample_count += 1
+            delta = value - self.mean
+            self.mean += delta / self.sample_count
+            self.sum_squared_deviations += delta * (value - self.mean)
+            # nan values propagate to the min and the max, like they do with np.min and np.max
+            if value < self.min or value != value:
+                self.min = value
+            if value > self.max or value != value:
+                self.max = value
+            return
+
+        if isinstance(sample, numbers.Real):
+            values = [float(sample)]
+        else:
+            values = np.asarray(sample, dtype=np.float64).ravel()
+            # small arrays, like the action values of a single step, are accumulated much faster as python lists
+            if len(values) <= 64:
+                values = values.tolist()
+        if len(values) == 0:
+            return
+
+        if isinstance(values, list):
+            values_mean = math.fsum(values) / len(values)
+            values_sum_squared_deviations = sum([(value - values_mean) ** 2 for value in values])
+            if values_mean != values_mean:
+                values_min = values_max = values_mean
+            else:
+                values_min, values_max = min(values), max(values)
         else:
-            return self.values
+            values_mean = np.mean(values)
+            values_sum_squared_deviations = np.sum(np.square(values - values_mean))
+            values_min, values_max = np.min(values), np.max(values)
+
+        # merge the statistics of the values into the running statistics
+        count = self.sample_count + len(values)
+        delta = values_mean - self.mean
+        self.mean += delta * len(values) / count
+        self.sum_squared_deviations += values_sum_squared_deviations + \
+            delta ** 2 * self.sample_count * len(values) / count
+        if values_min < self.min or values_min != values_min:
+            self.min = values_min
+        if values_max > self.max or values_max != values_max:
+            self.max = values_max
+        if self.reservoir_size > 0:
+            self._add_to_reservoir(np.asarray(values))
+        self.sample_count = count
+
+    def _add_to_reservoir(self, values):
+        # the first values fill the reservoir, and each of the next ones replaces a random value with a probability of
+        # reservoir_size / (index + 1)
+        num_filling = max(min(self.reservoir_size - self.sample_count, len(values)), 0)
+        self.reservoir[self.sample_count:self.sample_count + num_filling] = values[:num_filling]
+        indices = np.arange(self.sample_count + num_filling, self.sample_count + len(values))
+        if len(indices) > 0:
+            replaced = (self.random_state.random_sample(len(indices)) * (indices + 1)).astype(np.int64)
+            accepted = replaced < self.reservoir_size
+            self.reservoir[replaced[accepted]] = values[num_filling:][accepted]
 
     def get_mean(self):
-        if len(self.values) == 0:
-            return ''
-        return np.mean(self._get_values())
+        with self.lock:
+            if self.sample_count == 0:
+                return ''
+            return self.mean
 
     def get_max(self):
-        if len(self.values) == 0:
-            return ''
-        return np.max(self._get_values())
+        with self.lock:
+            if self.sample_count == 0:
+                return ''
+            return self.max
 
     def get_min(self):
-        if len(self.values) == 0:
-            return ''
-        return np.min(self._get_values())
+        with self.lock:
+            if self.sample_count == 0:
+                return ''
+            return self.min
 
     def get_stdev(self):
-        if len(self.values) == 0:
-            return ''
-        return np.std(self._get_values())
+        with self.lock:
+            if self.sample_count == 0:
+                return ''
+            return np.sqrt(self.sum_squared_deviations / self.sample_count)
+
+    def get_percentile(self, percentile):
+        """
+        :param percentile: the percentile, between 0 and 100. it should be one of the percentiles of the signal
+        :return: the percentile of the values, which is estimated from the reservoir
+        """
+        with self.lock:
+            if self.sample_count == 0 or self.reservoir_size == 0:
+                return ''
+            return np.percentile(self.reservoir[:min(self.sample_count, self.reservoir_size)], percentile)
+
+
+class ReplayRatioController(object):
+    """
+    Keeps the number of training steps per acting step close to a given replay ratio, when an agent acts and trains on
+    separate threads. A thread which gets ahead of the ratio by more than the allowed lag waits for the other thread.
+    """
+    def __init__(self, replay_ratio, max_lag):
+        """
+        :param replay_ratio: the number of training steps per acting step
+        :param max_lag: the number of training steps by which each of the threads may get ahead of the ratio
+        """
+        assert max_lag > 0, 'The replay ratio lag should be positive, otherwise both of the threads would wait'
+        self.replay_ratio = replay_ratio
+        self.max_lag = max_lag
+        self.acting_steps = 0
+        self.training_steps = 0
+        self.stopped = False
+        self.condition = threading.Condition()
+
+    def _training_lag(self):
+        # positive when the training is behind the acting
+        return self.replay_ratio * self.acting_steps - self.training_steps
+
+    def add_acting_steps(self, num_steps):
+        with self.condition:
+            self.acting_steps += num_steps
+            self.condition.notify_all()
+
+    def add_training_steps(self, num_steps):
+        with self.condition:
+            self.training_steps += num_steps
+            self.condition.notify_all()
+
+    def wait_for_acting(self):
+        """
+        Wait until the acting thread may take more steps
+        :return: False if the controller was stopped
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.stopped or self._training_lag() < self.max_lag)
+            return not self.stopped
+
+    def wait_for_training(self):
+        """
+        Wait until the training thread may take more steps
+        :return: False if the controller was stopped
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.stopped or -self._training_lag() < self.max_lag)
+            return not self.stopped
+
+    def get_replay_ratio(self):
+        """
+        :return: the number of training steps per acting step so far
+        """
+        with self.condition:
+            return float(self.training_steps) / max(self.acting_steps, 1)
+
+    def stop(self):
+        """
+        Release the waiting threads. The following waits return False immediately
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
 
 
 def force_list(var):